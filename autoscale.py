@@ -0,0 +1,154 @@
+# autoscale.py - Адаптивна кількість воркерів за пропускною здатністю та пам'яттю
+import sys
+import time
+
+try:
+    import psutil
+except ImportError:  # psutil необов'язковий: на Linux читаємо /proc
+    psutil = None
+
+
+def available_memory_mb():
+    """Available physical memory in MB, or None if it cannot be determined"""
+    if psutil is not None:
+        return psutil.virtual_memory().available / (1024 * 1024)
+    if sys.platform.startswith("linux"):
+        try:
+            with open("/proc/meminfo", encoding="ascii") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            return None
+    if sys.platform == "win32":
+        import ctypes
+
+        class MEMORYSTATUSEX(ctypes.Structure):
+            _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                        ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                        ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                        ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                        ("sullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+        status = MEMORYSTATUSEX()
+        status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+        if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullAvailPhys / (1024 * 1024)
+    return None
+
+
+def process_rss_mb(pid):
+    """Resident memory of a process in MB, or None if unavailable"""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class AdaptiveConcurrency:
+    """
+    Hill-climbing controller for the number of documents rendered in parallel.
+
+    Starts from baseline and every `interval` seconds compares docs/sec with the
+    previous window: it keeps growing while throughput improves, steps back when
+    the last step made it worse, and shrinks whenever worker RSS would exceed the
+    memory budget (memory_limit_mb, or available RAM minus reserve_mb).
+    After stepping back it holds the level for PLATEAU_WINDOWS windows, then
+    probes one step up again, so the target recovers once memory use falls.
+    worker_pids must be the workers rendering the run's documents: idle pool
+    processes are not terminated and a lower target does not shrink their RSS.
+    """
+
+    PLATEAU_WINDOWS = 10
+
+    def __init__(self, baseline, min_workers=1, max_workers=None, memory_limit_mb=None,
+                 reserve_mb=1024, interval=2.0, enabled=True, log_callback=None):
+        self.max_workers = max(1, max_workers or baseline)
+        self.min_workers = max(1, min(min_workers, self.max_workers))
+        self.target = max(self.min_workers, min(baseline, self.max_workers))
+        self.memory_limit_mb = memory_limit_mb
+        self.reserve_mb = reserve_mb
+        self.interval = interval
+        self.enabled = enabled
+        self.log_callback = log_callback or (lambda message: None)
+        self.adjustments = []
+
+        self._window_start = time.time()
+        self._window_done = 0
+        self._last_rate = None
+        self._last_direction = 0
+        self._plateau = 0  # windows left before probing upwards again
+        self._probe = False  # plateau is over: try one step up even if throughput is flat
+
+    def record_completion(self, count=1):
+        self._window_done += count
+
+    def _memory_budget_mb(self, total_rss):
+        if self.memory_limit_mb:
+            return self.memory_limit_mb
+        available = available_memory_mb()
+        if available is None:
+            return None
+        # Budget = what workers already use + what is still free, minus a reserve
+        return total_rss + max(0.0, available - self.reserve_mb)
+
+    def _set_target(self, new_target, reason, rate, total_rss):
+        new_target = max(self.min_workers, min(self.max_workers, new_target))
+        if new_target == self.target:
+            return
+        arrow = "📈" if new_target > self.target else "📉"
+        rss_text = f", workers RSS {total_rss:.0f} MB" if total_rss else ""
+        self.log_callback(
+            f"{arrow} Concurrency {self.target} → {new_target}: {reason} ({rate:.1f} docs/sec{rss_text})")
+        self.adjustments.append({"time": time.time(), "from": self.target, "to": new_target,
+                                 "reason": reason, "rate": rate, "rss_mb": total_rss})
+        self._last_direction = 1 if new_target > self.target else -1
+        self.target = new_target
+
+    def maybe_adjust(self, worker_pids=()):
+        """Re-evaluates concurrency once per interval; returns the current target"""
+        now = time.time()
+        elapsed = now - self._window_start
+        if not self.enabled or elapsed < self.interval:
+            return self.target
+
+        rate = self._window_done / elapsed if elapsed > 0 else 0.0
+        rss_values = [rss for rss in (process_rss_mb(pid) for pid in worker_pids) if rss]
+        total_rss = sum(rss_values)
+        per_worker = total_rss / len(rss_values) if rss_values else 0.0
+        budget = self._memory_budget_mb(total_rss)
+
+        if budget is not None and per_worker and total_rss > budget:
+            self._set_target(max(1, int(budget // per_worker)), "memory pressure", rate, total_rss)
+            self._plateau = self.PLATEAU_WINDOWS
+        elif self._last_rate is not None and self._last_direction > 0 and rate < self._last_rate * 0.95:
+            # The last step up did not pay off: step back and stop probing upwards
+            self._set_target(self.target - 1, "throughput dropped", rate, total_rss)
+            self._plateau = self.PLATEAU_WINDOWS
+        elif not self._plateau and self._window_done:
+            fits = budget is None or not per_worker or total_rss + per_worker <= budget
+            improving = self._last_rate is None or self._probe or rate > self._last_rate * 1.05
+            self._probe = False
+            if fits and improving:
+                self._set_target(self.target + 1, "throughput improving", rate, total_rss)
+            elif not fits:
+                self._plateau = self.PLATEAU_WINDOWS
+            else:
+                self._last_direction = 0
+        elif self._plateau:
+            self._plateau -= 1
+            self._probe = not self._plateau
+
+        self._last_rate = rate
+        self._window_start = now
+        self._window_done = 0
+        return self.target
@@ -32,6 +32,23 @@ def build_exe():
         "--hidden-import=multiprocessing.spawn",  # Для ProcessPoolExecutor
         "--hidden-import=pickle",  # Для серіалізації між процесами
         "--hidden-import=utils",  # Наш модуль utils
+        "--hidden-import=worker_pool",  # Прогрітий пул процесів
+        "--hidden-import=render_worker",  # Легкий модуль рендерингу для воркерів
+        "--hidden-import=autoscale",  # Адаптивна кількість процесів
+        "--hidden-import=distributed",  # Розподілена генерація (координатор)
+        "--hidden-import=streaming",  # Потокове читання великих таблиць
+        "--hidden-import=table_sources",  # Читання csv/parquet/feather/sqlite
+        "--hidden-import=tables",  # Типи колонок і підготовка рядків
+        "--hidden-import=join_engine",  # SQL-з'єднання додаткових таблиць
+        "--hidden-import=docx_writer",  # Швидке збереження DOCX
+        "--hidden-import=log_pipeline",  # Неблокуючий журнал
+        "--hidden-import=output_layout",  # Підпапки виводу та індекс файлів
+        "--hidden-import=metrics",  # Метрики Prometheus для веб-версії
+        "--hidden-import=janitor",  # Фонове прибирання тимчасових файлів
+        "--hidden-import=session_store",  # Сесії веб-версії в SQLite
+        "--hidden-import=upload_extract",  # Фонове розпакування архіву таблиць
+        "--hidden-import=preview",  # Попередній перегляд одного рядка
+        "--hidden-import=preflight",  # Перевірка шаблонів і даних перед генерацією
         "--optimize=2",  # Максимальна оптимізація
         "--strip",  # Видаляємо зайві символи
         "--noupx",  # Відключаємо UPX (може конфліктувати з багатопроцесорністю)
@@ -0,0 +1,274 @@
+# cli.py - Запуск генерації з командного рядка (без PyQt5 та Flask), напр. з cron
+"""
+Headless entry point:
+
+    python -m cli generate --config config.yaml [--workers 8] [--format both]
+    python -m cli worker --coordinator http://host:8765     (see distributed.py)
+
+Progress goes to stdout as JSON lines ({"event": "progress" | "summary" | "error"}),
+human-readable log messages go to stderr. Exit codes: EXIT_* below.
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+EXIT_OK = 0
+EXIT_FAILED_DOCUMENTS = 1  # generation finished, but some rows failed
+EXIT_USAGE = 2  # bad arguments or config (same code as argparse)
+EXIT_NOT_STARTED = 3  # missing files, unreadable tables, unexpected errors
+EXIT_CONVERSION_FAILED = 4
+EXIT_STOPPED = 130  # SIGINT/SIGTERM
+
+SAVE_FORMATS = ("docx", "pdf", "both")
+# Files per LibreOffice call (keeps the command line short)
+PDF_BATCH_SIZE = 200
+DEFAULT_COLUMN = "id"
+# Precision of |floatformat without an argument
+DEFAULT_DECIMAL_PLACES = 2
+
+
+def emit(event, **fields):
+    """Writes one machine-readable JSON line to stdout"""
+    sys.stdout.write(json.dumps({"event": event, **fields}, ensure_ascii=False, default=str) + "\n")
+    sys.stdout.flush()
+
+
+def load_config(path):
+    """Reads config.yaml; relative paths are resolved against the config folder"""
+    import yaml
+
+    with open(path, encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+    if not isinstance(config, dict):
+        raise ValueError(f"{path}: expected a mapping of settings")
+
+    # Only the filters' own default is accepted: a different value would be silently ignored
+    decimal_places = config.get("decimal_places", DEFAULT_DECIMAL_PLACES)
+    if decimal_places != DEFAULT_DECIMAL_PLACES:
+        raise ValueError(f"{path}: decimal_places: {decimal_places} is not supported, numbers are formatted "
+                         f"with {DEFAULT_DECIMAL_PLACES} decimals; set the precision in the template "
+                         f"({{{{ amount_credit|floatformat:{decimal_places} }}}})")
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+
+    def resolve(value, root=base_dir):
+        return value if value is None or os.path.isabs(value) else os.path.join(root, value)
+
+    data_folder = resolve(config.get("data_folder") or ".")
+    templates = config.get("template_path") or "template.docx"
+    if isinstance(templates, str):
+        templates = [templates]
+    return {
+        "root_dir": data_folder,
+        # credits_path is relative to data_folder (main.xlsx lies next to the other tables)
+        "main_path": resolve(config.get("credits_path") or "main.xlsx", data_folder),
+        "template_path": [resolve(template) for template in templates],
+        "output_dir": resolve(config.get("output_dir") or "output_docs"),
+        "save_format": config.get("save_format") or "docx",
+        "common_column": str(config.get("common_column") or DEFAULT_COLUMN),
+        "file_name_column": str(config.get("file_name_column") or DEFAULT_COLUMN),
+        "file_name_patterns": config.get("file_name_patterns"),
+        "output_layout": config.get("output_layout"),
+        "streaming": bool(config.get("streaming", False)),
+        "join_engine": config.get("join_engine"),
+        "table_views": config.get("table_views"),
+        "table_sorts": config.get("table_sorts"),
+        # true / false / strict
+        "preflight": "strict" if config.get("preflight") == "strict" else bool(config.get("preflight", True)),
+    }
+
+
+def convert_to_pdf(docx_files, output_dir, log_callback):
+    """
+    Converts DOCX files to PDF next to them: docx2pdf (MS Word) on Windows/macOS,
+    LibreOffice (soffice --headless) elsewhere. Returns the PDF paths.
+    """
+    if not docx_files:
+        return []
+    if sys.platform in ("win32", "darwin"):
+        from docx2pdf import convert
+        for docx_file in docx_files:
+            convert(docx_file, os.path.splitext(docx_file)[0] + ".pdf")
+    else:
+        soffice = shutil.which("soffice") or shutil.which("libreoffice")
+        if soffice is None:
+            raise RuntimeError("PDF conversion needs LibreOffice (soffice) on this platform")
+        # soffice writes into one --outdir: batches per sub-folder (output_layout)
+        folders = {}
+        for docx_file in docx_files:
+            folders.setdefault(os.path.dirname(docx_file) or output_dir, []).append(docx_file)
+        converted = 0
+        for folder, files in folders.items():
+            for start in range(0, len(files), PDF_BATCH_SIZE):
+                batch = files[start:start + PDF_BATCH_SIZE]
+                subprocess.run([soffice, "--headless", "--convert-to", "pdf", "--outdir", folder, *batch],
+                               check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+                converted += len(batch)
+                log_callback(f"📄 Converted to PDF: {converted}/{len(docx_files)}")
+    pdf_files = [os.path.splitext(docx_file)[0] + ".pdf" for docx_file in docx_files]
+    missing = [path for path in pdf_files if not os.path.exists(path)]
+    if missing:
+        raise RuntimeError(f"{len(missing)} PDF files were not created, e.g. {missing[0]}")
+    return pdf_files
+
+
+def run_generate(args):
+    try:
+        settings = load_config(args.config) if args.config else {}
+    except (OSError, ValueError) as e:
+        emit("error", message=f"Cannot read config: {e}")
+        return EXIT_USAGE
+    # Command-line flags override config.yaml
+    overrides = {"root_dir": args.data_folder, "main_path": args.main, "template_path": args.template,
+                 "output_dir": args.output, "save_format": args.format,
+                 "common_column": args.common_column, "file_name_column": args.file_name_column,
+                 "join_engine": args.join_engine, "output_layout": args.output_layout}
+    settings.update({key: value for key, value in overrides.items() if value})
+    settings.setdefault("common_column", DEFAULT_COLUMN)
+    settings.setdefault("file_name_column", DEFAULT_COLUMN)
+    missing = [key for key in ("root_dir", "main_path", "template_path", "output_dir") if not settings.get(key)]
+    if missing:
+        emit("error", message=f"Missing settings: {', '.join(missing)} (use --config or flags)")
+        return EXIT_USAGE
+    save_format = settings.pop("save_format", "docx")
+    streaming = settings.pop("streaming", False) or args.streaming
+    if args.no_preflight:
+        settings["preflight"] = False
+    elif args.strict_preflight:
+        settings["preflight"] = "strict"
+    if save_format not in SAVE_FORMATS:
+        emit("error", message=f"Unknown save_format '{save_format}', expected one of {', '.join(SAVE_FORMATS)}")
+        return EXIT_USAGE
+
+    stop_event = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop_event.set())
+
+    # Log lines are queued and written to stderr in batches (never blocks generation)
+    from log_pipeline import LogPipeline, stderr_sink
+    log_callback = LogPipeline([] if args.quiet else [stderr_sink])
+    try:
+        return _generate(args, settings, save_format, streaming, stop_event, log_callback)
+    except Exception as e:
+        # A traceback would exit with 1, the code of failed documents
+        log_callback(traceback.format_exc())
+        emit("error", message=f"Generation failed: {e}")
+        return EXIT_NOT_STARTED
+    finally:
+        log_callback.close()
+
+
+def _generate(args, settings, save_format, streaming, stop_event, log_callback):
+    started = time.time()
+
+    def progress(done, total, result):
+        emit("progress", done=done, total=total, index=result.get("index"), success=result.get("success"),
+             files=[os.path.basename(path) for path in result.get("filenames", [])],
+             error=result.get("error"), elapsed=round(time.time() - started, 3))
+
+    # Imported only now: argument errors are reported without loading pandas
+    from generator import generate_documents
+
+    summary = generate_documents(
+        log_callback=log_callback,
+        stop_flag=stop_event.is_set,
+        progress_callback=progress,
+        max_workers=args.workers,
+        autoscale=not args.no_autoscale,
+        document_timeout=args.timeout or None,
+        profile=args.profile,
+        coordinator=args.coordinator,
+        coordinator_token=args.token,
+        shard_size=args.shard_size,
+        local_workers=args.local_workers,
+        streaming=streaming,
+        chunk_size=args.chunk_size or 1000,
+        **settings,
+    )
+    if summary is None:
+        emit("error", message="Generation did not start, see the log")
+        return EXIT_NOT_STARTED
+
+    exit_code = EXIT_OK
+    if summary["stopped"]:
+        exit_code = EXIT_STOPPED
+    elif summary["failed"]:
+        exit_code = EXIT_FAILED_DOCUMENTS
+
+    if save_format != "docx" and not summary["stopped"]:
+        docx_files = summary["files"]
+        if docx_files is None:  # streaming runs do not keep the list in memory
+            from output_layout import read_output_index
+            docx_files = read_output_index(settings["output_dir"])
+        try:
+            summary["pdf_files"] = len(convert_to_pdf(docx_files, settings["output_dir"], log_callback))
+            if save_format == "pdf":
+                for docx_file in docx_files:
+                    os.remove(docx_file)
+        except Exception as e:
+            emit("error", message=f"PDF conversion failed: {e}")
+            exit_code = EXIT_CONVERSION_FAILED
+
+    summary.pop("files", None)
+    emit("summary", exit_code=exit_code, **summary)
+    return exit_code
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Headless DOCX generation")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    generate = subparsers.add_parser("generate", help="generate documents from a config and/or flags")
+    generate.add_argument("--config", help="config.yaml (data_folder, credits_path, template_path, ...)")
+    generate.add_argument("--data-folder", help="folder with main.xlsx and the additional tables")
+    generate.add_argument("--main", help="main table (.xlsx/.csv/.parquet/.feather, data.sqlite[::table])")
+    generate.add_argument("--template", action="append", help="DOCX template; repeat for several")
+    generate.add_argument("--output", help="output folder")
+    generate.add_argument("--format", choices=SAVE_FORMATS, help="save_format override")
+    generate.add_argument("--common-column")
+    generate.add_argument("--file-name-column")
+    generate.add_argument("--workers", type=int, help="maximum worker processes")
+    generate.add_argument("--no-autoscale", action="store_true", help="run --workers documents in parallel")
+    generate.add_argument("--chunk-size", type=int, help="rows read at a time with --streaming")
+    generate.add_argument("--shard-size", type=int, help="rows per lease in distributed mode (--coordinator)")
+    generate.add_argument("--streaming", action="store_true",
+                          help="out-of-core mode for main tables larger than RAM")
+    generate.add_argument("--join-engine", choices=("sqlite", "duckdb"),
+                          help="join additional tables in an in-process database (table_views in config)")
+    generate.add_argument("--output-layout",
+                          help='sub-folders of the output: "hash" or a pattern such as "{region}"')
+    generate.add_argument("--timeout", type=float, default=30, help="seconds per document, 0 disables")
+    generate.add_argument("--coordinator", help="host:port - serve rows to distributed workers")
+    generate.add_argument("--token", default=os.environ.get("DOCGEN_TOKEN"), help="shared secret for workers")
+    generate.add_argument("--local-workers", type=int, default=0, help="distributed workers to start locally")
+    generate.add_argument("--profile", action="store_true", help="per-stage timings in the summary")
+    generate.add_argument("--no-preflight", action="store_true",
+                          help="skip the check of template variables and the sample render before the run")
+    generate.add_argument("--strict-preflight", action="store_true",
+                          help="also stop on template variables that match no column")
+    generate.add_argument("--quiet", action="store_true", help="no log messages on stderr")
+
+    subparsers.add_parser("worker", add_help=False, help="distributed worker (see distributed.py)")
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["worker"]:
+        import distributed
+        return distributed.main(argv)
+    args = build_parser().parse_args(argv)
+    return run_generate(args)
+
+
+if __name__ == "__main__":
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
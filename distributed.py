@@ -0,0 +1,586 @@
+# distributed.py - Розподілена генерація: координатор роздає шарди рядків воркерам по HTTP
+"""
+Coordinator/worker mode for generate_documents (stdlib only: http.server + urllib).
+
+The coordinator splits the rows into shards and serves them over HTTP; a worker
+(`python distributed.py worker --coordinator http://host:8765`) runs a local
+WarmWorkerPool, renders leased rows and sends the DOCX bytes back.
+
+Protocol (JSON, POST, optional X-Auth-Token header):
+  /register {"host", "processes"}           -> {"worker_id", "job"}
+  /lease    {"worker_id"}                   -> {"lease_id", "tasks": [[index, row(, tables)], ...]}
+                                               | {"wait": seconds} | {"done": true}
+  /result   {"worker_id", "lease_id", "results", "complete"}
+                                            -> {"drop": [index, ...], "cancel": bool}
+
+Workers post progress at least every PROGRESS_INTERVAL seconds, which extends
+their lease. Rows of an expired lease (worker died or lost) are requeued, at most
+MAX_CRASH_RETRIES times. An idle worker steals half of the unfinished rows of the
+oldest lease, or duplicates a single straggling row; the first result wins.
+"""
+import argparse
+import base64
+import hmac
+import json
+import os
+import queue
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, time as dt_time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8765
+DEFAULT_SHARD_SIZE = 20
+PROGRESS_INTERVAL = 1.0
+# A lease expires when its worker has not reported for this long (at least)
+LEASE_TIMEOUT = 60
+# An idle worker may steal from a lease running at least this long
+STEAL_AFTER = 5.0
+# Same as generator.MAX_CRASH_RETRIES (not imported: workers must not load pandas)
+MAX_CRASH_RETRIES = 3
+
+
+def _encode_value(val):
+    """json default: datetimes from tables travel as tagged ISO strings"""
+    if isinstance(val, datetime):
+        return {"__datetime__": val.isoformat()}
+    if isinstance(val, date):
+        return {"__date__": val.isoformat()}
+    if isinstance(val, dt_time):
+        return {"__time__": val.isoformat()}
+    return str(val)
+
+
+def _decode_value(obj):
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return date.fromisoformat(obj["__date__"])
+        if "__time__" in obj:
+            return dt_time.fromisoformat(obj["__time__"])
+    return obj
+
+
+def dumps(payload):
+    return json.dumps(payload, default=_encode_value, ensure_ascii=False).encode("utf-8")
+
+
+def loads(data):
+    return json.loads(data.decode("utf-8"), object_hook=_decode_value)
+
+
+def _pack_tables(other_tables):
+    """JSON object keys are strings: per-key aggregates travel as [key, values] pairs"""
+    if not other_tables:
+        return other_tables
+    return {name: {**table, "aggregates_by_key": list(table["aggregates_by_key"].items())}
+            if "aggregates_by_key" in table else table
+            for name, table in other_tables.items()}
+
+
+def _unpack_tables(other_tables):
+    if not other_tables:
+        return other_tables
+    return {name: {**table, "aggregates_by_key": {key: values for key, values in table["aggregates_by_key"]}}
+            if "aggregates_by_key" in table else table
+            for name, table in other_tables.items()}
+
+
+def parse_address(address):
+    """'host:port', 'port' or (host, port) -> (host, port)"""
+    if isinstance(address, (tuple, list)):
+        return address[0], int(address[1])
+    host, _, port = str(address).rpartition(":")
+    return host or "127.0.0.1", int(port or DEFAULT_PORT)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        coordinator = self.server.coordinator
+        token = coordinator.token
+        if token and not hmac.compare_digest(self.headers.get("X-Auth-Token", ""), token):
+            self.send_error(403)
+            return
+        routes = {"/register": coordinator.register, "/lease": coordinator.lease, "/result": coordinator.result}
+        route = routes.get(self.path)
+        if route is None:
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = route(loads(self.rfile.read(length)) if length else {})
+        except Exception as e:
+            coordinator.log_callback(f"⚠️ Coordinator: bad request to {self.path}: {e}")
+            self.send_error(400)
+            return
+        data = body if isinstance(body, bytes) else dumps(body)
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # worker went away; its lease expires and the rows are requeued
+
+    def log_message(self, format, *args):
+        pass  # every lease/progress post would flood the log
+
+
+class Coordinator:
+    """
+    Serves the rows of one generate_documents run to remote workers and feeds
+    their results back to the caller's thread (run() calls on_result).
+
+    tasks: task tuples as built by generate_documents (see render_worker)
+    """
+
+    def __init__(self, tasks, output_dir, address=("127.0.0.1", DEFAULT_PORT), shard_size=DEFAULT_SHARD_SIZE,
+                 token=None, log_callback=None):
+        self.output_dir = output_dir
+        self.token = token
+        self.log_callback = log_callback or (lambda message: None)
+        self.rows = {task[0][0]: task[0][1] for task in tasks}
+        # Output paths assigned by generate_documents (output_layout.py), relative to output_dir
+        self.file_names = {task[0][0]: task[0][2] for task in tasks if len(task[0]) > 2}
+        # join_engine: every task carries only its own table rows, sent with the lease
+        shared_tables = tasks[0][5]
+        self.row_tables = ({task[0][0]: task[5] for task in tasks}
+                           if any(task[5] is not shared_tables for task in tasks) else None)
+        self.host, self.port = parse_address(address)
+
+        _, template_specs, _, common_column, file_name_column, other_tables, main_columns = tasks[0][:7]
+        options = tasks[0][7] if len(tasks[0]) > 7 else {}
+        templates = []
+        for path, pattern in template_specs:
+            with open(path, "rb") as f:
+                templates.append({"name": os.path.basename(path), "pattern": pattern,
+                                  "data": base64.b64encode(f.read()).decode("ascii")})
+        self.timeout = options.get("timeout")
+        # Encoded once: every worker receives the same job
+        self._job = dumps({"templates": templates, "common_column": common_column,
+                     "file_name_column": file_name_column,
+                     "other_tables": None if self.row_tables else _pack_tables(other_tables),
+                     "main_columns": main_columns,
+                     "options": {"profile": options.get("profile", False), "timeout": self.timeout,
+                                 "render_cache": bool(options.get("render_cache"))}})
+
+        indexes = list(self.rows)
+        shard_size = max(1, shard_size or DEFAULT_SHARD_SIZE)
+        self.queue = deque(indexes[i:i + shard_size] for i in range(0, len(indexes), shard_size))
+        self.shards = len(self.queue)
+        self.lease_timeout = max(LEASE_TIMEOUT, 3 * (self.timeout or 0))
+        self.leases = {}  # lease_id -> {"worker", "indexes", "started", "deadline", "drop"}
+        self.finished = set()  # rows with a final result (success or error)
+        self.row_attempts = {}
+        self.workers = {}  # worker_id -> {"host", "processes", "documents"}
+        self.steals = 0
+        self.requeued = 0
+        self.stopping = False
+        self.results = queue.Queue()
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._server = None
+
+    @property
+    def url(self):
+        host = socket.gethostname() if self.host in ("", "0.0.0.0") else self.host
+        return f"http://{host}:{self.port}"
+
+    def _new_id(self, prefix):
+        self._next_id += 1
+        return f"{prefix}{self._next_id}"
+
+    # --- HTTP routes (server threads) ---
+
+    def register(self, payload):
+        with self._lock:
+            worker_id = self._new_id("w")
+            self.workers[worker_id] = {"host": payload.get("host"), "processes": payload.get("processes"),
+                                       "documents": 0}
+        self.log_callback(f"🤝 Worker {worker_id} registered: {payload.get('host')}, "
+                          f"{payload.get('processes')} processes")
+        return b'{"worker_id": ' + dumps(worker_id) + b', "job": ' + self._job + b'}'
+
+    def lease(self, payload):
+        worker_id = payload["worker_id"]
+        with self._lock:
+            if self.stopping or len(self.finished) == len(self.rows):
+                return {"done": True}
+            while self.queue:
+                indexes = [i for i in self.queue.popleft() if i not in self.finished]
+                if indexes:
+                    return self._grant(worker_id, indexes)
+            indexes = self._steal(worker_id)
+            if indexes:
+                return self._grant(worker_id, indexes)
+        return {"wait": PROGRESS_INTERVAL}
+
+    def _grant(self, worker_id, indexes):
+        lease_id = self._new_id("l")
+        now = time.time()
+        self.leases[lease_id] = {"worker": worker_id, "indexes": set(indexes), "started": now,
+                                 "deadline": now + self.lease_timeout, "drop": set()}
+        if self.row_tables:
+            lease = {"lease_id": lease_id,
+                     "tasks": [[index, self.rows[index], self.row_tables[index]] for index in indexes]}
+        else:
+            lease = {"lease_id": lease_id, "tasks": [[index, self.rows[index]] for index in indexes]}
+        if self.file_names:
+            lease["file_names"] = [self.file_names[index] for index in indexes]
+        return lease
+
+    def _steal(self, thief):
+        """Moves half of the unfinished rows of the oldest busy lease to an idle worker"""
+        now = time.time()
+        candidates = [(lease["started"], lease_id) for lease_id, lease in self.leases.items()
+                      if lease["worker"] != thief and now - lease["started"] >= STEAL_AFTER
+                      and lease["indexes"] - self.finished]
+        if not candidates:
+            return None
+        _, victim_id = min(candidates)
+        victim = self.leases[victim_id]
+        remaining = sorted(victim["indexes"] - self.finished)
+        if len(remaining) > 1:
+            stolen = remaining[len(remaining) // 2:]
+            victim["indexes"] -= set(stolen)
+            victim["drop"].update(stolen)
+        else:
+            # Last straggling row: render it speculatively on the idle worker as well
+            stolen = remaining
+            victim["started"] = now  # steal a lone row at most once per STEAL_AFTER
+        self.steals += 1
+        self.log_callback(f"🔀 Work stealing: {len(stolen)} rows of {victim['worker']} → {thief}")
+        return stolen
+
+    def result(self, payload):
+        accepted = []
+        with self._lock:
+            lease = self.leases.get(payload.get("lease_id"))
+            if lease is not None:
+                lease["deadline"] = time.time() + self.lease_timeout
+            for result in payload.get("results", []):
+                index = result["index"]
+                if index in self.finished or result.get("cancelled"):
+                    continue  # duplicate of a stolen row, or cancelled on stop
+                self.finished.add(index)
+                accepted.append(result)
+                for other_id, other in self.leases.items():
+                    if other_id != payload.get("lease_id") and index in other["indexes"]:
+                        other["indexes"].discard(index)
+                        other["drop"].add(index)  # speculative copy is no longer needed
+            worker = self.workers.get(payload.get("worker_id"))
+            if worker is not None:
+                worker["documents"] += sum(1 for result in accepted if result["success"])
+            drop = []
+            if lease is not None:
+                drop = sorted(lease["drop"])
+                lease["drop"].clear()
+                if payload.get("complete"):
+                    del self.leases[payload["lease_id"]]
+            stopping = self.stopping
+
+        # Files are written outside the lock: only the first result of a row gets here
+        for result in accepted:
+            files = result.pop("files", [])
+            if result["success"]:
+                filenames = []
+                names = self.file_names.get(result["index"])
+                for n, item in enumerate(files):
+                    # Own names, never a path sent by the worker
+                    name = names[n] if names and n < len(names) else os.path.basename(item["name"])
+                    filename = os.path.join(self.output_dir, name)
+                    os.makedirs(os.path.dirname(filename), exist_ok=True)
+                    with open(filename, "wb") as f:
+                        f.write(base64.b64decode(item["data"]))
+                    filenames.append(filename)
+                result["filenames"] = filenames
+                result["filename"] = filenames[0] if filenames else None
+            self.results.put(result)
+        return {"drop": drop, "cancel": stopping}
+
+    # --- coordinator thread ---
+
+    def _expire_leases(self):
+        lost = []
+        with self._lock:
+            now = time.time()
+            for lease_id, lease in list(self.leases.items()):
+                if now < lease["deadline"]:
+                    continue
+                del self.leases[lease_id]
+                leased_elsewhere = set().union(*(other["indexes"] for other in self.leases.values()))
+                requeue = []
+                for index in sorted(lease["indexes"] - self.finished - leased_elsewhere):
+                    self.row_attempts[index] = self.row_attempts.get(index, 0) + 1
+                    if self.row_attempts[index] <= MAX_CRASH_RETRIES:
+                        requeue.append(index)
+                    else:
+                        self.finished.add(index)
+                        lost.append(index)
+                if requeue:
+                    self.queue.appendleft(requeue)
+                    self.requeued += len(requeue)
+                self.log_callback(f"♻️ Lease of worker {lease['worker']} expired after "
+                                  f"{self.lease_timeout:.0f} sec without progress, {len(requeue)} rows requeued")
+        for index in lost:
+            self.results.put({"success": False, "index": index,
+                              "error": f"worker lost {MAX_CRASH_RETRIES + 1} times"})
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._server.daemon_threads = True
+        self._server.coordinator = self
+        self.port = self._server.server_address[1]  # port 0 -> the one actually bound
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.log_callback(f"🌐 Coordinator listening on {self.url}: {len(self.rows)} rows in "
+                          f"{self.shards} shards")
+
+    def spawn_local_workers(self, count, processes=None):
+        """Starts worker processes on this machine (for testing on one host)"""
+        command = [sys.executable, os.path.abspath(__file__), "worker",
+                   "--coordinator", f"http://127.0.0.1:{self.port}"]
+        if processes:
+            command += ["--processes", str(processes)]
+        if self.token:
+            command += ["--token", self.token]
+        # Own process group: a killed worker must not leave its pool processes behind
+        kwargs = {"start_new_session": True} if os.name == "posix" else {}
+        return [subprocess.Popen(command, stdout=subprocess.DEVNULL, **kwargs) for _ in range(count)]
+
+    def run(self, on_result, stop_flag, cancel_grace=5.0):
+        """
+        Delivers results to on_result until every row is finished or stop_flag()
+        is set. Returns seconds from the stop request until no lease was left
+        (None if not stopped).
+        """
+        stop_requested = None
+        delivered = 0
+        while delivered < len(self.rows):
+            if stop_requested is None and stop_flag():
+                stop_requested = time.time()
+                self.log_callback("⛔ Stopping all workers...")
+                with self._lock:
+                    self.stopping = True
+            if stop_requested is not None:
+                with self._lock:
+                    idle = not self.leases
+                if idle or time.time() - stop_requested > cancel_grace:
+                    break
+            else:
+                self._expire_leases()
+            try:
+                on_result(self.results.get(timeout=0.5))
+                delivered += 1
+            except queue.Empty:
+                pass
+        while not self.results.empty():
+            on_result(self.results.get())
+        return time.time() - stop_requested if stop_requested is not None else None
+
+    def shutdown(self, local_workers=(), grace=PROGRESS_INTERVAL * 3):
+        """Lets workers see 'done', then stops the server and local workers"""
+        with self._lock:
+            self.stopping = True
+        deadline = time.time() + grace
+        for process in local_workers:
+            try:
+                process.wait(max(0.1, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                process.terminate()
+            if os.name == "posix":
+                try:
+                    os.killpg(process.pid, signal.SIGTERM)
+                except OSError:
+                    pass  # the whole group has already exited
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def stats(self):
+        return {"url": self.url, "shards": self.shards, "steals": self.steals,
+                "requeued_rows": self.requeued, "workers": self.workers}
+
+
+class RemoteWorker:
+    """Worker side: leases rows from a coordinator and renders them with a local pool"""
+
+    def __init__(self, coordinator_url, processes=None, token=None, log_callback=print, connect_timeout=30):
+        self.url = coordinator_url.rstrip("/")
+        self.processes = processes
+        self.token = token
+        self.log_callback = log_callback
+        self.connect_timeout = connect_timeout
+
+    def _post(self, path, payload, retries=3):
+        """POST with retries on connection errors (the coordinator may be starting or busy)"""
+        request = urllib.request.Request(self.url + path, data=dumps(payload), method="POST",
+                                         headers={"Content-Type": "application/json"})
+        if self.token:
+            request.add_header("X-Auth-Token", self.token)
+        for attempt in range(retries + 1):
+            try:
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    return loads(response.read())
+            except urllib.error.HTTPError:
+                raise
+            except (urllib.error.URLError, OSError):
+                if attempt == retries:
+                    raise
+                time.sleep(min(2 ** attempt, 5))
+
+    def _register(self):
+        deadline = time.time() + self.connect_timeout
+        while True:
+            try:
+                return self._post("/register", {"host": socket.gethostname(), "processes": self.processes},
+                                  retries=0)
+            except (urllib.error.URLError, OSError):
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.5)
+
+    def run(self):
+        from render_worker import process_single_document
+        from worker_pool import WarmWorkerPool
+
+        registration = self._register()
+        worker_id, job = registration["worker_id"], registration["job"]
+        job["other_tables"] = _unpack_tables(job["other_tables"])
+        workdir = tempfile.mkdtemp(prefix="docgen_worker_")
+        pool = WarmWorkerPool(max_workers=self.processes, log_callback=self.log_callback)
+        try:
+            template_specs = []
+            for n, template in enumerate(job["templates"]):
+                # Own folder per template: the file name is part of {template}
+                path = os.path.join(workdir, "templates", str(n), template["name"])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.write(base64.b64decode(template["data"]))
+                template_specs.append((path, template["pattern"]))
+            out_dir = os.path.join(workdir, "out")
+            os.makedirs(out_dir, exist_ok=True)
+            if job["options"].get("render_cache"):
+                # Per worker machine, next to the outputs (hits are hardlinked)
+                job["options"]["render_cache"] = os.path.join(workdir, "render_cache")
+                os.makedirs(job["options"]["render_cache"], exist_ok=True)
+            self.log_callback(f"🤝 Registered as {worker_id} at {self.url}")
+            pool.warm_up()
+
+            while True:
+                lease = self._post("/lease", {"worker_id": worker_id})
+                if lease.get("done"):
+                    break
+                if lease.get("wait"):
+                    time.sleep(lease["wait"])
+                    continue
+                slot = pool.begin_run()
+                try:
+                    options = {**job["options"], "cancel_slot": slot}
+                    names = lease.get("file_names") or [None] * len(lease["tasks"])
+                    tasks = [((index, row, file_names) if file_names else (index, row), template_specs, out_dir,
+                              job["common_column"], job["file_name_column"],
+                              tables[0] if tables else job["other_tables"], job["main_columns"], options)
+                             for (index, row, *tables), file_names in zip(lease["tasks"], names)]
+                    self._run_lease(pool, slot, worker_id, lease["lease_id"], tasks, process_single_document)
+                finally:
+                    pool.end_run(slot)
+        finally:
+            pool.shutdown(wait=False)
+            shutil.rmtree(workdir, ignore_errors=True)
+        self.log_callback(f"👋 Worker {worker_id} finished")
+
+    def _run_lease(self, pool, slot, worker_id, lease_id, tasks, render):
+        executor = pool.get_executor()
+        futures = {executor.submit(render, task): (task, executor) for task in tasks}
+        crash_attempts = {}
+        while True:
+            done = wait(list(futures), timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)[0] if futures else ()
+            results = []
+            broken = []
+            for future in done:
+                task, submitted_to = futures.pop(future)
+                if future.cancelled():
+                    continue
+                error = future.exception()
+                if isinstance(error, BrokenProcessPool):
+                    broken.append((task, submitted_to))
+                elif error is not None:
+                    results.append({"success": False, "index": task[0][0], "error": str(error)})
+                else:
+                    results.append(self._pack(future.result()))
+            if broken:
+                # A watchdog killed a worker: timed-out rows are reported, the rest resubmitted;
+                # rows that were only collateral of a timeout kill are not charged a crash attempt
+                timed_out = pool.collect_timeouts(slot)
+                collateral = {submitted_to for _, submitted_to in broken if pool.broke_on_timeout(submitted_to)}
+                for broken_executor in {submitted_to for _, submitted_to in broken}:
+                    executor = pool.restart_if_broken(broken_executor)
+                for task, submitted_to in broken:
+                    index = task[0][0]
+                    if index in timed_out:
+                        results.append({"success": False, "index": index, "timed_out": True,
+                                        "error": f"timed out after {task[7]['timeout']:.0f} sec"})
+                        continue
+                    if submitted_to not in collateral:
+                        crash_attempts[index] = crash_attempts.get(index, 0) + 1
+                    if crash_attempts.get(index, 0) > MAX_CRASH_RETRIES:
+                        results.append({"success": False, "index": index,
+                                        "error": f"worker process died {crash_attempts[index]} times"})
+                    else:
+                        futures[executor.submit(render, task)] = (task, executor)
+
+            reply = self._post("/result", {"worker_id": worker_id, "lease_id": lease_id,
+                                           "results": results, "complete": not futures})
+            if not futures:
+                return
+            dropped = set(reply.get("drop", ()))
+            if reply.get("cancel"):
+                pool.cancel_run(slot)
+                dropped = {task[0][0] for task, _ in futures.values()}
+            for future, (task, _) in list(futures.items()):
+                if task[0][0] in dropped and future.cancel():
+                    del futures[future]
+
+    @staticmethod
+    def _pack(result):
+        """Replaces local output paths with the file bytes for the coordinator"""
+        result.pop("profile_path", None)
+        filenames = result.pop("filenames", None) or ([result["filename"]] if result.get("filename") else [])
+        result.pop("filename", None)
+        files = []
+        for filename in filenames:
+            with open(filename, "rb") as f:
+                files.append({"name": os.path.basename(filename), "data": base64.b64encode(f.read()).decode("ascii")})
+            os.remove(filename)
+        result["files"] = files
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Distributed DOCX generation worker")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker = subparsers.add_parser("worker", help="render rows leased from a coordinator")
+    worker.add_argument("--coordinator", required=True, help="e.g. http://192.168.1.10:8765")
+    worker.add_argument("--processes", type=int, default=None, help="local worker processes")
+    worker.add_argument("--token", default=os.environ.get("DOCGEN_TOKEN"), help="shared secret")
+    args = parser.parse_args(argv)
+    # Terminating the worker still shuts its pool down (finally blocks run)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    RemoteWorker(args.coordinator, processes=args.processes, token=args.token).run()
+
+
+if __name__ == "__main__":
+    main()
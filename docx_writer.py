@@ -0,0 +1,121 @@
+# docx_writer.py - Швидке збереження DOCX: незмінні частини пакета не стискаються повторно
+"""
+Worker-side replacement for DocxTemplate.save.
+
+A DOCX is a zip of many parts (styles, theme, fonts, media), but rendering
+changes only a few of them (document.xml, headers, footers). python-docx
+serializes every part and deflates the whole package again for every document.
+This writer keeps, per worker process and template, the deflated zip entry of
+every part it has written; a part whose bytes are unchanged is copied as the
+raw compressed entry, only changed parts are compressed again.
+
+save_docx() falls back to DocxTemplate.save when the template uses docxtpl's
+media/zip replacements or the installed python-docx lacks the writer API.
+"""
+import os
+import struct
+import time
+import zlib
+
+# template path -> ((mtime, size), {member name: (blob, crc, compressed)})
+_entry_caches = {}
+
+_LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+_CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+_END_RECORD = struct.Struct("<IHHHHIIH")
+_ZIP64_LIMIT = 0xFFFFFFFF
+
+
+def _dos_time(timestamp):
+    t = time.localtime(timestamp)
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class _CachingZipWriter:
+    """PhysPkgWriter interface of python-docx writing deflated entries by hand"""
+
+    def __init__(self, path, entry_cache):
+        self._file = open(path, "wb")
+        self._entry_cache = entry_cache
+        self._central = []
+        self._time, self._date = _dos_time(time.time())
+        self.reused = 0
+
+    def write(self, pack_uri, blob):
+        name = pack_uri.membername
+        cached = self._entry_cache.get(name)
+        if cached is not None and cached[0] == blob:
+            _, crc, compressed = cached
+            self.reused += 1
+        else:
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            compressed = compressor.compress(blob) + compressor.flush()
+            crc = zlib.crc32(blob)
+            if cached is None:
+                # First document of this worker: every part is a candidate for reuse
+                self._entry_cache[name] = (blob, crc, compressed)
+        self._write_entry(name.encode("utf-8"), crc, compressed, len(blob))
+
+    def _write_entry(self, name, crc, compressed, size):
+        offset = self._file.tell()
+        if max(offset, len(compressed), size) >= _ZIP64_LIMIT:
+            raise ValueError("package too large for the fast DOCX writer")
+        self._file.write(_LOCAL_HEADER.pack(0x04034B50, 20, 0x800, 8, self._time, self._date,
+                                            crc, len(compressed), size, len(name), 0))
+        self._file.write(name)
+        self._file.write(compressed)
+        self._central.append(_CENTRAL_HEADER.pack(0x02014B50, 20, 20, 0x800, 8, self._time, self._date,
+                                                  crc, len(compressed), size, len(name), 0, 0, 0, 0, 0, offset)
+                             + name)
+
+    def close(self):
+        try:
+            start = self._file.tell()
+            for header in self._central:
+                self._file.write(header)
+            self._file.write(_END_RECORD.pack(0x06054B50, 0, 0, len(self._central), len(self._central),
+                                              self._file.tell() - start, start, 0))
+        finally:
+            self._file.close()
+
+
+def _entry_cache(template_path):
+    stat = os.stat(template_path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _entry_caches.get(template_path)
+    if cached is None or cached[0] != version:
+        cached = _entry_caches[template_path] = (version, {})
+    return cached[1]
+
+
+def _write_package(tpl, filename):
+    from docx.opc.pkgwriter import PackageWriter
+
+    package = tpl.docx.part.package
+    parts = list(package.parts)
+    for part in parts:
+        part.before_marshal()
+    writer = _CachingZipWriter(filename, _entry_cache(tpl.template_file))
+    try:
+        PackageWriter._write_content_types_stream(writer, parts)
+        PackageWriter._write_pkg_rels(writer, package.rels)
+        PackageWriter._write_parts(writer, parts)
+    finally:
+        writer.close()
+
+
+def save_docx(tpl, filename):
+    """Saves a rendered DocxTemplate like tpl.save(filename), reusing unchanged zip entries"""
+    if (not isinstance(tpl.template_file, (str, os.PathLike)) or tpl.docx is None
+            or tpl.pics_to_replace or tpl.crc_to_new_media or tpl.crc_to_new_embedded or tpl.zipname_to_replace):
+        tpl.save(filename)
+        return
+    try:
+        _write_package(tpl, filename)
+    except (ImportError, AttributeError, ValueError):
+        # Other python-docx version or a huge package: the regular writer
+        if os.path.exists(filename):
+            os.remove(filename)
+        tpl.save(filename)
+        return
+    tpl.is_saved = True
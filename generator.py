@@ -1,536 +1,805 @@
-import glob
+import heapq
+import itertools
 import multiprocessing
 import os
+import shutil
+import string
+import tempfile
 import time
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from datetime import datetime
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, CancelledError, wait
+from concurrent.futures.process import BrokenProcessPool
 
-import jinja2
-import pandas as pd
-from docxtpl import DocxTemplate
-import openpyxl
+from autoscale import AdaptiveConcurrency, available_memory_mb
+from output_layout import OutputLayout, layout_fields
+from preflight import run_preflight
+from render_worker import (DEFAULT_FILE_NAME_PATTERN, MULTI_TEMPLATE_FILE_NAME_PATTERN, PROFILE_STAGES,
+                           StageTimer, document_name, parse_sort, process_single_document)
+from tables import prepare_table, row_record
+from worker_pool import WarmWorkerPool
 
-from utils import format_date, floatformat, is_date_string
 
-
-def smart_read_excel(file_path, log_callback=None):
+def _remove_file_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+# Rough memory model of one worker: interpreter + render stack, plus the unpacked
+# template (lxml trees take roughly 10x the compressed .docx size)
+WORKER_BASE_MB = 200
+TEMPLATE_MEMORY_FACTOR = 10
+MAX_WORKERS_LIMIT = 48
+
+# A row in flight when workers die is resubmitted this many times, then reported as failed
+MAX_CRASH_RETRIES = 3
+# Extra seconds before the parent kills workers whose watchdog did not fire
+STUCK_WORKER_SLACK = 10
+
+
+def estimate_worker_memory_mb(template_paths):
+    """Expected RSS of one worker rendering the given template(s)"""
+    if isinstance(template_paths, (str, os.PathLike)):
+        template_paths = [template_paths]
+    template_mb = 0
+    for path in template_paths:
+        try:
+            # Templates of a row are rendered one after another: the largest one counts
+            template_mb = max(template_mb, os.path.getsize(path) / (1024 * 1024))
+        except OSError:
+            pass
+    return WORKER_BASE_MB + TEMPLATE_MEMORY_FACTOR * template_mb
+
+
+def _template_specs(template_path, file_name_patterns=None):
     """
-    Smart Excel reader that:
-    - Preserves leading zeros for numeric codes
-    - Properly handles dates
-    - Automatically determines data types
+    Normalizes templates to a list of (template_path, file_name_pattern).
+    template_path: one path or a list of paths; file_name_patterns: one pattern
+    for all templates or a list aligned with them (None - default pattern).
     """
-    if log_callback:
-        log_callback(f"🔍 Analyzing file structure: {os.path.basename(file_path)}")
-
-    # Step 1: Analyze source file using openpyxl
-    wb = openpyxl.load_workbook(file_path, data_only=False)
-    ws = wb.active
-
-    # Get headers
-    headers = []
-    for cell in ws[1]:
-        if cell.value is not None:
-            headers.append(str(cell.value).strip())
-        else:
-            headers.append(f"Column_{len(headers)}")
-
-    # Analyze each column
-    text_columns = []
-    date_columns = []
-
-    for col_idx, header in enumerate(headers, 1):
-        sample_values = []
-
-        # Take first 20 non-empty values for analysis
-        for row_idx in range(2, min(ws.max_row + 1, 22)):
-            cell = ws.cell(row=row_idx, column=col_idx)
-            if cell.value is not None:
-                sample_values.append(cell.value)
-            if len(sample_values) >= 10:  # 10 values is enough for analysis
-                break
-
-        if not sample_values:
-            continue
-
-        # Check for leading zeros
-        has_leading_zeros = False
-        for val in sample_values[:5]:  # Check first 5 values
-            if isinstance(val, str):
-                # If string starts with 0 and contains only digits
-                if (val.startswith('0') and len(val) > 1 and val.isdigit()):
-                    has_leading_zeros = True
-                    break
-            elif isinstance(val, (int, float)):
-                # Check if this was originally a string with leading zero
-                # This can be determined by cell format
-                cell = ws.cell(row=2, column=col_idx)  # First data row
-                if cell.number_format.startswith('0') or cell.number_format == '@':
-                    has_leading_zeros = True
-                    break
-
-        # Check for dates
-        is_date_column = False
-        if not has_leading_zeros:  # If this is not a leading zeros column
-            for val in sample_values[:3]:
-                if isinstance(val, datetime):
-                    is_date_column = True
-                    break
-                elif isinstance(val, str):
-                    # Check strings for date similarity
-                    if any(word in header.lower() for word in ['date', 'дата', 'время', 'time', 'created', 'updated']):
-                        is_date_column = True
-                        break
-                    # Or by content
-                    if is_date_string(val):
-                        is_date_column = True
-                        break
-
-        # Save analysis results
-        if has_leading_zeros:
-            text_columns.append(header)
-        elif is_date_column:
-            date_columns.append(header)
-
-    if log_callback:
-        if text_columns:
-            log_callback(f"🔢 Columns with leading zeros: {text_columns}")
-        if date_columns:
-            log_callback(f"📅 Date columns: {date_columns}")
+    paths = [template_path] if isinstance(template_path, (str, os.PathLike)) else list(template_path)
+    if not paths:
+        raise ValueError("No template selected")
+    if file_name_patterns is None or isinstance(file_name_patterns, str):
+        default = DEFAULT_FILE_NAME_PATTERN if len(paths) == 1 else MULTI_TEMPLATE_FILE_NAME_PATTERN
+        patterns = [file_name_patterns or default] * len(paths)
+    else:
+        patterns = list(file_name_patterns)
+        if len(patterns) != len(paths):
+            raise ValueError(f"{len(paths)} templates but {len(patterns)} file name patterns")
+    specs = list(zip(paths, patterns))
+    if len({pattern for _, pattern in specs}) < len(specs) and not all("{template}" in p for _, p in specs):
+        raise ValueError("File name patterns must differ per template or contain {template}")
+    return specs
 
-    # Step 2: Read file with correct types
-    dtype_dict = {}
 
-    # Read leading zeros columns as strings
-    for col in text_columns:
-        dtype_dict[col] = str
+def _pattern_fields(pattern):
+    """Placeholder names used in a file name pattern"""
+    return {field for _, field, _, _ in string.Formatter().parse(pattern) if field}
 
-    # Prepare parameters for pandas
-    read_params = {
-        'io': file_path,
-        'dtype': dtype_dict if dtype_dict else None
-    }
 
-    # If there are date columns, specify them for parsing
-    if date_columns:
-        read_params['parse_dates'] = date_columns
+def get_max_workers():
+    """Ceiling for autoscaling and the size of a shared pool: all CPU cores (at least 2, at most 48)"""
+    return max(2, min(MAX_WORKERS_LIMIT, multiprocessing.cpu_count()))
 
-    # Read file
-    df = pd.read_excel(**read_params)
-    df.columns = df.columns.str.strip()
 
-    return df
-
-
-def get_optimal_workers():
-    """Returns optimal number of worker processes (half of CPU cores)"""
-    cpu_count = multiprocessing.cpu_count()
-    # Use half of cores, but minimum 2 and maximum 8 for stability
-    optimal_workers = max(2, min(48, cpu_count // 2))
-    return optimal_workers
-
-
-def process_single_document(args):
+def get_optimal_workers(per_worker_mb=None):
     """
-    Function for processing single document in separate process.
-    Must be at module top level for pickle serialization.
+    Returns the baseline number of worker processes: half of CPU cores
+    (minimum 2, maximum 48), lowered if free RAM cannot hold per_worker_mb each.
     """
-    try:
-        (row_data, template_path, output_dir, common_column,
-         file_name_column, other_tables, main_columns) = args
-
-        index, borrower_dict = row_data
-
-        # Create Jinja2 environment in each process
-        jinja_env = jinja2.Environment()
-
-        # Define filters directly here to avoid import issues
-        def dateonly_filter(val):
-            """Date only without time"""
-            if pd.isnull(val):
-                return '—'
-
-            try:
-                # First try to convert everything to pandas datetime
-                parsed_date = None
-
-                # If it's already a datetime object
-                if hasattr(val, 'strftime'):
-                    parsed_date = val
-                # If it's a string
-                elif isinstance(val, str):
-                    if is_date_string(val):
-                        parsed_date = pd.to_datetime(val, errors='coerce')
-                    else:
-                        return str(val)  # Doesn't look like a date
-                # If it's a number (timestamp)
-                elif isinstance(val, (int, float)):
-                    parsed_date = pd.to_datetime(val, unit='s', errors='coerce')
-                else:
-                    # Try to convert anything else
-                    parsed_date = pd.to_datetime(val, errors='coerce')
-
-                # If successfully parsed date
-                if parsed_date is not None and pd.notna(parsed_date):
-                    # Format ONLY date without time
-                    if hasattr(parsed_date, 'date'):
-                        return parsed_date.date().strftime('%d.%m.%Y')
-                    else:
-                        return parsed_date.strftime('%d.%m.%Y')
-
-                return str(val)
-
-            except Exception as e:
-                return str(val)
-
-        def datetime_full_filter(val):
-            """Date with time - завжди показує час (навіть 00:00:00)"""
-            if pd.isnull(val):
-                return '—'
-
-            try:
-                parsed_date = None
-
-                # Якщо це вже datetime об'єкт
-                if hasattr(val, 'strftime'):
-                    parsed_date = val
-                # Якщо це рядок
-                elif isinstance(val, str):
-                    if is_date_string(val):
-                        parsed_date = pd.to_datetime(val, errors='coerce')
-                        if pd.isna(parsed_date):
-                            return str(val)
-                    else:
-                        return str(val)
-                # Якщо це число (timestamp)
-                elif isinstance(val, (int, float)):
-                    parsed_date = pd.to_datetime(val, unit='s', errors='coerce')
-                else:
-                    # Спробуємо конвертувати все інше
-                    parsed_date = pd.to_datetime(val, errors='coerce')
-
-                if parsed_date is not None and pd.notna(parsed_date):
-                    # ЗАВЖДИ показуємо дату + час (навіть якщо час 00:00:00)
-                    return parsed_date.strftime('%d.%m.%Y %H:%M:%S')
-
-                return str(val)
-
-            except Exception as e:
-                return str(val)
-
-        def datetime_full_no_sec_filter(val):
-            """Date with time without seconds - завжди показує час (навіть 00:00)"""
-            if pd.isnull(val):
-                return '—'
-
-            try:
-                parsed_date = None
-
-                # Якщо це вже datetime об'єкт
-                if hasattr(val, 'strftime'):
-                    parsed_date = val
-                # Якщо це рядок
-                elif isinstance(val, str):
-                    if is_date_string(val):
-                        parsed_date = pd.to_datetime(val, errors='coerce')
-                        if pd.isna(parsed_date):
-                            return str(val)
-                    else:
-                        return str(val)
-                # Якщо це число (timestamp)
-                elif isinstance(val, (int, float)):
-                    parsed_date = pd.to_datetime(val, unit='s', errors='coerce')
-                else:
-                    # Спробуємо конвертувати все інше
-                    parsed_date = pd.to_datetime(val, errors='coerce')
-
-                if parsed_date is not None and pd.notna(parsed_date):
-                    # ЗАВЖДИ показуємо дату + час без секунд (навіть якщо час 00:00)
-                    return parsed_date.strftime('%d.%m.%Y %H:%M')
-
-                return str(val)
-
-            except Exception as e:
-                return str(val)
-        def number_thousands_filter(val):
-            """Number with thousands separators"""
-            try:
-                if isinstance(val, str):
-                    val = val.replace(' ', '').replace(',', '.')
-                num = float(val)
-                formatted = f"{num:.2f}".replace('.', ',')
-                parts = formatted.split(',')
-                integer_part = parts[0]
-                decimal_part = parts[1] if len(parts) > 1 else ''
-                integer_with_spaces = ''
-                for i, digit in enumerate(reversed(integer_part)):
-                    if i > 0 and i % 3 == 0:
-                        integer_with_spaces = ' ' + integer_with_spaces
-                    integer_with_spaces = digit + integer_with_spaces
-                if decimal_part:
-                    return integer_with_spaces + ',' + decimal_part
-                else:
-                    return integer_with_spaces
-            except Exception:
-                return val
-
-        def currency_uah_filter(val):
-            """Ukrainian hryvnia currency"""
-            try:
-                formatted = number_thousands_filter(val)
-                return f"{formatted} ₴"
-            except Exception:
-                return val
-
-        def currency_usd_filter(val):
-            """US dollar currency"""
-            try:
-                formatted = number_thousands_filter(val)
-                return f"{formatted} $"
-            except Exception:
-                return val
-
-        # Register filters
-        jinja_env.filters['floatformat'] = floatformat
-        jinja_env.filters['dateonly'] = dateonly_filter
-        jinja_env.filters['datetime_full'] = datetime_full_filter
-        jinja_env.filters['datetime_full_no_sec'] = datetime_full_no_sec_filter
-        jinja_env.filters['number_thousands'] = number_thousands_filter
-        jinja_env.filters['currency_uah'] = currency_uah_filter
-        jinja_env.filters['currency_usd'] = currency_usd_filter
-
-        # Additional date filters (synonyms)
-        jinja_env.filters['date'] = dateonly_filter
-        jinja_env.filters['dateformat'] = dateonly_filter
-
-        # Prepare context for template
-        context = {}
-
-        # Add data from main table
-        for col in main_columns:
-            val = borrower_dict.get(col)
-            key = f"{col}_credit"
-
-            # Special handling for dates
-            if val is not None and not pd.isnull(val):
-                # If it's a datetime object, keep it as is
-                if isinstance(val, (pd.Timestamp, datetime)):
-                    context[key] = val
-                # If it's a date string
-                elif isinstance(val, str) and val != "NaT" and is_date_string(val):
-                    try:
-                        parsed_date = pd.to_datetime(val, errors='coerce')
-                        if pd.notna(parsed_date):
-                            context[key] = parsed_date
-                        else:
-                            context[key] = val
-                    except:
-                        context[key] = val
-                else:
-                    context[key] = val
-            else:
-                context[key] = "—"
-
-        # Add data from additional tables
-        for tablename, df_dict in other_tables.items():
-            # Restore DataFrame from dictionary
-            df = pd.DataFrame(df_dict['data'])
-            df.columns = df_dict['columns']
-
-            if common_column not in df.columns:
-                continue
-
-            # Filter by common column
-            borrower_id = borrower_dict.get(common_column)
-            filtered = df[df[common_column] == borrower_id]
-
-            rows = []
-            for _, row in filtered.iterrows():
-                row_dict = {}
-                for col in df.columns:
-                    val = row[col]
-
-                    # Special handling for dates
-                    if val is not None and not pd.isnull(val):
-                        # If it's a datetime object, keep it as is
-                        if isinstance(val, (pd.Timestamp, datetime)):
-                            row_dict[col] = val
-                        # If it's a date string
-                        elif isinstance(val, str) and val != "NaT" and is_date_string(val):
-                            try:
-                                parsed_date = pd.to_datetime(val, errors='coerce')
-                                if pd.notna(parsed_date):
-                                    row_dict[col] = parsed_date
-                                else:
-                                    row_dict[col] = val
-                            except:
-                                row_dict[col] = val
-                        else:
-                            row_dict[col] = val
-                    else:
-                        row_dict[col] = "—"
-                rows.append(row_dict)
-            context[f"{tablename}_table"] = rows
-
-        # Document generation
-        tpl = DocxTemplate(template_path)
-        tpl.render(context, jinja_env)
+    cpu_count = multiprocessing.cpu_count()
+    # Use half of cores, but minimum 2 and maximum 48 for stability
+    optimal_workers = max(2, min(MAX_WORKERS_LIMIT, cpu_count // 2))
+    if per_worker_mb:
+        available = available_memory_mb()
+        if available:
+            optimal_workers = max(1, min(optimal_workers, int(available // per_worker_mb)))
+    return optimal_workers
 
-        # Create filename
-        safe_name = str(borrower_dict.get(file_name_column, borrower_dict.get(common_column, f"doc_{index}"))).replace(
-            " ", "_")
-        # Remove unsafe characters from filename
-        safe_name = "".join(c for c in safe_name if c.isalnum() or c in ('-', '_', '.'))
 
-        docx_filename = os.path.join(output_dir, f"doc_{safe_name}.docx")
-        tpl.save(docx_filename)
+def _percentile(sorted_values, pct):
+    """Percentile with linear interpolation over an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    position = (len(sorted_values) - 1) * pct / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    fraction = position - lower
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * fraction
 
-        return {"success": True, "filename": docx_filename, "index": index}
 
-    except Exception as e:
-        return {"success": False, "error": str(e), "index": index}
+def summarize_stage_timings(stage_samples):
+    """
+    Aggregates per-document stage timings into percentile statistics.
+    stage_samples: {stage: [seconds, ...]}
+    Returns {stage: {"count", "mean", "p50", "p95", "p99", "max"}} in seconds.
+    """
+    summary = {}
+    for stage in list(PROFILE_STAGES) + sorted(set(stage_samples) - set(PROFILE_STAGES)):
+        values = sorted(stage_samples.get(stage, []))
+        if not values:
+            continue
+        summary[stage] = {
+            "count": len(values),
+            "mean": sum(values) / len(values),
+            "p50": _percentile(values, 50),
+            "p95": _percentile(values, 95),
+            "p99": _percentile(values, 99),
+            "max": values[-1],
+        }
+    return summary
+
+
+def _log_stage_summary(stage_summary, log_callback):
+    """Logs per-stage percentiles as a compact table (milliseconds)"""
+    if not stage_summary:
+        return
+    log_callback("⏱️ Stage timings per document (ms):")
+    log_callback(f"   {'stage':<8} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for stage, stats in stage_summary.items():
+        log_callback(
+            f"   {stage:<8} {stats['p50'] * 1000:>9.1f} {stats['p95'] * 1000:>9.1f} "
+            f"{stats['p99'] * 1000:>9.1f} {stats['max'] * 1000:>9.1f}")
+
+
+def _cancel_in_flight(pool, cancel_slot, pending, handle_result, grace, owns_pool, log_callback):
+    """
+    Stops a run: no new tasks, queued tasks cancelled, workers signalled through
+    the shared flag, and workers still busy after `grace` seconds are killed. With a
+    shared pool serving other runs they get another `grace` and are then detached.
+    Returns (seconds from the stop request until no document of the run is running
+    or the rest was detached, number of documents abandoned by killing or detaching them).
+    """
+    requested = time.time()
+    log_callback("⛔ Stopping all processes...")
+    pool.cancel_run(cancel_slot)
+    for future in pending:
+        future.cancel()
+
+    done, not_done = wait(pending, timeout=grace)
+    for future in done:
+        handle_result(future)
+
+    abandoned = 0
+    if not_done:
+        if pool.active_runs > 1:
+            log_callback(f"⚠️ {len(not_done)} documents still rendering; the shared pool serves "
+                         f"other runs, so workers are not killed")
+            done, not_done = wait(not_done, timeout=grace)
+            for future in done:
+                handle_result(future)
+            if not_done:
+                # Detached: their workers drop them at the next cancel check point
+                log_callback(f"⚠️ {len(not_done)} documents detached after another {grace:.0f} sec, "
+                             f"their results are discarded")
+                abandoned = len(not_done)
+        else:
+            log_callback(f"💀 Killing workers: {len(not_done)} documents still rendering after {grace:.0f} sec")
+            pool.terminate_workers(restart=not owns_pool)
+            if not owns_pool:
+                pool.warm_up_async()
+            abandoned = len(not_done)
+
+    stop_to_idle = time.time() - requested
+    if not_done and pool.active_runs > 1:
+        log_callback(f"⛔ Run released {stop_to_idle:.1f} sec after the stop request")
+    else:
+        log_callback(f"⛔ All workers idle {stop_to_idle:.1f} sec after the stop request")
+    return stop_to_idle, abandoned
+
+
+def _log_worker_startup(startup, log_callback):
+    """Logs how long workers needed before they could render"""
+    if startup["first_result_after"] is None:
+        return
+    if startup["cold_workers"]:
+        log_callback(
+            f"🚀 Worker startup: {startup['cold_workers']} cold workers, render stack import "
+            f"avg {startup['import_seconds_avg'] * 1000:.0f} ms / max {startup['import_seconds_max'] * 1000:.0f} ms, "
+            f"first document after {startup['first_result_after']:.2f} sec")
+    else:
+        log_callback(f"🚀 All workers were warm, first document after {startup['first_result_after']:.2f} sec")
 
 
 def generate_documents(root_dir, main_path, template_path, output_dir,
-                       common_column, file_name_column, log_callback, stop_flag):
+                       common_column, file_name_column, log_callback, stop_flag,
+                       profile=False, profile_dump_dir=None, profile_top_n=5, pool=None,
+                       max_workers=None, autoscale=True, memory_limit_mb=None, cancel_grace=5.0,
+                       document_timeout=30, timeout_retries=1, timeout_backoff=2.0, file_name_patterns=None,
+                       coordinator=None, coordinator_token=None, shard_size=None, local_workers=0,
+                       progress_callback=None, streaming=False, chunk_size=1000, join_engine=None,
+                       table_views=None, table_sorts=None, render_cache=True, output_layout=None,
+                       metrics=None, table_sources=None, preflight=True):
+    """
+    Generates one DOCX per row of the main table and template.
+
+    template_path: one template or a list of templates; each row's context and
+    tables are prepared once and all templates are rendered in the same worker task
+    file_name_patterns: output name pattern (or a list, one per template) with
+    {name} (file_name_column value), {template} (template file name), {index} and
+    main table columns; default "doc_{name}.docx", "{template}_{name}.docx" for
+    several templates. A pattern may contain "/" ("{region}/{id}.docx").
+    output_layout: sub-folders for very large batches - None (flat), "hash" (256
+    hash-prefix folders) or a folder pattern such as "{region}" or "{region}/{shard}".
+    Names are assigned in this process; duplicates get "_<index>" instead of
+    overwriting, and output_dir/output_index.csv maps rows to files (see output_layout.py)
+
+    max_workers: ceiling for parallel processes (default: all cores, at most 48;
+    with a pool - its size)
+    autoscale: start from get_optimal_workers() and adapt concurrency to measured
+    docs/sec and worker RSS; False runs max_workers documents in parallel
+    memory_limit_mb: RSS budget for all workers (default: available RAM minus a reserve)
+    cancel_grace: seconds running documents get to reach a cancel check point after
+    stop; then busy workers are killed (unless a shared pool serves other runs)
+    document_timeout: seconds one document may render (per template of a row); enforced by a watchdog inside
+    the worker, which kills its process; the pool is restarted and the other in-flight
+    documents, of this or another run, are resubmitted without counting as crashes.
+    None disables it.
+    timeout_retries / timeout_backoff: how many times a timed-out row is retried
+    at the end of the queue, each time with the timeout multiplied by the backoff
+
+    coordinator: "host:port" to serve rows to distributed workers instead of the local
+    pool (`python distributed.py worker --coordinator http://host:port`);
+    coordinator_token: shared secret the workers must send; shard_size: rows per
+    lease; local_workers: worker processes to start on this machine (testing)
+
+    render_cache: rows whose template and referenced context are identical (e.g.
+    re-issued notices) are rendered once; the other outputs are hardlinked (or copied)
+    from a content-addressed cache kept in output_dir for the duration of the run
+
+    pool: optional WarmWorkerPool owned by the caller; reused instead of creating
+    a new ProcessPoolExecutor for this run (it is not shut down afterwards)
+
+    streaming: out-of-core mode for main tables that do not fit in RAM: main rows are
+    read chunk_size at a time (openpyxl read_only, or .csv) and additional tables
+    are looked up through an on-disk SQLite index (see streaming.py).
+    Not combinable with coordinator.
+
+    join_engine: "sqlite" or "duckdb" - load the additional tables into an in-process
+    database indexed by common_column and send every task only its own rows (see
+    join_engine.py); table_views: {table: "SELECT ..."} filters/sorts tables at load
+    time (needs join_engine). Streaming mode always joins through its on-disk index.
+
+    Every {table}_table also gets per-row aggregates of its numeric columns, computed
+    once when the tables are loaded: {table}_table_count, {table}_table_sum_<col>,
+    _min_<col>, _max_<col>. table_sorts: {table: ["date", "-sum"]} adds pre-sorted
+    lists {table}_table_by_date, {table}_table_by_sum_desc.
+
+    Tables may be .xlsx, .csv, .parquet, .feather or SQLite files (see table_sources);
+    main_path "data.sqlite::table" picks the main table of an SQLite file.
+    table_sources: iterable of (name, path, sqlite_table) used instead of scanning
+    root_dir; it may yield tables while they are still being extracted (see
+    upload_extract.py), they are read in that order as soon as they arrive.
+
+    preflight: before any worker starts, check template syntax, variables and table
+    loop fields against the loaded columns and render the first row in a worker (with
+    document_timeout and stop_flag); errors stop the run with a report (see preflight.py). Summary key "preflight".
+    "strict" also stops on variables that match no column or table (otherwise a warning).
+
+    progress_callback: optional callable(done, total, result) invoked after every
+    finished row (for machine-readable progress; log_callback stays human-readable)
+    metrics: optional metrics.JobMetrics fed with the job start, every finished row
+    (per-stage timings are collected for it) and the number of rows in flight
+
+    profile: collect per-stage timings in workers and log p50/p95/p99 in the summary
+    profile_dump_dir: folder for cProfile stats (.prof) of the slowest profile_top_n documents
+    Returns summary dict (None if generation did not start).
+    """
+    index_dir = None
+    cache_dir = None
+    layout = None
+    private_pool = None
     try:
         # Determine number of worker processes
-        max_workers = get_optimal_workers()
+        if pool is not None:
+            max_workers = pool.max_workers
+        elif not max_workers:
+            max_workers = get_optimal_workers()
+            if autoscale:
+                max_workers = max(max_workers, get_max_workers())
+        try:
+            template_specs = _template_specs(template_path, file_name_patterns)
+        except ValueError as e:
+            log_callback(f"❌ Error: {e}")
+            return
+        template_paths = [path for path, _ in template_specs]
+        baseline = min(max_workers, get_optimal_workers(estimate_worker_memory_mb(template_paths)))
+        scaler = AdaptiveConcurrency(
+            baseline=baseline if autoscale else max_workers,
+            max_workers=max_workers,
+            memory_limit_mb=memory_limit_mb,
+            enabled=autoscale,
+            log_callback=log_callback,
+        )
         log_callback(f"=== Starting DOCX generation ===")
-        log_callback(f"💻 Using {max_workers} processes out of {multiprocessing.cpu_count()} available cores")
+        if autoscale:
+            log_callback(f"💻 Starting with {scaler.target} processes, autoscaling up to {max_workers} "
+                         f"({multiprocessing.cpu_count()} cores available)")
+        else:
+            log_callback(f"💻 Using {max_workers} processes out of {multiprocessing.cpu_count()} available cores")
 
-        if not all([os.path.exists(main_path), os.path.exists(template_path), os.path.isdir(root_dir)]):
+        if not all([os.path.exists(main_path.partition("::")[0]), os.path.isdir(root_dir)] +
+                   [os.path.exists(path) for path in template_paths]):
             log_callback("❌ Error: Check all file paths!")
             return
+        if len(template_specs) > 1:
+            log_callback(f"📑 {len(template_specs)} templates per row: "
+                         f"{', '.join(os.path.basename(path) for path in template_paths)}")
 
-        os.makedirs(output_dir, exist_ok=True)
+        if streaming and coordinator:
+            log_callback("❌ Error: streaming mode cannot be combined with distributed workers")
+            return
+        if table_views and (streaming or not join_engine):
+            log_callback("❌ Error: table_views need join_engine ('sqlite' or 'duckdb') and no streaming")
+            return
 
-        # Read main table with smart analysis
-        log_callback("📖 Reading main table...")
-        main_df = smart_read_excel(main_path, log_callback)
+        os.makedirs(output_dir, exist_ok=True)
+        if profile_dump_dir:
+            os.makedirs(profile_dump_dir, exist_ok=True)
+        task_options = {"profile": bool(profile or profile_dump_dir or metrics), "profile_dir": profile_dump_dir}
+        # The watchdog covers a whole task: all templates of the row (local and distributed workers)
+        task_options["timeout"] = document_timeout * len(template_specs) if document_timeout else document_timeout
+        if render_cache:
+            # Inside output_dir: same file system, so cache hits can be hardlinked
+            cache_dir = tempfile.mkdtemp(prefix=".render_cache_", dir=output_dir)
+            task_options["render_cache"] = cache_dir
+
+        # Additional tables: every supported file in root_dir (see table_sources) or the caller's sources
+        from table_sources import discover_sources, read_main_table, read_source
+        other_sources = discover_sources(root_dir, main_path) if table_sources is None else table_sources
+        table_load_seconds = {}
+        table_sniff_seconds = {}  # column typing part of the load time (xlsx)
+        joiner = None
+
+        def make_task(i, row_dict):
+            name = document_name(row_dict, file_name_column, common_column, i)
+            return (
+                (i, row_dict, layout.names_for(i, row_dict, name)),
+                template_specs,
+                output_dir,
+                common_column,
+                file_name_column,
+                joiner.rows_for(row_dict.get(common_column)) if joiner else other_tables,
+                main_columns,
+                task_options
+            )
 
-        # Read additional tables
-        log_callback("📖 Reading additional tables...")
-        all_xlsx = glob.glob(os.path.join(root_dir, "*.xlsx"))
-        other_xlsx = [f for f in all_xlsx if os.path.abspath(f) != os.path.abspath(main_path)]
-        other_tables = {}
+        if streaming:
+            from streaming import build_table_index, iter_chunks, open_table_stream
 
-        for fname in other_xlsx:
-            if stop_flag():
+            # Additional tables go to an on-disk index; workers look rows up by common_column
+            log_callback("📖 Indexing additional tables...")
+            index_dir = tempfile.mkdtemp(prefix="docgen_index_")
+            other_tables = build_table_index(os.path.join(index_dir, "tables.sqlite"), other_sources, common_column,
+                                             log_callback, stop_flag, chunk_size, table_load_seconds)
+            if other_tables is None:
                 log_callback("⛔ Generation stopped by user.")
                 return
+            # Rows of one document are sorted by the worker
+            for name, table in other_tables.items():
+                table["sorts"] = list((table_sorts or {}).get(name, ()))
+
+            # Main rows are read chunk by chunk while the scheduler consumes tasks
+            log_callback("📖 Streaming main table...")
+            main_columns, main_rows, total_tasks = open_table_stream(main_path, log_callback, dates_as_text=True)
+            if total_tasks:
+                log_callback(f"📊 About {total_tasks} records to process, reading {chunk_size} at a time")
+            else:
+                log_callback(f"📊 Reading records {chunk_size} at a time")
 
-            name = os.path.splitext(os.path.basename(fname))[0].lower()
-            # Smart reading for additional tables
-            df = smart_read_excel(fname, log_callback)
+            def stream_tasks():
+                i = 0
+                for chunk in iter_chunks(main_rows, chunk_size):
+                    for row_dict in chunk:
+                        yield make_task(i, row_dict)
+                        i += 1
 
-            # Convert DataFrame to serializable format
-            other_tables[name] = {
-                'data': df.to_dict('records'),
-                'columns': df.columns.tolist()
-            }
-            log_callback(f"✓ Loaded table: {name} ({len(df)} records)")
+            tasks = stream_tasks()
+        else:
+            # Read main table with smart analysis
+            log_callback("📖 Reading main table...")
+            main_df, table_load_seconds["main"] = read_main_table(main_path, log_callback)
+            table_sniff_seconds["main"] = main_df.attrs.get("sniff_seconds")
+
+            # Read additional tables
+            log_callback("📖 Reading additional tables...")
+            other_tables = {}
+            if join_engine:
+                from join_engine import TableJoiner
+                try:
+                    joiner = TableJoiner(common_column, join_engine, table_views, log_callback, table_sorts)
+                except (ImportError, ValueError) as e:
+                    log_callback(f"❌ Error: {e}")
+                    return
 
-        log_callback(f"📊 Found {len(main_df)} records to process")
-        log_callback(f"🚀 Starting {max_workers} parallel processes...")
+            for name, source_path, sql_table in other_sources:
+                if stop_flag():
+                    log_callback("⛔ Generation stopped by user.")
+                    return
+
+                # Smart reading for additional tables
+                df, table_load_seconds[name] = read_source(source_path, sql_table, log_callback)
+                table_sniff_seconds[name] = df.attrs.get("sniff_seconds")
+
+                if joiner:
+                    joiner.add_table(name, df)
+                else:
+                    other_tables[name] = prepare_table(df, common_column, (table_sorts or {}).get(name, ()))
+                log_callback(f"✓ Loaded table: {name} ({len(df)} records, {table_load_seconds[name]:.2f} sec)")
+
+            if joiner:
+                # One grouped query per table: tasks carry only their own rows
+                try:
+                    for name, seconds in joiner.build().items():
+                        table_load_seconds[name] += seconds
+                except Exception as e:
+                    log_callback(f"❌ Error in join engine: {e}")
+                    return
+                finally:
+                    joiner.close()
+
+            log_callback(f"📊 Found {len(main_df)} records to process "
+                         f"(main table read in {table_load_seconds['main']:.2f} sec)")
+            main_columns = main_df.columns.tolist()
+
+        table_columns = joiner.grouped if joiner else other_tables
+        for name, specs in (table_sorts or {}).items():
+            if name not in table_columns:
+                log_callback(f"❌ Error: table_sorts for unknown table '{name}'")
+                return
+            unknown = {parse_sort(spec)[0] for spec in specs} - set(table_columns[name]["columns"])
+            if unknown:
+                log_callback(f"❌ Error: table_sorts['{name}']: unknown columns {', '.join(sorted(unknown))}")
+                return
+
+        log_callback(f"🚀 Starting {scaler.target} parallel processes...")
 
         # Prepare data for parallel processing
-        main_columns = main_df.columns.tolist()
+        known_fields = set(main_columns) | {"name", "template", "index"}
+        for _, pattern in template_specs:
+            unknown = _pattern_fields(pattern) - known_fields
+            if unknown:
+                log_callback(f"❌ Error: unknown fields in file name pattern '{pattern}': {', '.join(sorted(unknown))}")
+                return
+        unknown = layout_fields(output_layout) - known_fields - {"shard"}
+        if unknown:
+            log_callback(f"❌ Error: unknown fields in output_layout '{output_layout}': {', '.join(sorted(unknown))}")
+            return
+        layout = OutputLayout(output_dir, template_specs, output_layout, log_callback)
 
-        # Convert rows to dictionaries for serialization
-        tasks = []
-        for i, (_, row) in enumerate(main_df.iterrows()):
-            if stop_flag():
-                break
-
-            row_dict = row.to_dict()
-            # Convert datetime objects to strings for serialization, but preserve type info
-            for key, val in row_dict.items():
-                if isinstance(val, (pd.Timestamp, datetime)):
-                    row_dict[key] = val.isoformat()
-                elif pd.isna(val):
-                    row_dict[key] = None
-
-            task_args = (
-                (i, row_dict),
-                template_path,
-                output_dir,
-                common_column,
-                file_name_column,
-                other_tables,
-                main_columns
-            )
-            tasks.append(task_args)
+        if not streaming:
+            # Convert rows to dictionaries for serialization
+            tasks = []
+            for i, (_, row) in enumerate(main_df.iterrows()):
+                if stop_flag():
+                    break
+
+                tasks.append(make_task(i, row_record(row)))
+            total_tasks = len(tasks)
+        total_label = total_tasks or "?"
 
         if stop_flag():
             log_callback("⛔ Generation stopped by user.")
             return
 
+        preflight_report = None
+        if preflight:
+            log_callback("🔎 Pre-flight check of templates and data...")
+            if streaming:
+                sample_task = next(tasks, None)
+                if sample_task is not None:
+                    tasks = itertools.chain([sample_task], tasks)
+            else:
+                sample_task = tasks[0] if tasks else None
+            if joiner:
+                table_schemas = {name: joiner.grouped.get(name) or {"columns": table["columns"]}
+                                 for name, table in joiner.tables.items()}
+            else:
+                table_schemas = other_tables
+            sample_pool = pool
+            if sample_pool is None:
+                # The run's own pool, started here and reused by the local branch
+                private_pool = WarmWorkerPool(max_workers=1 if coordinator else max_workers, log_callback=log_callback)
+                sample_pool = private_pool
+            preflight_report = run_preflight(template_paths, main_columns, table_schemas, common_column, sample_task,
+                                             strict=preflight == "strict", pool=sample_pool,
+                                             timeout=task_options["timeout"], stop_flag=stop_flag)
+            if stop_flag():
+                log_callback("⛔ Generation stopped by user.")
+                return
+            preflight_report.log(log_callback)
+            if not preflight_report.ok:
+                return
+
         # Parallel processing with ProcessPoolExecutor
-        created_docx_files = []
+        created_docx_files = []  # not kept when streaming: only counted
+        created_count = 0
         failed_files = []
+        stage_samples = {}
+        slowest_profiles = []  # min-heap of (total_seconds, index, profile_path)
+        worker_startups = []
+        first_result_after = None
+        completed_count = 0
+        cancelled_count = 0
+        timed_out_rows = []
+        cache_stats = {"hits": 0, "misses": 0}
+        stopped = False
+        stop_to_idle = None
         start_time = time.time()
 
-        # Use ProcessPoolExecutor for true multiprocessing
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            # Start all tasks
-            future_to_index = {
-                executor.submit(process_single_document, task): task[0][0]
-                for task in tasks
-            }
-
-            # Process results as they complete
-            completed_count = 0
-            active_processes = len(future_to_index)
-
-            log_callback(f"⚡ Actively processing {active_processes} tasks in parallel...")
-
-            for future in as_completed(future_to_index):
-                if stop_flag():
-                    log_callback("⛔ Stopping all processes...")
-                    # Cancel all unfinished tasks
-                    for f in future_to_index:
-                        f.cancel()
-                    executor.shutdown(wait=False)
-                    break
+        def record_result(result):
+            """Accounts one worker result dict (local future or remote worker)"""
+            nonlocal completed_count, cancelled_count, first_result_after, created_count
+            if result.get("cancelled"):
+                cancelled_count += 1
+                return
+            completed_count += 1
+            scaler.record_completion()
+            if first_result_after is None:
+                first_result_after = time.time() - start_time
+            if result.get("worker_startup"):
+                worker_startups.append(result["worker_startup"]["import_seconds"])
+            for key, count in result.get("render_cache", {}).items():
+                cache_stats[key] += count
+
+            if result.get("timings"):
+                for stage, seconds in result["timings"].items():
+                    stage_samples.setdefault(stage, []).append(seconds)
+            if result.get("profile_path"):
+                entry = (sum(result["timings"].values()), result["index"], result["profile_path"])
+                if len(slowest_profiles) < profile_top_n:
+                    heapq.heappush(slowest_profiles, entry)
+                else:
+                    entry = heapq.heappushpop(slowest_profiles, entry)
+                    _remove_file_quietly(entry[2])
+
+            if result["success"]:
+                filenames = result.get("filenames", [result["filename"]])
+                created_count += len(filenames)
+                layout.record(result["index"], filenames)
+                if not streaming:
+                    created_docx_files.extend(filenames)
+                elapsed = time.time() - start_time
+                speed = created_count / elapsed if elapsed > 0 else 0
+                names = ", ".join(os.path.basename(filename) for filename in filenames)
+                log_callback(f"✅ [{completed_count}/{total_label}] {names} | {speed:.1f} docs/sec")
+            else:
+                if result.get("timed_out"):
+                    timed_out_rows.append(result["index"])
+                error_msg = f"Row {result['index']}: {result['error']}"
+                failed_files.append(error_msg)
+                log_callback(f"❌ [{completed_count}/{total_label}] {error_msg}")
+            if progress_callback:
+                progress_callback(completed_count, total_tasks, result)
+            if metrics:
+                metrics.document(result)
+
+        def handle_result(future):
+            nonlocal cancelled_count
+            try:
+                record_result(future.result())
+            except (CancelledError, BrokenProcessPool):
+                # Only reached while stopping: queued or killed documents
+                cancelled_count += 1
+            except Exception as e:
+                failed_files.append(f"Critical process error: {str(e)}")
+                log_callback(f"❌ Critical process error: {str(e)}")
+
+        distributed_stats = None
+        if metrics:
+            metrics.started()
+        if coordinator and not tasks:
+            log_callback("📭 No rows to render, the coordinator is not started")
+        elif coordinator:
+            # Rows are rendered by remote workers (see distributed.py); this process only
+            # serves shards and writes the returned documents
+            from distributed import Coordinator
+            coord = Coordinator(tasks, output_dir, address=coordinator, shard_size=shard_size,
+                                token=coordinator_token, log_callback=log_callback)
+            coord.start()
+            local_processes = coord.spawn_local_workers(local_workers) if local_workers else []
+            try:
+                stop_to_idle = coord.run(record_result, stop_flag, cancel_grace)
+                stopped = stop_to_idle is not None
+            finally:
+                coord.shutdown(local_processes)
+            distributed_stats = coord.stats()
+        else:
+            # Use ProcessPoolExecutor for true multiprocessing: the caller's warm pool or
+            # a private one for this run. The executor is sized to the ceiling; the scaler
+            # decides how many tasks are in flight.
+            owns_pool = pool is None
+            if owns_pool:
+                pool = private_pool or WarmWorkerPool(max_workers=max_workers, log_callback=log_callback)
+                executor = pool.get_executor()
+            else:
+                executor = pool.ensure_healthy()
+            cancel_slot = pool.begin_run()
+            task_options["cancel_slot"] = cancel_slot
+            try:
+                # Process results as they complete
+                pending = {}  # future -> (task, submitted_at, executor)
+                task_iter = iter(tasks)
+                tasks_left = True
+                retry_queue = deque()
+                timeout_attempts = {}  # row index -> times it hit the timeout
+                crash_attempts = {}  # row index -> times its worker died for another reason
+
+                def handle_broken(broken_tasks, broken_executors):
+                    """A worker died: timed-out rows follow the retry policy, the rest are resubmitted"""
+                    nonlocal executor
+                    timed_out = pool.collect_timeouts(cancel_slot)
+                    collateral = {broken_executor for broken_executor in broken_executors
+                                  if pool.broke_on_timeout(broken_executor)}
+                    for task, submitted_to in broken_tasks:
+                        index = task[0][0]
+                        options = task[7]
+                        if index in timed_out:
+                            timeout_attempts[index] = timeout_attempts.get(index, 0) + 1
+                            if timeout_attempts[index] <= timeout_retries:
+                                new_timeout = options["timeout"] * timeout_backoff
+                                log_callback(f"⏰ Row {index}: timed out after {options['timeout']:.0f} sec, "
+                                             f"retry {timeout_attempts[index]}/{timeout_retries} with {new_timeout:.0f} sec")
+                                retry_queue.append(task[:7] + ({**options, "timeout": new_timeout},))
+                            else:
+                                error_msg = f"Row {index}: timed out after {options['timeout']:.0f} sec"
+                                timed_out_rows.append(index)
+                                failed_files.append(error_msg)
+                                log_callback(f"⏰ {error_msg}")
+                            continue
+                        if submitted_to in collateral:
+                            # Another document's worker was killed for a timeout
+                            retry_queue.append(task)
+                            continue
+                        crash_attempts[index] = crash_attempts.get(index, 0) + 1
+                        if crash_attempts[index] <= MAX_CRASH_RETRIES:
+                            retry_queue.append(task)
+                        else:
+                            error_msg = f"Row {index}: worker process died {crash_attempts[index]} times"
+                            failed_files.append(error_msg)
+                            log_callback(f"❌ {error_msg}")
+                    for broken_executor in broken_executors:
+                        executor = pool.restart_if_broken(broken_executor)
+
+                log_callback(f"⚡ Processing {total_label} tasks, {scaler.target} in parallel...")
+
+                while True:
+                    if stop_flag():
+                        stopped = True
+                        stop_to_idle, abandoned = _cancel_in_flight(pool, cancel_slot, pending, handle_result,
+                                                                    cancel_grace, owns_pool, log_callback)
+                        cancelled_count += abandoned
+                        break
 
-                try:
-                    result = future.result(timeout=30)  # 30 second timeout per document
-                    completed_count += 1
-
-                    if result["success"]:
-                        created_docx_files.append(result["filename"])
-                        elapsed = time.time() - start_time
-                        speed = completed_count / elapsed if elapsed > 0 else 0
-                        log_callback(
-                            f"✅ [{completed_count}/{len(tasks)}] {os.path.basename(result['filename'])} | {speed:.1f} docs/sec")
-                    else:
-                        error_msg = f"Row {result['index']}: {result['error']}"
-                        failed_files.append(error_msg)
-                        log_callback(f"❌ [{completed_count}/{len(tasks)}] {error_msg}")
+                    # Keep exactly scaler.target documents in flight (retries first)
+                    while len(pending) < scaler.target:
+                        if retry_queue:
+                            task = retry_queue.popleft()
+                        elif tasks_left:
+                            task = next(task_iter, None)
+                            if task is None:
+                                tasks_left = False
+                                continue
+                        else:
+                            break
+                        try:
+                            future = executor.submit(process_single_document, task)
+                        except (BrokenProcessPool, RuntimeError):
+                            # The shared executor broke or was replaced by another run
+                            executor = pool.restart_if_broken(executor)
+                            future = executor.submit(process_single_document, task)
+                        pending[future] = (task, time.time(), executor)
+
+                    if metrics:
+                        metrics.in_flight(len(pending))
+                    if not pending:
+                        break
 
-                except Exception as e:
-                    failed_files.append(f"Critical process error: {str(e)}")
-                    log_callback(f"❌ Critical process error: {str(e)}")
+                    done, _ = wait(list(pending), timeout=0.5, return_when=FIRST_COMPLETED)
+                    broken_tasks = []
+                    broken_executors = set()
+                    for future in done:
+                        task, _, submitted_to = pending.pop(future)
+                        if isinstance(future.exception(), BrokenProcessPool):
+                            broken_tasks.append((task, submitted_to))
+                            broken_executors.add(submitted_to)
+                        else:
+                            handle_result(future)
+                    if broken_tasks:
+                        handle_broken(broken_tasks, broken_executors)
+                    elif document_timeout:
+                        # Fallback when the in-worker watchdog could not fire (e.g. stuck in C code)
+                        now = time.time()
+                        overdue = [task for task, submitted, _ in pending.values()
+                                   if now - submitted > task[7]["timeout"] * 2 + STUCK_WORKER_SLACK]
+                        killed = [task[0][0] for task in overdue if pool.kill_worker(cancel_slot, task[0][0])]
+                        if killed:
+                            log_callback(f"💀 Rows {', '.join(map(str, killed))} stuck past their deadline, "
+                                         f"killing their workers...")
+
+                    # Only this run's busy workers: idle pool processes keep their RSS whatever the target is
+                    scaler.maybe_adjust(pool.busy_worker_pids(cancel_slot, [task[0][0] for task, _, _ in pending.values()]))
+            finally:
+                if metrics:
+                    metrics.in_flight(0)
+                pool.end_run(cancel_slot)
+                if owns_pool:
+                    pool.shutdown(wait=not stopped)
 
         # Summary
         total_time = time.time() - start_time
-        if not stop_flag():
+        stage_summary = summarize_stage_timings(stage_samples)
+        summary = {
+            "created": created_count,
+            "failed": len(failed_files),
+            "errors": failed_files,
+            "files": None if streaming else created_docx_files,
+            "total_time": total_time,
+            "stopped": stopped,
+            "cancelled": cancelled_count,
+            "timed_out_rows": timed_out_rows,
+            "stop_to_idle_seconds": stop_to_idle,
+            "stage_timings": stage_summary,
+            "table_load_seconds": table_load_seconds,
+            "table_sniff_seconds": {name: seconds for name, seconds in table_sniff_seconds.items()
+                                    if seconds is not None},
+            "concurrency_adjustments": scaler.adjustments,
+            "profiles": [path for _, _, path in sorted(slowest_profiles, reverse=True)],
+            "distributed": distributed_stats,
+            "render_cache": cache_stats if render_cache else None,
+            "name_collisions": layout.collisions,
+            "output_index": layout.index_path,
+            "preflight": {"seconds": preflight_report.seconds, "warnings": preflight_report.warnings}
+            if preflight_report else None,
+            "worker_startup": {
+                "cold_workers": len(worker_startups),
+                "import_seconds_avg": sum(worker_startups) / len(worker_startups) if worker_startups else 0.0,
+                "import_seconds_max": max(worker_startups, default=0.0),
+                "first_result_after": first_result_after,
+            },
+        }
+        if not stopped:
             log_callback(f"\n🎉 Generation completed in {total_time:.1f} seconds!")
-            log_callback(f"✅ Successfully created: {len(created_docx_files)} documents")
-            log_callback(f"⚡ Average speed: {len(created_docx_files) / total_time:.1f} documents/second")
+            log_callback(f"✅ Successfully created: {created_count} documents")
+            log_callback(f"⚡ Average speed: {created_count / total_time:.1f} documents/second")
             if failed_files:
                 log_callback(f"❌ Errors: {len(failed_files)}")
                 for error in failed_files[:3]:  # Show first 3 errors
                     log_callback(f"   • {error}")
                 if len(failed_files) > 3:
                     log_callback(f"   • ... and {len(failed_files) - 3} more errors")
+            _log_worker_startup(summary["worker_startup"], log_callback)
+            if render_cache and cache_stats["hits"]:
+                log_callback(f"♻️ Render cache: {cache_stats['hits']} documents reused, "
+                             f"{cache_stats['misses']} rendered")
+            if distributed_stats:
+                workers = ", ".join(f"{worker_id} ({info['host']}): {info['documents']}"
+                                    for worker_id, info in distributed_stats["workers"].items())
+                log_callback(f"🌐 Documents per worker: {workers or '-'}; work stealing {distributed_stats['steals']}x, "
+                             f"requeued rows {distributed_stats['requeued_rows']}")
+            _log_stage_summary(stage_summary, log_callback)
+            if summary["profiles"]:
+                log_callback(f"🔬 cProfile stats of {len(summary['profiles'])} slowest documents:")
+                for path in summary["profiles"]:
+                    log_callback(f"   • {path}")
             log_callback(f"📁 Output folder: {output_dir}")
         else:
             log_callback(
-                f"\n⛔ Generation stopped after {total_time:.1f} sec. Created: {len(created_docx_files)} documents")
+                f"\n⛔ Generation stopped after {total_time:.1f} sec. Created: {created_count} documents")
+        return summary
 
     except Exception as e:
         log_callback(f"❌ CRITICAL ERROR: {str(e)}")
         import traceback
-        log_callback(f"Error details: {traceback.format_exc()}")
\ No newline at end of file
+        log_callback(f"Error details: {traceback.format_exc()}")
+    finally:
+        if private_pool is not None:
+            private_pool.shutdown(wait=False)
+        if layout:
+            layout.close()
+        if index_dir:
+            shutil.rmtree(index_dir, ignore_errors=True)
+        if cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)  # outputs keep their own links
\ No newline at end of file
@@ -0,0 +1,115 @@
+# janitor.py - Фонове прибирання тимчасових папок і журналів з квотами за віком і розміром
+"""
+Background cleanup of folders that grow with every job (uploads, logs,
+result archives), instead of scanning them inside web requests.
+
+Every interval seconds one daemon thread sweeps each CleanupRule: entries
+(direct children: job folders or files) older than max_age are deleted, then
+the oldest remaining ones until the folder fits into max_bytes. Entries of
+active jobs (protected() returns their paths) and entries modified within
+the last `grace` seconds (a job being uploaded) are never deleted.
+"""
+import os
+import shutil
+import threading
+import time
+
+from metrics import folder_size
+
+
+class CleanupRule:
+    """Quota of one folder: max_age seconds since an entry was modified, max_bytes in total (None - no limit)"""
+
+    def __init__(self, folder, max_age=None, max_bytes=None):
+        self.folder = folder
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+
+
+class Janitor:
+    """
+    Periodic cleanup thread. protected: callable returning the paths (files or
+    folders) of active jobs; on_remove(path) is called for every deleted entry.
+    """
+
+    def __init__(self, rules, protected=lambda: (), interval=60, grace=300, on_remove=None, log_callback=None):
+        self.rules = list(rules)
+        self.protected = protected
+        self.interval = interval
+        self.grace = grace
+        self.on_remove = on_remove or (lambda path: None)
+        self.log_callback = log_callback or print
+        self.usage = {}  # folder -> bytes after the last sweep
+        self.removed = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the thread once (safe to call on every request)"""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="janitor", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sweep()
+            self._stop.wait(self.interval)
+
+    def sweep(self):
+        """One cleanup pass over all rules; returns the number of deleted entries"""
+        removed = 0
+        for rule in self.rules:
+            try:
+                removed += self._sweep_folder(rule)
+            except OSError as e:
+                self.log_callback(f"Janitor: cannot clean {rule.folder}: {e}")
+        self.removed += removed
+        return removed
+
+    def _sweep_folder(self, rule):
+        now = time.time()
+        protected = {os.path.abspath(path) for path in self.protected()}
+        entries = []  # (mtime, path, size, deletable)
+        with os.scandir(rule.folder) as scan:
+            for entry in scan:
+                try:
+                    mtime = entry.stat(follow_symlinks=False).st_mtime
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    size = folder_size(entry.path) if is_dir else entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue  # removed meanwhile
+                deletable = os.path.abspath(entry.path) not in protected and now - mtime > self.grace
+                entries.append((mtime, entry.path, size, deletable))
+        entries.sort()
+
+        total = sum(size for _, _, size, _ in entries)
+        removed = 0
+        for mtime, path, size, deletable in entries:
+            expired = rule.max_age is not None and now - mtime > rule.max_age
+            over_quota = rule.max_bytes is not None and total > rule.max_bytes
+            if not deletable or not (expired or over_quota):
+                continue
+            if self._remove(path):
+                total -= size
+                removed += 1
+        self.usage[rule.folder] = total
+        return removed
+
+    def _remove(self, path):
+        try:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            return False  # removed by the janitor of another web process
+        except OSError as e:
+            self.log_callback(f"Janitor: cannot remove {path}: {e}")
+            return False
+        self.on_remove(path)
+        return True
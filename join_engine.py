@@ -0,0 +1,172 @@
+# join_engine.py - SQL-рушій з'єднання додаткових таблиць (SQLite у пам'яті або DuckDB)
+"""
+Optional join engine of generate_documents (join_engine="sqlite" | "duckdb").
+
+The additional tables are loaded into an in-process database with an index on
+common_column. Each table (or its SQL view from table_views) is read with one
+query and grouped by key, so every task receives only the rows of its own
+document instead of the whole tables, and workers do not filter anything.
+
+table_views: {table name: "SELECT ... FROM payments WHERE ... ORDER BY ..."} -
+filtering, sorting and computed columns applied once at load time. A view may
+reference every loaded table (by its name, as in the template: payments_table
+-> payments). The view must keep common_column.
+
+Per-key count/min/max of the numeric columns come from one GROUP BY query per
+table, sums are added exactly from the grouped rows (render_worker.column_sum,
+as on the pandas path); sorts ({table: ["date", "-sum"]}) are applied to every key's rows once.
+"""
+import time
+from datetime import datetime
+
+from render_worker import column_sum, index_key, numeric_columns, sort_positions, table_aggregates
+from tables import table_records
+
+JOIN_ENGINES = ("sqlite", "duckdb")
+
+
+def _quote(identifier):
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+def _sql_value(val):
+    """SQLite stores datetimes as ISO text (restored on read, see _restore_date)"""
+    if isinstance(val, datetime):
+        return val.isoformat(" ")
+    return val
+
+
+class TableJoiner:
+    """
+    Additional tables in an in-process SQL database, pre-joined by common_column.
+    add_table() every table, then build(); rows_for(key) returns the per-row
+    other_tables mapping for a task.
+    """
+
+    def __init__(self, common_column, backend="sqlite", views=None, log_callback=None, sorts=None):
+        if backend not in JOIN_ENGINES:
+            raise ValueError(f"Unknown join engine '{backend}', expected one of {', '.join(JOIN_ENGINES)}")
+        self.common_column = common_column
+        self.backend = backend
+        self.views = dict(views or {})
+        self.sorts = dict(sorts or {})
+        self.log_callback = log_callback or (lambda message: None)
+        if backend == "duckdb":
+            try:
+                import duckdb
+            except ImportError as e:
+                raise ImportError("join_engine='duckdb' requires duckdb (pip install duckdb)") from e
+            self.conn = duckdb.connect(":memory:")
+        else:
+            import sqlite3
+            self.conn = sqlite3.connect(":memory:")
+        self.tables = {}  # name -> {"columns", "date_columns"}
+        self.grouped = {}  # name -> {"columns", "rows", "aggregates", "order", "numeric_columns"}
+
+    def add_table(self, name, df):
+        """Loads a DataFrame (as read by table_sources) and indexes its join key"""
+        columns = df.columns.tolist()
+        table = _quote(name)
+        if self.backend == "duckdb":
+            self.conn.register("_source", df)
+            self.conn.execute(f"CREATE TABLE {table} AS SELECT * FROM _source")
+            self.conn.unregister("_source")
+            date_columns = set()  # DuckDB keeps timestamps typed
+        else:
+            records = table_records(df)
+            date_columns = {col for col in columns if any(isinstance(record[col], datetime) for record in records)}
+            self.conn.execute(f"CREATE TABLE {table} ({', '.join(_quote(col) for col in columns)})")
+            self.conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(columns))})",
+                                  [[_sql_value(record[col]) for col in columns] for record in records])
+        if self.common_column in columns:
+            self.conn.execute(f"CREATE INDEX {_quote(f'{name}_key')} ON {table} ({_quote(self.common_column)})")
+        self.tables[name] = {"columns": columns, "date_columns": date_columns}
+
+    def build(self):
+        """Runs one query per table (or view) and groups its rows by key; returns seconds per table"""
+        unknown = set(self.views) - set(self.tables)
+        if unknown:
+            raise ValueError(f"table_views for unknown tables: {', '.join(sorted(unknown))}")
+        seconds = {}
+        for name, table in self.tables.items():
+            started = time.perf_counter()
+            view = self.views.get(name)
+            cursor = self.conn.execute(view or f"SELECT * FROM {_quote(name)} ORDER BY rowid")
+            columns = [str(column[0]) for column in cursor.description]
+            if self.common_column not in columns:
+                if view:
+                    raise ValueError(f"table_views['{name}'] must keep the '{self.common_column}' column")
+                continue  # workers skip tables without the join key
+            key_position = columns.index(self.common_column)
+            date_positions = [n for n, col in enumerate(columns) if col in table["date_columns"]]
+            rows = {}
+            count = 0
+            for values in cursor.fetchall():
+                key = index_key(values[key_position])
+                if key is None:
+                    continue  # missing id never matches, as in pandas
+                record = dict(zip(columns, values))
+                for n in date_positions:
+                    record[columns[n]] = self._restore_date(values[n])
+                rows.setdefault(key, []).append(record)
+                count += 1
+            numeric = numeric_columns([record for group in rows.values() for record in group],
+                                      columns, self.common_column)
+            sorts = list(self.sorts.get(name, ()))
+            self.grouped[name] = {
+                "columns": columns,
+                "rows": rows,
+                "aggregates": self._aggregates(view or f'SELECT * FROM {_quote(name)}', numeric, rows),
+                "numeric_columns": numeric,
+                "sorts": sorts,
+                "order": {key: {spec: sort_positions(group, spec) for spec in sorts} for key, group in rows.items()},
+            }
+            seconds[name] = time.perf_counter() - started
+            self.log_callback(f"🔗 Joined table: {name} ({count} records, {len(rows)} keys"
+                              f"{', view' if view else ''}, {seconds[name]:.2f} sec)")
+        return seconds
+
+    def _aggregates(self, source_sql, numeric, rows):
+        """
+        {key: {"count", "sum_<col>", "min_<col>", "max_<col>"}}: count/min/max in one
+        GROUP BY query, sums from the grouped rows with column_sum - SQL SUM adds
+        floats in its own order and would differ from the pandas path in the last digits
+        """
+        key = _quote(self.common_column)
+        selects = ["COUNT(*)"] + [f"{stat}({_quote(col)})" for col in numeric for stat in ("MIN", "MAX")]
+        aggregates = {}
+        for values in self.conn.execute(f"SELECT {key}, {', '.join(selects)} FROM ({source_sql}) AS source "
+                                        f"WHERE {key} IS NOT NULL GROUP BY {key}").fetchall():
+            group_key = index_key(values[0])
+            if group_key is None:
+                continue
+            result = {"count": values[1]}
+            group = rows.get(group_key, [])
+            for n, col in enumerate(numeric):
+                low, high = values[2 + 2 * n:4 + 2 * n]
+                total = column_sum([record[col] for record in group if record.get(col) is not None])
+                result.update({f"sum_{col}": total, f"min_{col}": low, f"max_{col}": high})
+            aggregates[group_key] = result
+        return aggregates
+
+    @staticmethod
+    def _restore_date(val):
+        if isinstance(val, str):
+            try:
+                return datetime.fromisoformat(val)
+            except ValueError:
+                pass
+        return val
+
+    def rows_for(self, key):
+        """other_tables of one task: {name: {"columns", "rows", "aggregates", ...}} with only this key's rows"""
+        key = index_key(key)
+        return {name: {"columns": table["columns"],
+                       "rows": table["rows"].get(key, []),
+                       "aggregates": table["aggregates"].get(key) or table_aggregates([], table["numeric_columns"]),
+                       "sorts": table["sorts"],
+                       "order": table["order"].get(key, {spec: [] for spec in table["sorts"]})}
+                for name, table in self.grouped.items()}
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,111 @@
+# log_pipeline.py - Неблокуючий журнал з обмеженою чергою (Qt, веб і CLI)
+"""
+Bounded, non-blocking logging backend for generate_documents' log_callback.
+
+A LogPipeline instance is the log_callback: it only puts the message into a
+bounded queue and returns, so the result-collection loop never waits for a
+widget, a file or a pipe. One background thread drains the queue every
+interval seconds and hands the batch to the sinks (callables taking a list of
+lines), e.g. a LogFile, a Qt signal or stderr.
+
+Under back-pressure (queue full) per-document progress lines are dropped and
+counted; the next batch then starts with a summary line. Other messages
+(errors, summaries) go to a small overflow buffer instead.
+"""
+import queue
+import sys
+import threading
+from collections import deque
+
+LOG_QUEUE_SIZE = 10000
+# Important messages kept beyond a full queue
+OVERFLOW_SIZE = 1000
+FLUSH_INTERVAL = 0.1
+# Per-document progress lines ("✅ [12/500] doc_1.docx | ...") may be dropped
+DROPPABLE_PREFIXES = ("✅ [",)
+
+
+class LogFile:
+    """Sink appending lines to a text file, flushed after every batch"""
+
+    def __init__(self, path, mode="a"):
+        self.path = path
+        self._file = open(path, mode, encoding="utf-8")
+
+    def __call__(self, lines):
+        self._file.write("\n".join(lines) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def stderr_sink(lines):
+    print("\n".join(lines), file=sys.stderr, flush=True)
+
+
+class LogPipeline:
+    """log_callback that never blocks: bounded queue + one writer thread"""
+
+    def __init__(self, sinks=(), max_queue=LOG_QUEUE_SIZE, interval=FLUSH_INTERVAL):
+        self.sinks = list(sinks)
+        self.interval = interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._overflow = deque(maxlen=OVERFLOW_SIZE)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="log-pipeline", daemon=True)
+        self._thread.start()
+
+    def __call__(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            if str(message).startswith(DROPPABLE_PREFIXES):
+                self.dropped += 1
+            else:
+                self._overflow.append(message)
+
+    def _take_batch(self, timeout):
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout))
+            while True:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        while self._overflow:
+            batch.append(self._overflow.popleft())
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            batch.insert(0, f"⚠️ Log overloaded: {dropped} progress messages skipped")
+        return batch
+
+    def _deliver(self, batch):
+        for sink in self.sinks:
+            try:
+                sink(batch)
+            except Exception as e:  # a broken sink must not stop the others
+                print(f"Log sink failed: {e}", file=sys.stderr)
+
+    def _run(self):
+        while not self._closed.is_set():
+            batch = self._take_batch(self.interval)
+            if batch:
+                self._deliver(batch)
+        # Drain what was logged before close()
+        batch = self._take_batch(0)
+        while batch:
+            self._deliver(batch)
+            batch = self._take_batch(0)
+
+    def close(self, timeout=5):
+        """Delivers the remaining messages, stops the thread and closes sinks that have close()"""
+        self._closed.set()
+        self._thread.join(timeout)
+        for sink in self.sinks:
+            if hasattr(sink, "close"):
+                try:
+                    sink.close()
+                except OSError:
+                    pass
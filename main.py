@@ -2,9 +2,6 @@
 import sys
 import multiprocessing
 
-# Імпортуємо оновлений UI з тестуванням
-from ui import main as ui_main
-
 
 def main():
     """Головна функція з правильною ініціалізацією багатопроцесорності"""
@@ -19,7 +16,11 @@ def main():
         except RuntimeError:
             pass  # Метод вже встановлено
 
-    # Запускаємо UI з тестуванням
+    # Запускаємо UI з тестуванням.
+    # Імпорт тут, а не на рівні модуля: при 'spawn' кожен воркер імпортує main.py
+    # як __mp_main__ і не повинен тягнути PyQt5, pandas та openpyxl
+    from ui import main as ui_main
+
     try:
         ui_main()
     except KeyboardInterrupt:
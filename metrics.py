@@ -0,0 +1,241 @@
+# metrics.py - Метрики генерації у текстовому форматі Prometheus (для /metrics веб-застосунку)
+"""
+Counters, gauges and histograms of document generation, exported in the
+Prometheus text exposition format without extra dependencies.
+
+GenerationMetrics is the registry of one process (the web app keeps one).
+Every job gets a JobMetrics handle from job(); generate_documents(metrics=...)
+reports to it directly: started() when rendering begins, document(result) for
+every finished row (with per-stage timings), in_flight(n) from the scheduler.
+The caller ends the job with finish(summary).
+"""
+import os
+import threading
+import time
+
+# Seconds; per-stage latency of one document and whole-job / archive durations
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+JOB_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+ARCHIVE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._lock = registry.lock
+        self._values = {}  # sorted label pairs -> value
+        registry.metrics.append(self)
+
+    def _samples(self):
+        return [(self.name, labels, value) for labels, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """
+    Starts at 0 for every label set in `labels` (default: the unlabelled series),
+    so increase() and rate() also see the first increment
+    """
+
+    kind = "counter"
+
+    def __init__(self, registry, name, help_text, labels=({},)):
+        super().__init__(registry, name, help_text)
+        for label_set in labels:
+            self._values[tuple(sorted(label_set.items()))] = 0
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, buckets):
+        super().__init__(registry, name, help_text)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0.0)
+            for n, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[n] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        samples = []
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", labels + (("le", _format_value(bound)),), cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+
+class JobMetrics:
+    """Instrumentation handle of one generation job (see module docstring)"""
+
+    def __init__(self, registry):
+        self._registry = registry
+        self.created = 0
+        self.running_since = None
+        self.tasks_in_flight = 0
+        self._finished = False
+        registry.jobs_queued.inc()
+
+    def started(self):
+        """Rendering begins: the job moves from queued to running"""
+        registry = self._registry
+        with registry.lock:
+            registry.running_jobs.add(self)
+        self.running_since = time.time()
+        registry.jobs_queued.inc(-1)
+        registry.jobs_running.inc()
+
+    def document(self, result):
+        """One finished row of generate_documents (a worker result dict)"""
+        registry = self._registry
+        if result.get("cancelled"):
+            return
+        if result["success"]:
+            count = len(result.get("filenames") or [result["filename"]])
+            self.created += count
+            registry.documents.inc(count, status="success")
+        else:
+            registry.documents.inc(status="timed_out" if result.get("timed_out") else "failed")
+        for stage, seconds in (result.get("timings") or {}).items():
+            registry.stage_seconds.observe(seconds, stage=stage)
+
+    def in_flight(self, count):
+        self.tasks_in_flight = count
+
+    def finish(self, summary):
+        """Ends the job; summary is the return value of generate_documents (None: not started / error)"""
+        if self._finished:
+            return
+        self._finished = True
+        registry = self._registry
+        with registry.lock:
+            registry.running_jobs.discard(self)
+        if self.running_since is None:
+            registry.jobs_queued.inc(-1)
+        else:
+            registry.jobs_running.inc(-1)
+            registry.job_seconds.observe(time.time() - self.running_since)
+        if summary is None:
+            status = "failed"
+        elif summary["stopped"]:
+            status = "stopped"
+        else:
+            status = "completed"
+        registry.jobs_finished.inc(status=status)
+
+
+class GenerationMetrics:
+    """Metrics registry of the process; render() gives the /metrics text"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.running_jobs = set()
+        self.jobs_queued = Gauge(self, "docgen_jobs_queued", "Accepted jobs that have not started rendering")
+        self.jobs_running = Gauge(self, "docgen_jobs_running", "Jobs rendering documents")
+        self.jobs_finished = Counter(self, "docgen_jobs_finished_total", "Finished jobs by status",
+                                     [{"status": status} for status in ("completed", "stopped", "failed")])
+        self.job_seconds = Histogram(self, "docgen_job_seconds", "Rendering time of finished jobs", JOB_BUCKETS)
+        self.documents = Counter(self, "docgen_documents_total", "Rendered documents and failed rows",
+                                 [{"status": status} for status in ("success", "failed", "timed_out")])
+        self.stage_seconds = Histogram(self, "docgen_stage_seconds", "Per-document render latency by stage",
+                                       STAGE_BUCKETS)
+        self.docs_per_second = Gauge(self, "docgen_documents_per_second", "Current speed of all running jobs")
+        self.tasks_in_flight = Gauge(self, "docgen_tasks_in_flight", "Rows submitted to worker processes")
+        self.pool_workers = Gauge(self, "docgen_pool_workers", "Worker processes of the shared pool")
+        self.pool_utilization = Gauge(self, "docgen_pool_utilization", "Rows in flight per pool worker")
+        self.pool_restarts = Counter(self, "docgen_pool_restarts_total", "Restarts of the shared worker pool")
+        self.temp_dir_bytes = Gauge(self, "docgen_temp_dir_bytes", "Disk usage of temp folders at the last cleanup")
+        self.archive_seconds = Histogram(self, "docgen_archive_seconds", "Time to build the result archive",
+                                         ARCHIVE_BUCKETS)
+
+    def job(self):
+        """New queued job; pass it to generate_documents(metrics=...)"""
+        return JobMetrics(self)
+
+    def render(self, pool_workers=None):
+        """Prometheus text format; speed, in-flight rows and utilization are computed now"""
+        now = time.time()
+        with self.lock:
+            running = list(self.running_jobs)
+        in_flight = sum(job.tasks_in_flight for job in running)
+        self.docs_per_second.set(sum(job.created / (now - job.running_since) for job in running
+                                     if now > job.running_since))
+        self.tasks_in_flight.set(in_flight)
+        if pool_workers:
+            self.pool_workers.set(pool_workers)
+            self.pool_utilization.set(min(1.0, in_flight / pool_workers))
+        with self.lock:
+            lines = [line for metric in self.metrics for line in metric.render()]
+        return "\n".join(lines) + "\n"
+
+
+def folder_size(path):
+    """Bytes of all files below path (missing files are skipped)"""
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    else:
+                        total += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+    return total
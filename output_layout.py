@@ -0,0 +1,118 @@
+# output_layout.py - Розкладка вихідних файлів по підпапках, індекс рядок → файл, контроль колізій імен
+"""
+Output naming of generate_documents, done in the parent process.
+
+Every row gets its output paths (one per template) before it is submitted:
+file_name_patterns give the file name, output_layout an optional sub-folder
+pattern in front of it, so a batch of 100k+ documents is not written into
+one flat folder:
+
+- None / "flat": output_dir/doc_1.docx
+- "hash": output_dir/3f/doc_1.docx - {shard}, the first SHARD_WIDTH hex digits
+  of a hash of the {name} value (stable between runs, 256 folders)
+- any pattern with main columns, {name}, {template}, {index}, {shard}:
+  "{region}" -> output_dir/Kyiv/doc_1.docx, "{region}/{shard}", ...
+
+A file name pattern may contain "/" as well ("{region}/{id}.docx").
+
+Names already given in this run are kept in a set (case-insensitive, as on
+NTFS), so a duplicate is found in O(1): the later row gets "_<index>" in its
+file name instead of silently overwriting the earlier document. Every created
+document is listed in output_dir/output_index.csv (row, template, path).
+"""
+import csv
+import hashlib
+import os
+import string
+
+from render_worker import format_file_name, safe_file_name, template_stem
+
+OUTPUT_INDEX_FILE = "output_index.csv"
+HASH_LAYOUT = "hash"
+SHARD_WIDTH = 2
+# Collisions logged one by one; the rest are only counted
+MAX_COLLISION_MESSAGES = 10
+
+
+def shard_of(name):
+    """Stable hash-prefix folder of a document name"""
+    return hashlib.md5(str(name).encode("utf-8")).hexdigest()[:SHARD_WIDTH]
+
+
+def layout_fields(layout):
+    """Placeholder names used in an output_layout pattern"""
+    if not layout or layout == "flat":
+        return set()
+    pattern = "{shard}" if layout == HASH_LAYOUT else layout
+    return {field for _, field, _, _ in string.Formatter().parse(pattern) if field}
+
+
+def _safe_relative_path(path):
+    """Relative path that stays inside output_dir: empty, '.' and '..' parts become '_'"""
+    parts = [part if part.strip(".") else "_" for part in path.replace("\\", "/").split("/")]
+    return os.path.join(*parts)
+
+
+class OutputLayout:
+    """
+    Assigns collision-free output paths to rows (names_for) and writes the
+    row -> path index of the created documents (record).
+    """
+
+    def __init__(self, output_dir, template_specs, layout=None, log_callback=None):
+        self.output_dir = output_dir
+        self.template_specs = template_specs
+        self.layout = None if layout in (None, "", "flat") else ("{shard}" if layout == HASH_LAYOUT else layout)
+        self.log_callback = log_callback or (lambda message: None)
+        self.collisions = 0
+        self._taken = set()
+        self._templates = [os.path.basename(path) for path, _ in template_specs]
+        self.index_path = os.path.join(output_dir, OUTPUT_INDEX_FILE)
+        self._index_file = open(self.index_path, "w", encoding="utf-8", newline="")
+        self._index = csv.writer(self._index_file)
+        self._index.writerow(["row", "template", "path"])
+
+    def names_for(self, index, row_dict, safe_name):
+        """Paths relative to output_dir, one per template, for row `index`"""
+        names = []
+        for spec_path, pattern in self.template_specs:
+            name = format_file_name(pattern, row_dict, safe_name, spec_path, index)
+            if self.layout:
+                fields = {key: safe_file_name(val) for key, val in row_dict.items()}
+                fields.update(name=safe_name, template=safe_file_name(template_stem(spec_path)), index=index,
+                              shard=shard_of(safe_name))
+                name = self.layout.format_map(fields) + "/" + name
+            names.append(self._claim(_safe_relative_path(name), index))
+        return names
+
+    def _claim(self, name, index):
+        key = os.path.normcase(name).lower()
+        if key in self._taken:
+            stem, ext = os.path.splitext(name)
+            unique, n = f"{stem}_{index}{ext}", 1
+            while os.path.normcase(unique).lower() in self._taken:
+                n += 1
+                unique = f"{stem}_{index}_{n}{ext}"
+            self.collisions += 1
+            if self.collisions <= MAX_COLLISION_MESSAGES:
+                self.log_callback(f"⚠️ File name collision: row {index} '{name}' is already used, "
+                                  f"saved as '{unique}'")
+            name, key = unique, os.path.normcase(unique).lower()
+        self._taken.add(key)
+        return name
+
+    def record(self, index, filenames):
+        """Adds the created documents of one row to the index file"""
+        for template, filename in zip(self._templates, filenames):
+            self._index.writerow([index, template, os.path.relpath(filename, self.output_dir)])
+
+    def close(self):
+        if self.collisions > MAX_COLLISION_MESSAGES:
+            self.log_callback(f"⚠️ {self.collisions} file name collisions in total (see {OUTPUT_INDEX_FILE})")
+        self._index_file.close()
+
+
+def read_output_index(output_dir):
+    """Absolute paths of the documents listed in output_dir/output_index.csv"""
+    with open(os.path.join(output_dir, OUTPUT_INDEX_FILE), encoding="utf-8", newline="") as f:
+        return [os.path.join(output_dir, row["path"]) for row in csv.DictReader(f)]
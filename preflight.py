@@ -0,0 +1,276 @@
+# preflight.py - Перевірка шаблонів і даних перед запуском процесів: невідомі змінні, стовпці циклів, пробний рендеринг
+"""
+Pre-flight validation of generate_documents, run after the tables are loaded
+and before any worker starts, so a broken batch fails in a second instead of
+after thousands of documents.
+
+1. Every XML part docxtpl renders (body, headers, footers, footnotes,
+   properties) is patched and parsed like docxtpl does it: syntax errors are
+   found without rendering.
+2. Top-level variables are checked against the context a worker builds from
+   the loaded columns: <column>_credit, <table>_table, its aggregates and
+   sorted lists, with the closest known name as a hint ({{ amout_credit }}
+   -> amount_credit). Unknown names of a loaded table, and a table that is used
+   but has no common_column (workers skip such tables), are errors. Other
+   unknown names render empty and are warnings, errors in strict mode; a table
+   that is not loaded at all is always a warning ({% if phones_table|length == 0 %}
+   is a valid way to handle an optional table).
+3. Item fields read in loops over a table ({% for p in payments_table %}
+   {{ p.sume }}) are checked against the table's columns.
+4. The first row is rendered into a temporary folder by a worker of the run's
+   pool, with the same task and timeout a worker gets: filters and values fail
+   here, not in the middle of the run. A sample that hangs is killed after the
+   timeout, and stop_flag is honoured while it renders.
+"""
+import difflib
+import os
+import re
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+
+from render_worker import get_jinja_env, process_single_document, sort_context_name
+
+# Parts of a .docx that docxtpl renders with Jinja
+RENDERED_PARTS = re.compile(r"^(word/(document|header\d*|footer\d*|footnotes)\.xml|docProps/core\.xml)$")
+# dict methods a template may call on a table row
+ROW_METHODS = {"get", "items", "keys", "values"}
+AGGREGATE_STATS = ("sum", "min", "max")
+# Seconds after the timeout before the parent kills a sample whose watchdog did not fire
+SAMPLE_KILL_SLACK = 5
+
+
+class PreflightReport:
+    """Problems found before rendering: errors stop the run, warnings are only logged"""
+
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+        self.seconds = 0.0
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def error(self, message):
+        if message not in self.errors:
+            self.errors.append(message)
+
+    def warning(self, message):
+        if message not in self.warnings:
+            self.warnings.append(message)
+
+    def log(self, log_callback):
+        for message in self.warnings:
+            log_callback(f"⚠️ Pre-flight: {message}")
+        if self.errors:
+            log_callback("❌ Pre-flight check failed, nothing was rendered:")
+            for message in self.errors:
+                log_callback(f"   • {message}")
+        else:
+            log_callback(f"✅ Pre-flight check passed in {self.seconds:.2f} sec")
+
+
+def _loop_source(node):
+    """Variable a for loop iterates over: payments_table, payments_table|sort(...), ..."""
+    from jinja2 import nodes
+
+    while isinstance(node, (nodes.Filter, nodes.Test)):
+        node = node.node
+    return node.name if isinstance(node, nodes.Name) else None
+
+
+def _item_fields(for_node, item):
+    """Fields read from the loop variable inside the loop body: item.sum, item['sum']"""
+    from jinja2 import nodes
+
+    fields = set()
+    for body_node in for_node.body + for_node.else_:
+        for node in body_node.find_all((nodes.Getattr, nodes.Getitem)):
+            if not (isinstance(node.node, nodes.Name) and node.node.name == item):
+                continue
+            if isinstance(node, nodes.Getattr):
+                fields.add(node.attr)
+            elif isinstance(node.arg, nodes.Const) and isinstance(node.arg.value, str):
+                fields.add(node.arg.value)
+    return fields - ROW_METHODS
+
+
+def template_usage(path, jinja_env=None):
+    """
+    (variables, loops) of a template: top-level variables of all rendered parts
+    and {iterated variable: item fields read in its loops}. Raises
+    jinja2.TemplateSyntaxError with the failing part name in its `part` attribute.
+    """
+    from docxtpl import DocxTemplate
+    from jinja2 import TemplateSyntaxError, meta, nodes
+
+    jinja_env = jinja_env or get_jinja_env()
+    tpl = DocxTemplate(path)
+    variables = set()
+    loops = {}
+    with zipfile.ZipFile(path) as package:
+        for name in package.namelist():
+            if not RENDERED_PARTS.match(name):
+                continue
+            xml = package.read(name).decode("utf-8")
+            if "{" not in xml:
+                continue
+            try:
+                ast = jinja_env.parse(tpl.patch_xml(xml))
+                # Runs the code generator: unknown filters and tests are reported here
+                variables |= meta.find_undeclared_variables(ast)
+            except TemplateSyntaxError as e:
+                e.part = name
+                raise
+            for for_node in ast.find_all(nodes.For):
+                source = _loop_source(for_node.iter)
+                if source and isinstance(for_node.target, nodes.Name):
+                    loops.setdefault(source, set()).update(_item_fields(for_node, for_node.target.name))
+    return variables - set(jinja_env.globals), loops
+
+
+def context_names(main_columns, tables, common_column):
+    """
+    {context variable: (table name or None, row columns or None)} a worker can
+    produce for these columns; tables is {name: {"columns", "numeric_columns", "sorts"}}
+    """
+    names = {f"{col}_credit": (None, None) for col in main_columns}
+    for name, table in tables.items():
+        if common_column not in table["columns"]:
+            continue
+        columns = set(table["columns"])
+        names[f"{name}_table"] = (name, columns)
+        names[f"{name}_table_count"] = (name, None)
+        for col in table.get("numeric_columns") or ():
+            for stat in AGGREGATE_STATS:
+                names[f"{name}_table_{stat}_{col}"] = (name, None)
+        for spec in table.get("sorts") or ():
+            names[sort_context_name(name, spec)] = (name, columns)
+    return names
+
+
+def _table_of(variable, tables):
+    """Loaded table a variable refers to by its name (payments_table_sum_x -> payments), longest name first"""
+    for name in sorted(tables, key=len, reverse=True):
+        if variable == f"{name}_table" or variable.startswith(f"{name}_table_"):
+            return name
+    return None
+
+
+def _suggestion(name, known):
+    match = difflib.get_close_matches(name, known, n=1, cutoff=0.75)
+    return f" (did you mean '{match[0]}'?)" if match else ""
+
+
+def check_template(path, main_columns, tables, common_column, report, strict=False):
+    """Static checks of one template against the loaded columns; adds problems to report"""
+    from jinja2 import TemplateSyntaxError
+
+    label = os.path.basename(path)
+    try:
+        variables, loops = template_usage(path)
+    except TemplateSyntaxError as e:
+        report.error(f"{label}: template syntax error in {getattr(e, 'part', 'the template')}: {e.message}")
+        return
+    except Exception as e:
+        report.error(f"{label}: cannot read the template: {e}")
+        return
+
+    known = context_names(main_columns, tables, common_column)
+    for variable in sorted(variables):
+        if variable in known:
+            continue
+        table = _table_of(variable, tables)
+        if table and common_column not in tables[table]["columns"]:
+            report.error(f"{label}: {{{{ {variable} }}}} - table '{table}' has no '{common_column}' column, "
+                         f"its rows are never matched to documents")
+        elif table:
+            report.error(f"{label}: unknown variable {{{{ {variable} }}}} for table '{table}'"
+                         f"{_suggestion(variable, known)}")
+        elif variable.endswith("_table") or "_table_" in variable:
+            report.warning(f"{label}: {{{{ {variable} }}}} - no such table is loaded, it is empty in every document"
+                           f"{_suggestion(variable, known)}")
+        elif strict:
+            report.error(f"{label}: unknown variable {{{{ {variable} }}}}{_suggestion(variable, known)}")
+        else:
+            report.warning(f"{label}: unknown variable {{{{ {variable} }}}}, it is empty in every document"
+                           f"{_suggestion(variable, known)}")
+
+    for variable, fields in sorted(loops.items()):
+        table, columns = known.get(variable, (None, None))
+        if columns is None:
+            continue
+        for field in sorted(fields - columns):
+            report.error(f"{label}: loop over {variable} reads '{field}', table '{table}' has no such column"
+                         f"{_suggestion(field, columns)}")
+
+
+def _render_in_pool(pool, sample, timeout, stop_flag):
+    """Result of one task rendered by a worker of pool (WarmWorkerPool) in its own run slot"""
+    index = sample[0][0]
+    slot = pool.begin_run()
+    try:
+        executor = pool.ensure_healthy()
+        future = executor.submit(process_single_document, sample[:7] + ({"timeout": timeout, "cancel_slot": slot},))
+        deadline = time.monotonic() + timeout + SAMPLE_KILL_SLACK if timeout else None
+        while not wait([future], timeout=0.2)[0]:
+            if stop_flag():
+                pool.cancel_run(slot)
+                pool.kill_worker(slot, index)
+                wait([future], timeout=SAMPLE_KILL_SLACK)
+                return {"success": False, "error": "stopped"}
+            if deadline and time.monotonic() > deadline:
+                pool.kill_worker(slot, index)
+                deadline = None
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            timed_out = index in pool.collect_timeouts(slot)
+            pool.restart_if_broken(executor)
+            return {"success": False,
+                    "error": f"timed out after {timeout:.0f} sec" if timed_out else "the worker process died"}
+    finally:
+        pool.end_run(slot)
+
+
+def check_sample(task, report, pool=None, timeout=None, stop_flag=None):
+    """
+    Renders one task into a temporary folder, in a worker of pool with the
+    timeout (in this process without a pool); a failure or timeout is an error
+    """
+    (row_data, template_specs, _, common_column, file_name_column, other_tables, main_columns) = task[:7]
+    sample_dir = tempfile.mkdtemp(prefix="docgen_preflight_")
+    sample = ((row_data[0], row_data[1]), template_specs, sample_dir, common_column,
+              file_name_column, other_tables, main_columns, {})
+    try:
+        if pool is None:
+            result = process_single_document(sample)
+        else:
+            result = _render_in_pool(pool, sample, timeout, stop_flag or (lambda: False))
+    finally:
+        shutil.rmtree(sample_dir, ignore_errors=True)
+    if not result["success"]:
+        report.error(f"sample render of row {row_data[0]} failed: {result['error']}")
+
+
+def run_preflight(template_paths, main_columns, tables, common_column, sample_task=None, strict=False,
+                  pool=None, timeout=None, stop_flag=None):
+    """All checks (see module docstring); returns a PreflightReport. pool, timeout, stop_flag: see check_sample"""
+    started = time.perf_counter()
+    report = PreflightReport()
+    if tables and common_column not in main_columns:
+        report.error(f"the main table has no '{common_column}' column: no table rows can be matched")
+    for name, table in sorted(tables.items()):
+        if common_column not in table["columns"]:
+            report.warning(f"table '{name}' has no '{common_column}' column and is skipped")
+    for path in template_paths:
+        check_template(path, main_columns, tables, common_column, report, strict)
+    # A template that does not parse would fail the sample render with the same error
+    if report.ok and sample_task is not None:
+        check_sample(sample_task, report, pool, timeout, stop_flag)
+    report.seconds = time.perf_counter() - started
+    return report
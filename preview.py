@@ -0,0 +1,229 @@
+# preview.py - Швидкий попередній перегляд одного рядка: кешовані таблиці та скомпільований шаблон, той самий рендер, що й у пакетному запуску
+"""
+Preview of one row of the main table: renders row N in this process, so it
+takes a few hundred milliseconds once the tables are loaded.
+
+Preview and batch output match because nothing is reimplemented: tables are
+read by table_sources and prepared by tables.prepare_table / row_record,
+and the row goes through render_worker.process_single_document as the same
+task a batch worker gets. The preview renders with its own Jinja environment
+that keeps compiled templates (docxtpl compiles every XML part on each
+render), so only the first preview of a template pays for compiling it.
+
+Loaded tables are cached per process, keyed by file content (sha256) and the
+settings they were prepared with: the next preview of any row - and of a
+re-uploaded copy of the same file - skips reading and preparing them.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from generator import _template_specs
+from tables import prepare_table, row_record
+from render_worker import _build_jinja_env, parse_sort, process_single_document
+
+# Prepared tables and main tables kept in memory (LRU)
+CACHE_LIMIT = 32
+# Files whose sha256 is remembered (LRU); uploads get a new path per request
+DIGESTS_LIMIT = 256
+# Compiled XML parts (LRU): a few templates x body, headers, footers
+COMPILED_LIMIT = 128
+CHUNK_SIZE = 1024 * 1024
+
+_cache = OrderedDict()  # key -> cached value
+_cache_lock = threading.RLock()  # a prepared table is built from a cached frame
+_digests = OrderedDict()  # file path -> ((mtime, size), sha256)
+_digests_lock = threading.Lock()
+_jinja_env = None
+_compiled = OrderedDict()  # patched XML source -> compiled template
+_compiled_lock = threading.Lock()
+
+
+class PreviewError(ValueError):
+    """The preview cannot be rendered (bad row number, unreadable table, template error)"""
+
+
+def file_digest(path):
+    """sha256 of a file, recomputed only when its mtime or size changes"""
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with _digests_lock:
+        cached = _digests.get(path)
+        if cached and cached[0] == version:
+            _digests.move_to_end(path)
+            return cached[1]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    with _digests_lock:
+        _digests[path] = (version, digest.hexdigest())
+        while len(_digests) > DIGESTS_LIMIT:
+            _digests.popitem(last=False)
+    return digest.hexdigest()
+
+
+def _cached(key, build):
+    """Value for key from the cache, or build() it (one build at a time: parallel previews wait for it)"""
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+        value = build()
+        _cache[key] = value
+        while len(_cache) > CACHE_LIMIT:
+            _cache.popitem(last=False)
+        return value
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+    with _digests_lock:
+        _digests.clear()
+    with _compiled_lock:
+        _compiled.clear()
+
+
+def _preview_env():
+    """Jinja environment of the previews: the workers' filters, from_string() compiles each source once"""
+    global _jinja_env
+    if _jinja_env is None:
+        import jinja2
+
+        class CompilingEnvironment(jinja2.Environment):
+            def from_string(self, source, globals=None, template_class=None):
+                if globals is not None or template_class is not None or not isinstance(source, str):
+                    return super().from_string(source, globals, template_class)
+                with _compiled_lock:
+                    if source in _compiled:
+                        _compiled.move_to_end(source)
+                        return _compiled[source]
+                template = super().from_string(source)
+                with _compiled_lock:
+                    _compiled[source] = template
+                    while len(_compiled) > COMPILED_LIMIT:
+                        _compiled.popitem(last=False)
+                return template
+
+        _jinja_env = _build_jinja_env(jinja2, CompilingEnvironment)
+    return _jinja_env
+
+
+def _main_table(main_path, log_callback):
+    from table_sources import read_main_table
+
+    file_path = main_path.partition("::")[0]
+    key = ("main", file_digest(file_path), os.path.splitext(file_path)[1].lower(), main_path.partition("::")[2])
+    return _cached(key, lambda: read_main_table(main_path, log_callback)[0])
+
+
+def _table_frame(source_path, sql_table, log_callback):
+    from table_sources import read_source
+
+    key = ("frame", file_digest(source_path), os.path.splitext(source_path)[1].lower(), sql_table)
+    return _cached(key, lambda: read_source(source_path, sql_table, log_callback)[0])
+
+
+def _other_tables(sources, common_column, table_sorts, join_engine, table_views, log_callback):
+    """other_tables in the form generate_documents sends them: prepared tables, or a built TableJoiner"""
+    sources = [(name, path, sql_table, file_digest(path)) for name, path, sql_table in sources]
+    if join_engine:
+        def build_joiner():
+            from join_engine import TableJoiner
+
+            joiner = TableJoiner(common_column, join_engine, table_views, log_callback, table_sorts)
+            try:
+                for name, path, sql_table, _ in sources:
+                    joiner.add_table(name, _table_frame(path, sql_table, log_callback))
+                joiner.build()
+            finally:
+                joiner.close()
+            return joiner
+
+        key = ("joiner", tuple((name, digest, sql_table) for name, _, sql_table, digest in sources), common_column,
+               join_engine, repr(sorted((table_views or {}).items())), repr(sorted((table_sorts or {}).items())))
+        return _cached(key, build_joiner)
+
+    tables = {}
+    for name, path, sql_table, digest in sources:
+        sorts = tuple((table_sorts or {}).get(name, ()))
+        key = ("table", digest, sql_table, common_column, sorts)
+        tables[name] = _cached(key, lambda: prepare_table(_table_frame(path, sql_table, log_callback),
+                                                          common_column, sorts))
+    return tables
+
+
+def render_preview(root_dir, main_path, template_path, row, output_dir, common_column, file_name_column,
+                   file_name_patterns=None, table_sorts=None, join_engine=None, table_views=None,
+                   table_sources=None, pdf=False, log_callback=None):
+    """
+    Renders row `row` of the main table (0-based, as "Row N" in the log and
+    the row column of output_index.csv) with every template into output_dir.
+    Arguments mean the same as in generate_documents. pdf: convert the result
+    (see cli.convert_to_pdf). Returns the created file paths; PreviewError
+    if the row cannot be rendered.
+    """
+    from table_sources import discover_sources
+
+    log_callback = log_callback or (lambda message: None)
+    started = time.perf_counter()
+    try:
+        template_specs = _template_specs(template_path, file_name_patterns)
+    except ValueError as e:
+        raise PreviewError(str(e)) from e
+    missing = [path for path in [main_path.partition("::")[0]] + [path for path, _ in template_specs]
+               if not os.path.exists(path)]
+    if missing:
+        raise PreviewError(f"File not found: {', '.join(missing)}")
+    if table_views and not join_engine:
+        raise PreviewError("table_views need join_engine ('sqlite' or 'duckdb')")
+
+    try:
+        main_df = _main_table(main_path, log_callback)
+        sources = discover_sources(root_dir, main_path) if table_sources is None else list(table_sources)
+        other_tables = _other_tables(sources, common_column, table_sorts, join_engine, table_views, log_callback)
+    except PreviewError:
+        raise
+    except Exception as e:
+        raise PreviewError(f"Cannot load tables: {e}") from e
+    if not 0 <= row < len(main_df):
+        raise PreviewError(f"Row {row} does not exist: the main table has rows 0-{len(main_df) - 1}")
+
+    joiner = None if isinstance(other_tables, dict) else other_tables
+    table_columns = joiner.grouped if joiner else other_tables
+    for name, specs in (table_sorts or {}).items():
+        if name not in table_columns:
+            raise PreviewError(f"table_sorts for unknown table '{name}'")
+        unknown = {parse_sort(spec)[0] for spec in specs} - set(table_columns[name]["columns"])
+        if unknown:
+            raise PreviewError(f"table_sorts['{name}']: unknown columns {', '.join(sorted(unknown))}")
+
+    row_dict = row_record(main_df.iloc[row])
+    os.makedirs(output_dir, exist_ok=True)
+    task = (
+        (row, row_dict),
+        template_specs,
+        output_dir,
+        common_column,
+        file_name_column,
+        joiner.rows_for(row_dict.get(common_column)) if joiner else other_tables,
+        main_df.columns.tolist(),
+        {},
+    )
+    result = process_single_document(task, _preview_env())
+    if not result["success"]:
+        raise PreviewError(f"Row {row}: {result['error']}")
+    files = result["filenames"]
+    if pdf:
+        from cli import convert_to_pdf
+
+        try:
+            files = convert_to_pdf(files, output_dir, log_callback)
+        except Exception as e:
+            raise PreviewError(f"PDF conversion failed: {e}") from e
+    log_callback(f"👁️ Preview of row {row}: {', '.join(os.path.basename(path) for path in files)} "
+                 f"({time.perf_counter() - started:.2f} sec)")
+    return files
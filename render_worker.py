@@ -0,0 +1,664 @@
+# render_worker.py - Мінімальний модуль рендерингу для процесів-воркерів
+"""
+Worker-side rendering code.
+
+Spawned workers unpickle tasks that reference only this module, so they do not
+import generator.py (pandas, openpyxl, smart_read_excel). docxtpl and jinja2 are
+loaded on the first document; pandas only if a value needs its date parser.
+Tasks must therefore contain plain Python values (see tables._to_plain_value).
+"""
+import cProfile
+import hashlib
+import json
+import math
+import os
+import shutil
+import signal
+import threading
+import time
+from datetime import datetime
+
+from docx_writer import save_docx
+from utils import floatformat, is_date_string
+
+PROFILE_STAGES = ("context", "tables", "load", "render", "save")
+
+# Output file name patterns: {name} is the sanitized file_name_column value,
+# {template} the template file stem, {index} the row number, plus any main column
+DEFAULT_FILE_NAME_PATTERN = "doc_{name}.docx"
+MULTI_TEMPLATE_FILE_NAME_PATTERN = "{template}_{name}.docx"
+
+# Lazily loaded rendering stack (per process)
+_DocxTemplate = None
+_jinja_env = None
+_import_seconds = None
+_startup_reported = False
+
+# Shared per-run cancel flags (worker_pool.CancelFlags), the queue the timeout
+# watchdog reports to and the busy worker table (worker_pool.BusyWorkers), set by init_worker
+_cancel_flags = None
+_timeout_queue = None
+_busy_pids = None
+_index_connections = {}  # on-disk table index path -> read-only sqlite connection
+_template_fingerprints = {}  # template path -> ((mtime, size), sha256, referenced variables or None)
+
+# Exit code of a worker killed by its own timeout watchdog
+TIMEOUT_EXIT_CODE = 75
+
+
+class DocumentCancelled(Exception):
+    """Raised at a check point when the run was stopped"""
+
+
+class StageTimer:
+    """Collects high-resolution durations of the rendering stages of one document"""
+
+    def __init__(self):
+        self.timings = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        """Closes the current stage under the given name and starts the next one"""
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + (now - self._last)
+        self._last = now
+
+
+def _is_missing(val):
+    """pd.isnull for scalars without importing pandas"""
+    if val is None:
+        return True
+    if isinstance(val, float):
+        return val != val
+    return type(val).__name__ in ("NaTType", "NAType")
+
+
+def _to_datetime(val, unit=None):
+    """pd.to_datetime(errors='coerce') with a pandas-free fast path for ISO strings"""
+    if isinstance(val, str) and unit is None:
+        try:
+            return datetime.fromisoformat(val.strip())
+        except ValueError:
+            pass
+    try:
+        import pandas as pd
+        parsed = pd.to_datetime(val, unit=unit, errors='coerce')
+        return None if pd.isna(parsed) else parsed
+    except Exception:
+        return None
+
+
+def _parse_filter_date(val):
+    """Common parsing for date filters; returns datetime or None"""
+    # If it's already a datetime object
+    if hasattr(val, 'strftime'):
+        return val
+    # If it's a number (timestamp)
+    if isinstance(val, (int, float)):
+        return _to_datetime(val, unit='s')
+    # Try to convert anything else
+    return _to_datetime(val)
+
+
+def dateonly_filter(val):
+    """Date only without time"""
+    if _is_missing(val):
+        return '—'
+
+    try:
+        # Doesn't look like a date
+        if isinstance(val, str) and not is_date_string(val):
+            return str(val)
+
+        parsed_date = _parse_filter_date(val)
+
+        # If successfully parsed date
+        if parsed_date is not None:
+            # Format ONLY date without time
+            if hasattr(parsed_date, 'date'):
+                return parsed_date.date().strftime('%d.%m.%Y')
+            else:
+                return parsed_date.strftime('%d.%m.%Y')
+
+        return str(val)
+
+    except Exception:
+        return str(val)
+
+
+def datetime_full_filter(val):
+    """Date with time - завжди показує час (навіть 00:00:00)"""
+    if _is_missing(val):
+        return '—'
+
+    try:
+        if isinstance(val, str) and not is_date_string(val):
+            return str(val)
+
+        parsed_date = _parse_filter_date(val)
+
+        if parsed_date is not None:
+            # ЗАВЖДИ показуємо дату + час (навіть якщо час 00:00:00)
+            return parsed_date.strftime('%d.%m.%Y %H:%M:%S')
+
+        return str(val)
+
+    except Exception:
+        return str(val)
+
+
+def datetime_full_no_sec_filter(val):
+    """Date with time without seconds - завжди показує час (навіть 00:00)"""
+    if _is_missing(val):
+        return '—'
+
+    try:
+        if isinstance(val, str) and not is_date_string(val):
+            return str(val)
+
+        parsed_date = _parse_filter_date(val)
+
+        if parsed_date is not None:
+            # ЗАВЖДИ показуємо дату + час без секунд (навіть якщо час 00:00)
+            return parsed_date.strftime('%d.%m.%Y %H:%M')
+
+        return str(val)
+
+    except Exception:
+        return str(val)
+
+
+def number_thousands_filter(val):
+    """Number with thousands separators"""
+    try:
+        if isinstance(val, str):
+            val = val.replace(' ', '').replace(',', '.')
+        num = float(val)
+        formatted = f"{num:.2f}".replace('.', ',')
+        parts = formatted.split(',')
+        integer_part = parts[0]
+        decimal_part = parts[1] if len(parts) > 1 else ''
+        integer_with_spaces = ''
+        for i, digit in enumerate(reversed(integer_part)):
+            if i > 0 and i % 3 == 0:
+                integer_with_spaces = ' ' + integer_with_spaces
+            integer_with_spaces = digit + integer_with_spaces
+        if decimal_part:
+            return integer_with_spaces + ',' + decimal_part
+        else:
+            return integer_with_spaces
+    except Exception:
+        return val
+
+
+def currency_uah_filter(val):
+    """Ukrainian hryvnia currency"""
+    try:
+        formatted = number_thousands_filter(val)
+        return f"{formatted} ₴"
+    except Exception:
+        return val
+
+
+def currency_usd_filter(val):
+    """US dollar currency"""
+    try:
+        formatted = number_thousands_filter(val)
+        return f"{formatted} $"
+    except Exception:
+        return val
+
+
+def _build_jinja_env(jinja2, environment_class=None):
+    jinja_env = (environment_class or jinja2.Environment)()
+
+    # Register filters
+    jinja_env.filters['floatformat'] = floatformat
+    jinja_env.filters['dateonly'] = dateonly_filter
+    jinja_env.filters['datetime_full'] = datetime_full_filter
+    jinja_env.filters['datetime_full_no_sec'] = datetime_full_no_sec_filter
+    jinja_env.filters['number_thousands'] = number_thousands_filter
+    jinja_env.filters['currency_uah'] = currency_uah_filter
+    jinja_env.filters['currency_usd'] = currency_usd_filter
+
+    # Additional date filters (synonyms)
+    jinja_env.filters['date'] = dateonly_filter
+    jinja_env.filters['dateformat'] = dateonly_filter
+    return jinja_env
+
+
+def _load_render_stack():
+    """Imports docxtpl/jinja2 once per process and measures how long it took"""
+    global _DocxTemplate, _jinja_env, _import_seconds
+    if _DocxTemplate is None:
+        started = time.perf_counter()
+        import jinja2
+        from docxtpl import DocxTemplate
+        _jinja_env = _build_jinja_env(jinja2)
+        _DocxTemplate = DocxTemplate
+        _import_seconds = time.perf_counter() - started
+    return _DocxTemplate, _jinja_env
+
+
+def get_jinja_env():
+    """Jinja2 environment with all document filters registered"""
+    return _load_render_stack()[1]
+
+
+def init_worker(cancel_flags, timeout_queue=None, busy_pids=None):
+    """ProcessPoolExecutor initializer: keeps the shared cancel flags, timeout queue and busy table"""
+    global _cancel_flags, _timeout_queue, _busy_pids
+    # Ctrl+C reaches the whole process group; stopping is the parent's job
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _cancel_flags = cancel_flags
+    _timeout_queue = timeout_queue
+    _busy_pids = busy_pids
+
+
+def _mark_busy(options, index, pid):
+    """Records (pid) or clears (0) the worker rendering this row of the run"""
+    slot = options.get("cancel_slot")
+    if _busy_pids is None or slot is None or index is None:
+        return
+    from worker_pool import BusyWorkers
+
+    entry = BusyWorkers.entry(slot, index)
+    if pid or _busy_pids[entry] == os.getpid():
+        _busy_pids[entry] = pid
+
+
+def _start_watchdog(options, index):
+    """
+    Kills this worker process if the document is not finished within
+    options["timeout"] seconds. A render stuck in Python code cannot be
+    interrupted otherwise; the parent restarts the pool and retries the row.
+    """
+    timeout = options.get("timeout")
+    if not timeout or _timeout_queue is None:
+        return None
+
+    def expire():
+        try:
+            _timeout_queue.put((options.get("cancel_slot"), index))
+        finally:
+            os._exit(TIMEOUT_EXIT_CODE)
+
+    watchdog = threading.Timer(timeout, expire)
+    watchdog.daemon = True
+    watchdog.start()
+    return watchdog
+
+
+def _check_cancelled(options):
+    slot = options.get("cancel_slot")
+    if _cancel_flags is not None and slot is not None and _cancel_flags[slot]:
+        raise DocumentCancelled()
+
+
+def preload():
+    """Warm-up entry point for worker pools: returns (pid, import_seconds)"""
+    _load_render_stack()
+    return os.getpid(), _import_seconds
+
+
+def safe_file_name(value):
+    """Filename-safe form of a value: spaces to '_', only alnum and -_. kept"""
+    return "".join(c for c in str(value).replace(" ", "_") if c.isalnum() or c in ('-', '_', '.'))
+
+
+def template_stem(template_path):
+    return os.path.splitext(os.path.basename(template_path))[0]
+
+
+def format_file_name(pattern, borrower_dict, name, template_path, index):
+    """Fills a file name pattern; every substituted value is made filename-safe"""
+    fields = {key: safe_file_name(val) for key, val in borrower_dict.items()}
+    fields.update(name=name, template=safe_file_name(template_stem(template_path)), index=index)
+    return pattern.format_map(fields)
+
+
+def document_name(borrower_dict, file_name_column, common_column, index):
+    """{name} of a row's file names: file_name_column value (or common_column), filename-safe"""
+    return safe_file_name(borrower_dict.get(file_name_column, borrower_dict.get(common_column, f"doc_{index}")))
+
+
+def index_key(val):
+    """Key of a row in the on-disk table index (streaming.py); None never matches"""
+    if _is_missing(val) or not isinstance(val, (int, float, str)):
+        return None
+    return val
+
+
+def _indexed_rows(index, key):
+    """Rows of an indexed table with the given key, in table order"""
+    path, sql_table = index
+    conn = _index_connections.get(path)
+    if conn is None:
+        import pickle
+        import sqlite3
+        conn = _index_connections[path] = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        conn.row_factory = lambda cursor, row: pickle.loads(row[0])
+    return conn.execute(f"SELECT row FROM {sql_table} WHERE key = ? ORDER BY rowid", (key,)).fetchall()
+
+
+def parse_sort(spec):
+    """'date' -> ('date', False), '-sum' -> ('sum', True)"""
+    spec = str(spec)
+    return (spec[1:], True) if spec.startswith("-") else (spec, False)
+
+
+def sort_context_name(tablename, spec):
+    """Context variable of a pre-sorted table: payments_table_by_date, payments_table_by_sum_desc"""
+    column, descending = parse_sort(spec)
+    return f"{tablename}_table_by_{column}{'_desc' if descending else ''}"
+
+
+def sort_positions(records, spec):
+    """Positions of records sorted by a column (stable, missing values last)"""
+    column, descending = parse_sort(spec)
+    present = [n for n, record in enumerate(records) if not _is_missing(record.get(column))]
+    missing = [n for n, record in enumerate(records) if _is_missing(record.get(column))]
+    try:
+        present.sort(key=lambda n: records[n][column], reverse=descending)
+    except TypeError:  # mixed types in one column
+        present.sort(key=lambda n: str(records[n][column]), reverse=descending)
+    return present + missing
+
+
+def numeric_columns(records, columns, common_column):
+    """Columns whose non-missing values are all numbers (bool excluded)"""
+    result = []
+    for col in columns:
+        if col == common_column:
+            continue
+        values = [record.get(col) for record in records if not _is_missing(record.get(col))]
+        if values and all(isinstance(val, (int, float)) and not isinstance(val, bool) for val in values):
+            result.append(col)
+    return result
+
+
+def column_sum(values):
+    """
+    Sum of one key's numbers, the same on every path (pandas, streaming, SQL
+    join): floats are added exactly (math.fsum), so the result does not depend
+    on the order or the engine that added them; integers stay integers.
+    """
+    if any(isinstance(val, float) for val in values):
+        return math.fsum(values)
+    return sum(values)
+
+
+def table_aggregates(records, columns):
+    """{'count', 'sum_<col>', 'min_<col>', 'max_<col>'} of one document's rows"""
+    aggregates = {"count": len(records)}
+    for col in columns:
+        values = [record.get(col) for record in records if not _is_missing(record.get(col))]
+        aggregates[f"sum_{col}"] = column_sum(values)
+        aggregates[f"min_{col}"] = min(values) if values else None
+        aggregates[f"max_{col}"] = max(values) if values else None
+    return aggregates
+
+
+def _context_value(val):
+    """Keeps datetimes, parses date strings and replaces missing values with '—'"""
+    if _is_missing(val):
+        return "—"
+    # If it's a datetime object, keep it as is
+    if isinstance(val, datetime):
+        return val
+    # If it's a date string
+    if isinstance(val, str) and val != "NaT" and is_date_string(val):
+        parsed_date = _to_datetime(val)
+        return parsed_date if parsed_date is not None else val
+    return val
+
+
+def _template_fingerprint(DocxTemplate, jinja_env, path):
+    """
+    (sha256 of the template file, top-level variables it references) - cached per
+    process. Variables are collected from every XML part docxtpl may render;
+    None if the template cannot be parsed (the whole context is then hashed).
+    """
+    stat = os.stat(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _template_fingerprints.get(path)
+    if cached and cached[0] == version:
+        return cached[1], cached[2]
+    import zipfile
+    from jinja2 import meta
+
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    try:
+        tpl = DocxTemplate(path)
+        variables = set()
+        with zipfile.ZipFile(path) as package:
+            for name in package.namelist():
+                if name.endswith(".xml"):
+                    xml = package.read(name).decode("utf-8")
+                    if "{" in xml:
+                        variables |= meta.find_undeclared_variables(jinja_env.parse(tpl.patch_xml(xml)))
+    except Exception:
+        variables = None
+    _template_fingerprints[path] = (version, digest, variables)
+    return digest, variables
+
+
+def render_cache_key(template_digest, variables, context):
+    """Content address of a rendered document: template hash + the context it can see"""
+    if variables is not None:
+        context = {key: context[key] for key in variables if key in context}
+    payload = json.dumps(context, sort_keys=True, ensure_ascii=False,
+                         default=lambda val: f"{type(val).__name__}:{val!r}")
+    return hashlib.sha256(f"{template_digest}\n{payload}".encode("utf-8")).hexdigest()
+
+
+def _link_or_copy(source, target):
+    """Hardlink (same file system) or copy; replaces an existing target"""
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def _unshare(path):
+    """Removes a hardlinked output of an earlier cached run, so saving does not write through it"""
+    try:
+        if os.stat(path).st_nlink > 1:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _publish_to_cache(docx_filename, cache_path):
+    """Adds a rendered document to the cache (atomically; concurrent writers are harmless)"""
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        _link_or_copy(docx_filename, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def process_single_document(args, jinja_env=None):
+    """
+    Function for processing single document in separate process.
+    Must be at module top level for pickle serialization.
+
+    template_path is a path, or a list of (template_path, file_name_pattern):
+    the row context is built once and every template is rendered from it.
+    row_data is (index, row) or (index, row, file_names): output paths relative to
+    output_dir, one per template, assigned by the parent (output_layout.py);
+    without them the worker fills the file name patterns itself.
+
+    Optional 8th element of args is a dict of options:
+    - profile: return per-stage timings in result["timings"]
+    - profile_dir: run the document under cProfile and dump stats there
+    - cancel_slot: index in the shared cancel flags checked between stages
+    - timeout: seconds after which the watchdog kills this worker
+    - render_cache: folder of the content-addressed render cache; a document with the
+      same template and referenced context is linked/copied instead of rendered
+
+    jinja_env: render with this environment instead of the process one (in-process callers only)
+    """
+    global _startup_reported
+    profiler = None
+    watchdog = None
+    index = None
+    options = {}
+    try:
+        (row_data, template_path, output_dir, common_column,
+         file_name_column, other_tables, main_columns) = args[:7]
+        options = args[7] if len(args) > 7 else {}
+
+        # row_data: (index, row) or (index, row, output names assigned by the parent)
+        index, borrower_dict = row_data[:2]
+        file_names = row_data[2] if len(row_data) > 2 else None
+        _check_cancelled(options)
+        _mark_busy(options, index, os.getpid())
+
+        # One-time import cost is reported separately, not as a stage
+        cold_start = _DocxTemplate is None
+        DocxTemplate, process_env = _load_render_stack()
+        jinja_env = jinja_env or process_env
+        watchdog = _start_watchdog(options, index)
+
+        if options.get("profile_dir"):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        timer = StageTimer()
+
+        # Prepare context for template
+        context = {}
+
+        # Add data from main table
+        for col in main_columns:
+            context[f"{col}_credit"] = _context_value(borrower_dict.get(col))
+
+        timer.lap("context")
+
+        # Add data from additional tables
+        borrower_id = borrower_dict.get(common_column)
+        for tablename, df_dict in other_tables.items():
+            columns = df_dict['columns']
+            if common_column not in columns:
+                continue
+
+            # Filter by common column (missing id never matches, as in pandas)
+            key = index_key(borrower_id)
+            positions = None  # matched positions in df_dict['data']
+            if 'index' in df_dict:
+                records = _indexed_rows(df_dict['index'], key) if key is not None else []
+            elif 'rows' in df_dict:
+                # Already joined in the parent (join_engine.py)
+                records = df_dict['rows']
+            else:
+                data = df_dict['data']
+                positions = [] if _is_missing(borrower_id) else [
+                    n for n, record in enumerate(data) if record.get(common_column) == borrower_id]
+                records = [data[n] for n in positions]
+            rows = [{col: _context_value(record.get(col)) for col in columns} for record in records]
+            context[f"{tablename}_table"] = rows
+
+            # Aggregates and sorted lists precomputed in the parent (fallback: this row only)
+            if 'aggregates' in df_dict:
+                aggregates = df_dict['aggregates']
+            else:
+                numeric = df_dict.get('numeric_columns')
+                if numeric is None:
+                    numeric = numeric_columns(records, columns, common_column)
+                aggregates = df_dict.get('aggregates_by_key', {}).get(key) or table_aggregates(records, numeric)
+            for name, val in aggregates.items():
+                context[f"{tablename}_table_{name}"] = _context_value(val)
+            order = df_dict.get('order', {})
+            for spec in df_dict.get('sorts', ()):
+                if spec not in order:
+                    sorted_positions = sort_positions(records, spec)
+                elif positions is not None:
+                    # Global order of the whole table, narrowed to this row's records
+                    rank = {position: n for n, position in enumerate(positions)}
+                    sorted_positions = [rank[position] for position in order[spec] if position in rank]
+                else:
+                    sorted_positions = order[spec]
+                context[sort_context_name(tablename, spec)] = [rows[n] for n in sorted_positions]
+        timer.lap("tables")
+        _check_cancelled(options)
+
+        # Create filename base (unsafe characters removed)
+        safe_name = document_name(borrower_dict, file_name_column, common_column, index)
+
+        if isinstance(template_path, (str, os.PathLike)):
+            template_specs = [(template_path, DEFAULT_FILE_NAME_PATTERN)]
+        else:
+            template_specs = template_path
+
+        # Document generation: one context, every template (stage timings accumulate)
+        filenames = []
+        cache_dir = options.get("render_cache")
+        cache_stats = {"hits": 0, "misses": 0}
+        for n, (spec_path, name_pattern) in enumerate(template_specs):
+            if file_names:
+                docx_filename = os.path.join(output_dir, file_names[n])
+                if os.path.dirname(file_names[n]):
+                    os.makedirs(os.path.dirname(docx_filename), exist_ok=True)
+            else:
+                docx_filename = os.path.join(
+                    output_dir, format_file_name(name_pattern, borrower_dict, safe_name, spec_path, index))
+            cache_path = None
+            if cache_dir:
+                digest, variables = _template_fingerprint(DocxTemplate, jinja_env, spec_path)
+                cache_path = os.path.join(cache_dir, render_cache_key(digest, variables, context) + ".docx")
+                if os.path.exists(cache_path):
+                    _link_or_copy(cache_path, docx_filename)
+                    filenames.append(docx_filename)
+                    cache_stats["hits"] += 1
+                    timer.lap("save")
+                    continue
+                cache_stats["misses"] += 1
+
+            tpl = DocxTemplate(spec_path)
+            tpl.init_docx()
+            timer.lap("load")
+            tpl.render(context, jinja_env)
+            timer.lap("render")
+            _check_cancelled(options)
+
+            _unshare(docx_filename)
+            save_docx(tpl, docx_filename)
+            if cache_path:
+                _publish_to_cache(docx_filename, cache_path)
+            filenames.append(docx_filename)
+            timer.lap("save")
+
+        result = {"success": True, "filename": filenames[0], "filenames": filenames, "index": index}
+        if cache_dir:
+            result["render_cache"] = cache_stats
+        if options.get("profile") or profiler is not None:
+            result["timings"] = timer.timings
+        if cold_start and not _startup_reported:
+            _startup_reported = True
+            result["worker_startup"] = {"pid": os.getpid(), "import_seconds": _import_seconds}
+        if profiler is not None:
+            profiler.disable()
+            profile_path = os.path.join(options["profile_dir"], f"row_{index}.prof")
+            profiler.dump_stats(profile_path)
+            result["profile_path"] = profile_path
+        return result
+
+    except DocumentCancelled:
+        if profiler is not None:
+            profiler.disable()
+        return {"success": False, "cancelled": True, "index": index}
+
+    except Exception as e:
+        if profiler is not None:
+            profiler.disable()
+        return {"success": False, "error": str(e), "index": index}
+
+    finally:
+        if watchdog is not None:
+            watchdog.cancel()
+        _mark_busy(options, index, 0)
@@ -0,0 +1,129 @@
+# session_store.py - Сховище сесій веб-версії в SQLite: спільне для кількох процесів (gunicorn), зупинка між процесами
+"""
+Session/job store of the web app, shared by all HTTP worker processes of one
+host (e.g. gunicorn -w 4) through an SQLite file.
+
+A job is generated in the process that accepted its upload; every other
+process can serve its log and result or stop it: /stop only sets a flag in
+the database, the generating process polls it through stop_flag() (at most
+once per interval). The job's heartbeat is refreshed by polling and by a
+keep_alive() thread, also in phases that do not poll (reading tables, pre-flight,
+archiving). Jobs whose heartbeat is older than stale_after (their process
+died) no longer count as active for cleanup.
+
+Another backend only needs the same methods: create, get, finish,
+request_stop, stop_flag, heartbeat, keep_alive, active_paths, forget_dir.
+"""
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+STOP_POLL_INTERVAL = 1.0
+HEARTBEAT_INTERVAL = 60.0
+# A running job refreshes its heartbeat while generating; silence this long means its process is gone
+STALE_AFTER = 30 * 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    dir TEXT,
+    log TEXT,
+    result TEXT,
+    status TEXT NOT NULL DEFAULT 'running',
+    stop_requested INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    heartbeat REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_status ON sessions (status);
+"""
+
+
+class SessionStore:
+    """Jobs of the web app in an SQLite file (one short connection per call: thread- and process-safe)"""
+
+    def __init__(self, path, stale_after=STALE_AFTER):
+        self.path = path
+        self.stale_after = stale_after
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")  # readers do not wait for the writer
+            conn.executescript(_SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _execute(self, sql, params=()):
+        with closing(self._connect()) as conn:
+            with conn:
+                cursor = conn.execute(sql, params)
+                return cursor.fetchall(), cursor.rowcount
+
+    def create(self, session_id, output_dir, log_path):
+        now = time.time()
+        self._execute("INSERT INTO sessions (id, dir, log, created, heartbeat) VALUES (?, ?, ?, ?, ?)",
+                      (session_id, os.path.abspath(output_dir), log_path, now, now))
+
+    def get(self, session_id):
+        """{"id", "dir", "log", "result", "status", "stop_requested"} or None"""
+        rows, _ = self._execute("SELECT id, dir, log, result, status, stop_requested FROM sessions WHERE id = ?",
+                                (session_id,))
+        if not rows:
+            return None
+        return dict(zip(("id", "dir", "log", "result", "status", "stop_requested"), rows[0]))
+
+    def finish(self, session_id, result=None):
+        """The job is no longer running; result is the archive path (None if it was not built)"""
+        self._execute("UPDATE sessions SET status = ?, result = ?, heartbeat = ? WHERE id = ?",
+                      ("done" if result else "failed", result, time.time(), session_id))
+
+    def request_stop(self, session_id):
+        """Asks the generating process (any process) to stop; False if no such running job"""
+        _, count = self._execute("UPDATE sessions SET stop_requested = 1 WHERE id = ? AND status = 'running'",
+                                 (session_id,))
+        return count > 0
+
+    def heartbeat(self, session_id):
+        """Refreshes the heartbeat; returns True if a stop was requested"""
+        with closing(self._connect()) as conn:
+            with conn:
+                conn.execute("UPDATE sessions SET heartbeat = ? WHERE id = ?", (time.time(), session_id))
+                row = conn.execute("SELECT stop_requested FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return bool(row and row[0])
+
+    def stop_flag(self, session_id, interval=STOP_POLL_INTERVAL):
+        """stop_flag for generate_documents: reads the database at most once per interval"""
+        state = {"checked": 0.0, "stopped": False}
+
+        def stop_flag():
+            now = time.monotonic()
+            if not state["stopped"] and now - state["checked"] >= interval:
+                state["checked"] = now
+                state["stopped"] = self.heartbeat(session_id)
+            return state["stopped"]
+
+        return stop_flag
+
+    def keep_alive(self, session_id, interval=HEARTBEAT_INTERVAL):
+        """Refreshes the heartbeat from a daemon thread until the returned Event is set"""
+        done = threading.Event()
+
+        def beat():
+            while not done.wait(interval):
+                try:
+                    self.heartbeat(session_id)
+                except sqlite3.Error:
+                    pass  # a locked database: the next beat retries
+
+        threading.Thread(target=beat, daemon=True, name=f"heartbeat-{session_id}").start()
+        return done
+
+    def active_paths(self):
+        """Folders and logs of running jobs with a fresh heartbeat (the janitor keeps them)"""
+        rows, _ = self._execute("SELECT dir, log FROM sessions WHERE status = 'running' AND heartbeat > ?",
+                                (time.time() - self.stale_after,))
+        return [path for row in rows for path in row if path]
+
+    def forget_dir(self, path):
+        """The janitor removed a job folder: its session is gone"""
+        self._execute("DELETE FROM sessions WHERE dir = ?", (os.path.abspath(path),))
@@ -0,0 +1,230 @@
+# streaming.py - Потокове читання великих таблиць та дисковий індекс додаткових таблиць
+"""
+Out-of-core mode of generate_documents (streaming=True): the main table is read
+row by row (openpyxl read_only or csv) in chunks, and the additional tables are
+stored in an SQLite file indexed by common_column, which workers query per row
+instead of receiving whole tables with every task.
+"""
+import csv
+import os
+import pickle
+import sqlite3
+import time
+from datetime import datetime
+from itertools import chain, islice
+
+import openpyxl
+
+from tables import SNIFF_ROWS, classify_column
+from render_worker import index_key
+from table_sources import (SQLITE_EXTENSIONS, extension, main_sqlite_table, parse_text_value, sniff_csv_dialect,
+                           split_source)
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def _open_xlsx(path):
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    rows = wb.active.iter_rows()
+    header_cells = next(rows, ())
+    headers = [str(cell.value).strip() if cell.value is not None else f"Column_{n}"
+               for n, cell in enumerate(header_cells)]
+    max_row = wb.active.max_row
+
+    def values():
+        try:
+            for cells in rows:
+                yield [cell.value for cell in cells], cells
+        finally:
+            wb.close()
+
+    return headers, values(), (max_row - 1 if max_row else None)
+
+
+def _open_csv(path):
+    f = open(path, encoding="utf-8-sig", newline="")
+    reader = csv.reader(f, sniff_csv_dialect(f))
+    headers = [header.strip() for header in next(reader, [])]
+
+    def values():
+        with f:
+            for raw in reader:
+                yield raw, None
+
+    return headers, values(), None
+
+
+def _open_sqlite(path, table):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    cursor = conn.execute(f'SELECT * FROM "{table}"')
+    headers = [str(column[0]).strip() for column in cursor.description]
+    estimated = conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0]
+
+    def values():
+        try:
+            for row in cursor:
+                yield list(row), None
+        finally:
+            conn.close()
+
+    return headers, values(), estimated
+
+
+def _open_arrow(path):
+    """Parquet row groups / memory-mapped Feather, converted batch by batch"""
+    try:
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError(f"Reading {extension(path)} files requires pyarrow (pip install pyarrow)") from e
+    if extension(path) == ".parquet":
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        headers = parquet_file.schema_arrow.names
+        batches = parquet_file.iter_batches(batch_size=DEFAULT_CHUNK_SIZE)
+        estimated = parquet_file.metadata.num_rows
+    else:
+        table = pyarrow.feather.read_table(path, memory_map=True)
+        headers = table.column_names
+        batches = table.to_batches(max_chunksize=DEFAULT_CHUNK_SIZE)
+        estimated = table.num_rows
+
+    def values():
+        for batch in batches:
+            for row in batch.to_pylist():
+                yield [row[header] for header in headers], None
+
+    return [str(header).strip() for header in headers], values(), estimated
+
+
+def open_table_stream(path, log_callback=None, dates_as_text=False):
+    """
+    Opens a table for streaming: .xlsx, .csv, .parquet, .feather or an SQLite
+    table ("file.sqlite::table", see table_sources). Returns (columns, iterator of row dicts, estimated row count or None).
+    Columns with leading-zero codes are kept as strings; dates stay datetime
+    unless dates_as_text (ISO strings, as main rows are sent to workers).
+    """
+    file_path, table = split_source(path)
+    if log_callback:
+        log_callback(f"🔍 Analyzing file structure: {os.path.basename(file_path)}{f' :: {table}' if table else ''}")
+    ext = extension(file_path)
+    is_csv = ext == ".csv"
+    if ext in SQLITE_EXTENSIONS:
+        headers, raw_rows, estimated = _open_sqlite(file_path, table or main_sqlite_table(file_path))
+    elif ext in (".parquet", ".feather"):
+        headers, raw_rows, estimated = _open_arrow(file_path)
+    elif is_csv:
+        headers, raw_rows, estimated = _open_csv(file_path)
+    else:
+        headers, raw_rows, estimated = _open_xlsx(file_path)
+
+    # Buffer the first rows for column typing, then continue with the rest
+    sniffed = list(islice(raw_rows, SNIFF_ROWS))
+    text_columns = set()
+    date_columns = []
+    for col_idx, header in enumerate(headers):
+        sample_values = []
+        for values, _ in sniffed:
+            val = values[col_idx] if col_idx < len(values) else None
+            if val not in (None, ""):
+                sample_values.append(parse_text_value(val) if is_csv else val)
+            if len(sample_values) >= 10:
+                break
+        first_cells = sniffed[0][1] if sniffed else None
+        kind = classify_column(header, sample_values, lambda: (
+            first_cells[col_idx].number_format if first_cells and col_idx < len(first_cells) else None))
+        if kind == "text":
+            text_columns.add(header)
+        elif kind == "date":
+            date_columns.append(header)
+    if log_callback:
+        if text_columns:
+            log_callback(f"🔢 Columns with leading zeros: {sorted(text_columns)}")
+        if date_columns:
+            log_callback(f"📅 Date columns: {date_columns}")
+
+    def rows():
+        for values, _ in chain(sniffed, raw_rows):
+            if not any(val not in (None, "") for val in values):
+                continue  # empty line
+            row = {}
+            for header, val in zip(headers, values):
+                if val is None or val == "":
+                    val = None
+                elif header in text_columns:
+                    val = str(val)
+                elif is_csv:
+                    val = parse_text_value(val)
+                elif isinstance(val, datetime) and dates_as_text:
+                    val = val.isoformat()
+                row[header] = val
+            for header in headers[len(values):]:
+                row[header] = None
+            yield row
+
+    return headers, rows(), estimated
+
+
+def iter_chunks(iterable, size):
+    """Yields lists of at most size items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def build_table_index(index_path, sources, common_column, log_callback, stop_flag,
+                      chunk_size=DEFAULT_CHUNK_SIZE, load_times=None):
+    """
+    Streams additional tables into an SQLite file indexed by common_column.
+    sources: [(name, path, sqlite_table or None)] as from table_sources.discover_sources
+    Returns the other_tables mapping for tasks: {name: {"columns", "index": (path, sql_table), "numeric_columns"}}
+    or None if stopped. load_times (dict) receives seconds per table.
+    """
+    conn = sqlite3.connect(index_path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    other_tables = {}
+    try:
+        for n, (name, path, table) in enumerate(sources):
+            if stop_flag():
+                return None
+            started = time.perf_counter()
+            columns, rows, _ = open_table_stream(f"{path}::{table}" if table else path, log_callback)
+            sql_table = f"t{n}"
+            other_tables[name] = {"columns": columns, "index": (index_path, sql_table)}
+            if common_column not in columns:
+                log_callback(f"✓ Skipped table: {name} (no '{common_column}' column)")
+                continue
+
+            conn.execute(f"CREATE TABLE {sql_table} (key, row BLOB)")
+            count = 0
+            # Numeric columns (aggregated by workers): every non-missing value is a number
+            numeric = {col: False for col in columns if col != common_column}
+            for chunk in iter_chunks(rows, chunk_size):
+                if stop_flag():
+                    return None
+                conn.executemany(f"INSERT INTO {sql_table} VALUES (?, ?)",
+                                 [(index_key(row.get(common_column)), pickle.dumps(row, pickle.HIGHEST_PROTOCOL))
+                                  for row in chunk])
+                for col in list(numeric):
+                    for row in chunk:
+                        val = row.get(col)
+                        if val is None:
+                            continue
+                        if isinstance(val, bool) or not isinstance(val, (int, float)):
+                            del numeric[col]
+                            break
+                        numeric[col] = True
+                count += len(chunk)
+            other_tables[name]["numeric_columns"] = [col for col, seen in numeric.items() if seen]
+            conn.execute(f"CREATE INDEX {sql_table}_key ON {sql_table} (key)")
+            conn.commit()
+            seconds = time.perf_counter() - started
+            if load_times is not None:
+                load_times[name] = seconds
+            log_callback(f"✓ Indexed table: {name} ({count} records, {seconds:.2f} sec)")
+        return other_tables
+    finally:
+        conn.close()
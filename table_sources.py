@@ -0,0 +1,203 @@
+# table_sources.py - Джерела таблиць: xlsx, csv, parquet, feather, sqlite
+"""
+Readers for the main and additional tables. Every reader returns DataFrames
+typed by the same rules as smart_read_excel (classify_column): codes with
+leading zeros stay strings, date columns become datetimes.
+
+An SQLite file contributes one table per SQL table; the main table inside an
+SQLite file is chosen as "file.sqlite::table", else the table named "main",
+else the only table of the file.
+"""
+import csv
+import glob
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from tables import SNIFF_ROWS, classify_column, smart_read_excel
+
+SQLITE_EXTENSIONS = (".sqlite", ".sqlite3", ".db")
+TABLE_EXTENSIONS = (".xlsx", ".csv", ".parquet", ".feather") + SQLITE_EXTENSIONS
+MAIN_TABLE_NAME = "main"
+
+
+def parse_text_value(val):
+    """Text cell (CSV) -> None / int / float / str; leading-zero codes stay strings"""
+    if val is None or val == "":
+        return None
+    if not (len(val) > 1 and val.startswith("0") and val.isdigit()):
+        for cast in (int, float):
+            try:
+                return cast(val)
+            except ValueError:
+                pass
+    return val
+
+
+def split_source(path):
+    """'data.sqlite::table' -> ('data.sqlite', 'table'); other paths -> (path, None)"""
+    file_path, _, table = str(path).partition("::")
+    return file_path, table or None
+
+
+def extension(path):
+    return os.path.splitext(split_source(path)[0])[1].lower()
+
+
+def is_supported(path):
+    return extension(path) in TABLE_EXTENSIONS
+
+
+def sniff_csv_dialect(f):
+    """Detects the delimiter (, ; tab) from the beginning of an open text file"""
+    sample = f.read(64 * 1024)
+    f.seek(0)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        return csv.excel
+
+
+def sqlite_tables(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return [name for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY name")]
+    finally:
+        conn.close()
+
+
+def main_sqlite_table(path):
+    """Name of the main table inside an SQLite main source"""
+    file_path, table = split_source(path)
+    if table:
+        return table
+    tables = sqlite_tables(file_path)
+    if MAIN_TABLE_NAME in tables:
+        return MAIN_TABLE_NAME
+    if len(tables) == 1:
+        return tables[0]
+    raise ValueError(f"{os.path.basename(file_path)}: choose the main table as '{file_path}::<table>' "
+                     f"(tables: {', '.join(tables)})")
+
+
+def _missing(val):
+    return val is None or (not isinstance(val, str) and pd.api.types.is_scalar(val) and pd.isna(val))
+
+
+def apply_typing_rules(df, log_callback=None, raw_strings=False):
+    """
+    Types columns like smart_read_excel. raw_strings: every value is text (CSV),
+    non-code columns are converted to numbers where possible.
+    """
+    text_columns = []
+    date_columns = []
+    for column in df.columns:
+        values = df[column].head(SNIFF_ROWS).tolist()
+        sample = [parse_text_value(val) if raw_strings else val for val in values if not _missing(val)][:10]
+        kind = classify_column(str(column), sample, lambda: None)
+        if kind == "text":
+            text_columns.append(column)
+            df[column] = df[column].map(lambda val: None if _missing(val) or val == "" else str(val))
+            continue
+        if raw_strings:
+            df[column] = df[column].map(lambda val: None if _missing(val) else parse_text_value(val))
+        if kind == "date" and not pd.api.types.is_datetime64_any_dtype(df[column]):
+            try:
+                df[column] = pd.to_datetime(df[column])
+                date_columns.append(column)
+            except (ValueError, TypeError):
+                pass  # mixed content: workers parse date strings per value
+        elif kind == "date":
+            date_columns.append(column)
+
+    if log_callback:
+        if text_columns:
+            log_callback(f"🔢 Columns with leading zeros: {text_columns}")
+        if date_columns:
+            log_callback(f"📅 Date columns: {date_columns}")
+    df.columns = [str(column).strip() for column in df.columns]
+    return df
+
+
+def _read_csv(path):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        dialect = sniff_csv_dialect(f)
+    return pd.read_csv(path, sep=dialect.delimiter, dtype=str, keep_default_na=False, encoding="utf-8-sig")
+
+
+def _read_arrow(path, reader):
+    try:
+        return reader(path)
+    except ImportError as e:
+        raise ImportError(f"Reading {extension(path)} files requires pyarrow (pip install pyarrow)") from e
+
+
+def read_sqlite_table(path, table):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return pd.read_sql_query(f'SELECT * FROM "{table}"', conn)
+    finally:
+        conn.close()
+
+
+def _read_one(path, log_callback, table=None):
+    ext = extension(path)
+    if ext == ".xlsx":
+        return smart_read_excel(path, log_callback)
+    if log_callback:
+        log_callback(f"🔍 Analyzing file structure: {os.path.basename(path)}{f' :: {table}' if table else ''}")
+    if ext == ".csv":
+        return apply_typing_rules(_read_csv(path), log_callback, raw_strings=True)
+    if ext == ".parquet":
+        return apply_typing_rules(_read_arrow(path, pd.read_parquet), log_callback)
+    if ext == ".feather":
+        return apply_typing_rules(_read_arrow(path, pd.read_feather), log_callback)
+    if ext in SQLITE_EXTENSIONS:
+        return apply_typing_rules(read_sqlite_table(path, table), log_callback)
+    raise ValueError(f"Unsupported table format: {os.path.basename(path)}")
+
+
+def read_main_table(main_path, log_callback=None):
+    """Returns (DataFrame, load seconds) of the main table from any supported source"""
+    started = time.perf_counter()
+    file_path, _ = split_source(main_path)
+    table = main_sqlite_table(main_path) if extension(main_path) in SQLITE_EXTENSIONS else None
+    df = _read_one(file_path, log_callback, table)
+    return df, time.perf_counter() - started
+
+
+def discover_sources(root_dir, main_path):
+    """
+    Additional table sources in root_dir: [(name, path, sqlite_table or None)].
+    The main table itself is excluded (for SQLite - only its main table).
+    """
+    sources = []
+    for path in sorted(glob.glob(os.path.join(root_dir, "*"))):
+        if os.path.isfile(path):
+            sources.extend(file_sources(path, main_path))
+    return sources
+
+
+def file_sources(path, main_path):
+    """Table sources of one file: [(name, path, sqlite_table or None)], [] if not a supported table"""
+    if not is_supported(path) or os.path.basename(path).startswith("~$"):
+        return []
+    is_main_file = os.path.abspath(path) == os.path.abspath(split_source(main_path)[0])
+    if extension(path) in SQLITE_EXTENSIONS:
+        main_table = main_sqlite_table(main_path) if is_main_file else None
+        return [(table.lower(), path, table) for table in sqlite_tables(path)
+                if not (is_main_file and table == main_table)]
+    if is_main_file:
+        return []
+    return [(os.path.splitext(os.path.basename(path))[0].lower(), path, None)]
+
+
+def read_source(path, table=None, log_callback=None):
+    """Returns (DataFrame, load seconds) of one additional table"""
+    started = time.perf_counter()
+    df = _read_one(path, log_callback, table)
+    return df, time.perf_counter() - started
@@ -0,0 +1,236 @@
+# tables.py - Читання таблиць, визначення типів колонок та підготовка рядків для воркерів
+"""
+Table helpers shared by generator, streaming, table_sources, join_engine and
+preview: column typing rules, smart Excel reading and conversion of rows and
+tables to the plain values that are sent to render workers.
+"""
+import os
+import time
+from datetime import datetime
+
+import openpyxl
+import pandas as pd
+
+from render_worker import column_sum, index_key, sort_positions
+from utils import is_date_string
+
+
+# Data rows sampled to detect text (leading zeros) and date columns
+SNIFF_ROWS = 20
+
+
+def classify_column(header, sample_values, first_number_format):
+    """
+    Typing rules shared by all table readers. Returns "text" for codes with
+    leading zeros (read as strings), "date" for date columns, otherwise None.
+    first_number_format: callable returning the number format of the first data cell
+    """
+    # Check for leading zeros
+    for val in sample_values[:5]:  # Check first 5 values
+        if isinstance(val, str):
+            # If string starts with 0 and contains only digits
+            if val.startswith('0') and len(val) > 1 and val.isdigit():
+                return "text"
+        elif isinstance(val, (int, float)):
+            # Check if this was originally a string with leading zero
+            # This can be determined by cell format
+            number_format = first_number_format()
+            if number_format and (number_format.startswith('0') or number_format == '@'):
+                return "text"
+
+    # Check for dates
+    for val in sample_values[:3]:
+        if isinstance(val, datetime):
+            return "date"
+        elif isinstance(val, str):
+            # Check strings for date similarity
+            if any(word in header.lower() for word in ['date', 'дата', 'время', 'time', 'created', 'updated']):
+                return "date"
+            # Or by content
+            if is_date_string(val):
+                return "date"
+    return None
+
+
+def _sniff_row_numbers(max_row, spread):
+    """Data rows sampled for typing: the first SNIFF_ROWS, or SNIFF_ROWS spread over the sheet"""
+    last = min(max_row, SNIFF_ROWS + 1) if max_row else SNIFF_ROWS + 1
+    if not spread or not max_row or max_row <= SNIFF_ROWS + 1:
+        return set(range(2, last + 1))
+    step = (max_row - 2) / (SNIFF_ROWS - 1)
+    return {2 + round(k * step) for k in range(SNIFF_ROWS)}
+
+
+def smart_read_excel(file_path, log_callback=None, spread_sample=False):
+    """
+    Smart Excel reader that:
+    - Preserves leading zeros for numeric codes
+    - Properly handles dates
+    - Automatically determines data types
+    spread_sample: type columns from rows spread over the whole sheet instead of
+    the first SNIFF_ROWS (one sequential pass up to the last sampled row)
+    The sniffing time is logged and kept in df.attrs["sniff_seconds"].
+    """
+    if log_callback:
+        log_callback(f"🔍 Analyzing file structure: {os.path.basename(file_path)}")
+
+    # Step 1: Analyze source file using openpyxl: one row-major pass in read-only
+    # mode, without loading the whole sheet or random cell access
+    sniff_started = time.perf_counter()
+    wb = openpyxl.load_workbook(file_path, read_only=True, data_only=False)
+    try:
+        ws = wb.active
+
+        # Get headers
+        headers = []
+        for header_row in ws.iter_rows(max_row=1):
+            for cell in header_row:
+                if cell.value is not None:
+                    headers.append(str(cell.value).strip())
+                else:
+                    headers.append(f"Column_{len(headers)}")
+
+        # First 10 non-empty sampled values per column; the first data row's
+        # format tells numeric codes stored with leading zeros
+        samples = [[] for _ in headers]
+        first_formats = [None] * len(headers)
+        sample_rows = _sniff_row_numbers(ws.max_row, spread_sample)
+        rows = ws.iter_rows(min_row=2, max_row=max(sample_rows)) if sample_rows else ()
+        for row_idx, row in enumerate(rows, 2):
+            if row_idx not in sample_rows:
+                continue
+            for col_idx, cell in enumerate(row[:len(headers)]):
+                if row_idx == 2:
+                    first_formats[col_idx] = cell.number_format
+                if cell.value is not None and len(samples[col_idx]) < 10:
+                    samples[col_idx].append(cell.value)
+    finally:
+        wb.close()
+
+    # Analyze each column
+    text_columns = []
+    date_columns = []
+
+    for col_idx, header in enumerate(headers):
+        sample_values = samples[col_idx]
+        if not sample_values:
+            continue
+
+        column_kind = classify_column(header, sample_values, lambda: first_formats[col_idx])
+
+        # Save analysis results
+        if column_kind == "text":
+            text_columns.append(header)
+        elif column_kind == "date":
+            date_columns.append(header)
+    sniff_seconds = time.perf_counter() - sniff_started
+
+    if log_callback:
+        if text_columns:
+            log_callback(f"🔢 Columns with leading zeros: {text_columns}")
+        if date_columns:
+            log_callback(f"📅 Date columns: {date_columns}")
+        log_callback(f"⏱️ Column types detected in {sniff_seconds:.3f} sec "
+                     f"({len(sample_rows)} {'spread' if spread_sample else 'first'} rows)")
+
+    # Step 2: Read file with correct types
+    dtype_dict = {}
+
+    # Read leading zeros columns as strings
+    for col in text_columns:
+        dtype_dict[col] = str
+
+    # Prepare parameters for pandas
+    read_params = {
+        'io': file_path,
+        'dtype': dtype_dict if dtype_dict else None
+    }
+
+    # If there are date columns, specify them for parsing
+    if date_columns:
+        read_params['parse_dates'] = date_columns
+
+    # Read file
+    df = pd.read_excel(**read_params)
+    df.columns = df.columns.str.strip()
+    df.attrs["sniff_seconds"] = sniff_seconds
+
+    return df
+
+
+def _to_plain_value(val):
+    """
+    Converts pandas/numpy scalars to builtins, so that worker processes can
+    unpickle tasks without importing pandas (see render_worker).
+    """
+    if val is None or (pd.api.types.is_scalar(val) and pd.isna(val)):
+        return None
+    if isinstance(val, pd.Timestamp):
+        return val.to_pydatetime()
+    if hasattr(val, 'item') and not isinstance(val, (str, bytes)):
+        return val.item()  # numpy scalar
+    return val
+
+
+def table_records(df):
+    """DataFrame -> list of row dicts with plain Python values"""
+    columns = df.columns.tolist()
+    return [
+        {col: _to_plain_value(val) for col, val in zip(columns, values)}
+        for values in df.itertuples(index=False, name=None)
+    ]
+
+
+def table_aggregates_by_key(df, common_column):
+    """
+    Per-key count/sum/min/max of the numeric columns, vectorized with groupby:
+    ({key: {"count", "sum_<col>", "min_<col>", "max_<col>"}}, numeric columns)
+    """
+    numeric = [col for col in df.columns if col != common_column
+               and pd.api.types.is_numeric_dtype(df[col]) and not pd.api.types.is_bool_dtype(df[col])]
+    if common_column not in df.columns:
+        return {}, numeric
+    grouped = df.groupby(common_column, sort=False)
+    stats = grouped[numeric].agg(["sum", "min", "max"]) if numeric else None
+    # Float sums as in the workers and the SQL join (column_sum), not pandas' own summation
+    float_sums = {col: grouped[col].agg(lambda values: column_sum(values.dropna().tolist()))
+                  for col in numeric if pd.api.types.is_float_dtype(df[col])}
+    aggregates = {}
+    for group_key, count in grouped.size().items():
+        key = index_key(_to_plain_value(group_key))
+        if key is None:
+            continue
+        values = {"count": int(count)}
+        for col in numeric:
+            for stat in ("sum", "min", "max"):
+                values[f"{stat}_{col}"] = _to_plain_value(stats.at[group_key, (col, stat)])
+            if col in float_sums:
+                values[f"sum_{col}"] = float(float_sums[col][group_key])
+        aggregates[key] = values
+    return aggregates, numeric
+
+
+def prepare_table(df, common_column, sorts=()):
+    """other_tables entry of one additional table: plain Python values, aggregates and sort orders"""
+    records = table_records(df)
+    aggregates_by_key, numeric = table_aggregates_by_key(df, common_column)
+    sorts = list(sorts)
+    return {
+        'data': records,
+        'columns': df.columns.tolist(),
+        'aggregates_by_key': aggregates_by_key,
+        'numeric_columns': numeric,
+        'sorts': sorts,
+        'order': {spec: sort_positions(records, spec) for spec in sorts},
+    }
+
+
+def row_record(row):
+    """Main table row (Series) -> task row dict; datetimes become ISO strings, the rest plain values"""
+    row_dict = row.to_dict()
+    for key, val in row_dict.items():
+        if isinstance(val, (pd.Timestamp, datetime)) and not pd.isna(val):
+            row_dict[key] = val.isoformat()
+        else:
+            row_dict[key] = _to_plain_value(val)
+    return row_dict
@@ -0,0 +1,53 @@
+# test_autoscale.py - Перевірка адаптивної кількості воркерів: спад при нестачі пам'яті та відновлення
+import autoscale
+from autoscale import AdaptiveConcurrency
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def run_window(scaler, clock, rss_by_pid, done=20):
+    """One measurement window: `done` documents in scaler.interval seconds by the given busy workers"""
+    scaler.record_completion(done)
+    clock.now += scaler.interval
+    return scaler.maybe_adjust(list(rss_by_pid))
+
+
+def test_target_recovers_after_memory_use_falls(monkeypatch):
+    clock = FakeClock()
+    rss = {}
+    monkeypatch.setattr(autoscale, "time", clock)
+    monkeypatch.setattr(autoscale, "process_rss_mb", lambda pid: rss.get(pid))
+    scaler = AdaptiveConcurrency(baseline=4, max_workers=8, memory_limit_mb=1000)
+    clock.now = scaler._window_start
+
+    # Four busy workers of 400 MB exceed the 1000 MB budget
+    rss.update({pid: 400 for pid in range(1, 5)})
+    assert run_window(scaler, clock, rss) == 2
+
+    # The rows that needed the memory are done: two busy workers of 100 MB, same speed
+    rss.clear()
+    rss.update({1: 100, 2: 100})
+    targets = [run_window(scaler, clock, rss) for _ in range(AdaptiveConcurrency.PLATEAU_WINDOWS + 2)]
+    assert targets[-1] > 2
+    assert scaler.adjustments[-1]["reason"] == "throughput improving"
+
+
+def test_target_holds_while_memory_stays_high(monkeypatch):
+    clock = FakeClock()
+    rss = {pid: 400 for pid in range(1, 5)}
+    monkeypatch.setattr(autoscale, "time", clock)
+    monkeypatch.setattr(autoscale, "process_rss_mb", lambda pid: rss.get(pid))
+    scaler = AdaptiveConcurrency(baseline=4, max_workers=8, memory_limit_mb=1000)
+    clock.now = scaler._window_start
+
+    assert run_window(scaler, clock, rss) == 2
+    rss.pop(3), rss.pop(4)
+    for _ in range(AdaptiveConcurrency.PLATEAU_WINDOWS + 5):
+        # Two 400 MB workers: a third would not fit into 1000 MB
+        assert run_window(scaler, clock, rss) == 2
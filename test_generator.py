@@ -120,7 +120,7 @@ class DocumentTestRunner:
             main_file = self.test_folder / "main.xlsx"
 
             # Читаємо дані
-            from generator import smart_read_excel
+            from tables import smart_read_excel
             df = smart_read_excel(str(main_file), self.log)
 
             if len(df) == 0:
@@ -1,31 +1,37 @@
 import sys
 import os
+import shutil
+import tempfile
 import threading
+from collections import deque
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QHBoxLayout,
-                             QWidget, QLabel, QLineEdit, QPushButton, QTextEdit,
+                             QWidget, QLabel, QLineEdit, QPushButton, QPlainTextEdit,
                              QFileDialog, QGridLayout, QMessageBox, QProgressBar,
-                             QGroupBox, QFrame, QCheckBox)
-from PyQt5.QtCore import QThread, pyqtSignal, Qt
-from PyQt5.QtGui import QFont, QIcon
+                             QGroupBox, QFrame, QCheckBox, QSpinBox)
+from PyQt5.QtCore import QObject, QThread, QTimer, QUrl, pyqtSignal, Qt
+from PyQt5.QtGui import QDesktopServices, QFont, QIcon
 from generator import generate_documents
+from log_pipeline import LogFile, LogPipeline
+from preview import PreviewError, render_preview
 from test_generator import run_integration_test
+from worker_pool import WarmWorkerPool
 
+# Перезапуск процесу-воркера після N документів (обмеження пам'яті)
+WORKER_MAX_TASKS = 500
+# Кілька шаблонів у полі вводу розділяються цим рядком
+TEMPLATE_SEPARATOR = "; "
+# Рядків у вікні журналу; повний журнал генерації пишеться у файл у папці збереження
+LOG_MAX_LINES = 5000
+LOG_FILE_NAME = "generation.log"
+# Як часто вікно журналу отримує накопичені повідомлення, мс
+LOG_FLUSH_INTERVAL_MS = 100
+# Попередній перегляд пишеться в тимчасову папку (видаляється при закритті програми)
+PREVIEW_DIR = os.path.join(tempfile.gettempdir(), "docx_generator_preview")
 
-class LoggerThread(QThread):
-    """Потік для обробки логування без блокування UI"""
-    log_signal = pyqtSignal(str)
 
-    def __init__(self):
-        super().__init__()
-        self.messages = []
-        self.running = True
-
-    def add_message(self, message):
-        self.messages.append(message)
-        self.log_signal.emit(message)
-
-    def stop(self):
-        self.running = False
+class LogEmitter(QObject):
+    """Передає пачки повідомлень LogPipeline у потік інтерфейсу"""
+    log_batch_signal = pyqtSignal(list)
 
 
 class TestThread(QThread):
@@ -51,11 +57,11 @@ class TestThread(QThread):
 
 class GeneratorThread(QThread):
     """Потік для генерації документів"""
-    log_signal = pyqtSignal(str)
+    log_batch_signal = pyqtSignal(list)
     finished_signal = pyqtSignal()
 
     def __init__(self, root_dir, main_file, template_file, output_dir,
-                 common_column, file_name_column, run_tests=True):
+                 common_column, file_name_column, run_tests=True, pool=None):
         super().__init__()
         self.root_dir = root_dir
         self.main_file = main_file
@@ -64,10 +70,27 @@ class GeneratorThread(QThread):
         self.common_column = common_column
         self.file_name_column = file_name_column
         self.run_tests = run_tests
+        self.pool = pool
         self.stop_flag = False
+        self.log_pipeline = None
 
     def run(self):
         try:
+            # Повний журнал - у файл (вікно показує лише останні LOG_MAX_LINES рядків);
+            # генерація лише кладе повідомлення в чергу і ніколи не чекає на запис
+            sinks = [self.log_batch_signal.emit]
+            log_error = None
+            try:
+                os.makedirs(self.output_dir, exist_ok=True)
+                sinks.append(LogFile(os.path.join(self.output_dir, LOG_FILE_NAME), mode="w"))
+            except OSError as e:
+                log_error = e
+            self.log_pipeline = LogPipeline(sinks)
+            if log_error:
+                self.log_message(f"⚠️ Не вдалося створити файл журналу: {log_error}")
+            else:
+                self.log_message(f"📝 Повний журнал: {sinks[-1].path}")
+
             # Спочатку запускаємо тести якщо потрібно
             if self.run_tests:
                 self.log_message("=" * 50)
@@ -101,20 +124,55 @@ class GeneratorThread(QThread):
                 common_column=self.common_column,
                 file_name_column=self.file_name_column,
                 log_callback=self.log_message,
-                stop_flag=lambda: self.stop_flag
+                stop_flag=lambda: self.stop_flag,
+                pool=self.pool
             )
         except Exception as e:
             self.log_message(f"❌ Критична помилка: {str(e)}")
         finally:
+            if self.log_pipeline:
+                self.log_pipeline.close()
             self.finished_signal.emit()
 
     def log_message(self, message):
-        self.log_signal.emit(message)
+        self.log_pipeline(message)
 
     def stop_generation(self):
         self.stop_flag = True
 
 
+class PreviewThread(QThread):
+    """Потік попереднього перегляду одного рядка (таблиці кешуються між переглядами)"""
+    log_signal = pyqtSignal(str)
+    preview_ready_signal = pyqtSignal(list)  # шляхи створених файлів; порожній - помилка
+
+    def __init__(self, root_dir, main_file, template_file, row, common_column, file_name_column, pdf=False):
+        super().__init__()
+        self.root_dir = root_dir
+        self.main_file = main_file
+        self.template_file = template_file
+        self.row = row
+        self.common_column = common_column
+        self.file_name_column = file_name_column
+        self.pdf = pdf
+
+    def run(self):
+        files = []
+        try:
+            # Окрема папка на кожен перегляд: попередній файл може бути ще відкритий у Word
+            os.makedirs(PREVIEW_DIR, exist_ok=True)
+            output_dir = tempfile.mkdtemp(prefix=f"row_{self.row}_", dir=PREVIEW_DIR)
+            files = render_preview(self.root_dir, self.main_file, self.template_file, self.row, output_dir,
+                                   self.common_column, self.file_name_column, pdf=self.pdf,
+                                   log_callback=self.log_signal.emit)
+        except PreviewError as e:
+            self.log_signal.emit(f"❌ Попередній перегляд: {e}")
+        except Exception as e:
+            self.log_signal.emit(f"❌ Критична помилка перегляду: {str(e)}")
+        finally:
+            self.preview_ready_signal.emit(files)
+
+
 class ModernButton(QPushButton):
     """Проста стилізована кнопка"""
 
@@ -171,9 +229,21 @@ class App(QMainWindow):
         super().__init__()
         self.generator_thread = None
         self.test_thread = None
-        self.logger_thread = LoggerThread()
-        self.logger_thread.log_signal.connect(self.log_write)
-        self.logger_thread.start()
+        self.preview_thread = None
+        # Повідомлення накопичуються і виводяться пачкою раз на LOG_FLUSH_INTERVAL_MS
+        self.pending_log = deque(maxlen=LOG_MAX_LINES)
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.flush_log)
+        self.log_timer.start(LOG_FLUSH_INTERVAL_MS)
+        # Повідомлення фонових потоків (пул процесів) - через неблокуючу чергу
+        self.log_emitter = LogEmitter()
+        self.log_emitter.log_batch_signal.connect(self.log_write_batch)
+        self.app_log = LogPipeline([self.log_emitter.log_batch_signal.emit])
+
+        # Пул процесів живе весь час роботи програми і прогрівається у фоні
+        self.worker_pool = WarmWorkerPool(max_tasks_per_child=WORKER_MAX_TASKS,
+                                          log_callback=self.app_log)
+        self.worker_pool.warm_up_async()
 
         self.init_ui()
         self.apply_modern_style()
@@ -295,7 +365,7 @@ class App(QMainWindow):
         self.main_file = ModernLineEdit()
         self.main_file.setPlaceholderText("Основний Excel файл...")
         self.template_file = ModernLineEdit()
-        self.template_file.setPlaceholderText("Word шаблон...")
+        self.template_file.setPlaceholderText("Word шаблон(и), через ';'...")
         self.output_dir = ModernLineEdit()
         self.output_dir.setText("output_docs")
         self.output_dir.setPlaceholderText("Папка збереження...")
@@ -393,9 +463,28 @@ class App(QMainWindow):
         self.stop_btn.clicked.connect(self.stop_generation)
         self.stop_btn.setEnabled(False)
 
+        # Попередній перегляд одного рядка без запуску всієї генерації
+        self.preview_row = QSpinBox()
+        self.preview_row.setRange(0, 10 ** 7)
+        self.preview_row.setToolTip("Номер рядка з 0, як у журналі генерації")
+        self.preview_pdf_checkbox = QCheckBox("PDF")
+
+        self.preview_btn = ModernButton("Попередній перегляд")
+        self.preview_btn.setStyleSheet(self.preview_btn.styleSheet() + """
+            QPushButton {
+                min-height: 35px;
+                min-width: 140px;
+            }
+        """)
+        self.preview_btn.clicked.connect(self.preview)
+
         control_layout.addWidget(self.start_btn)
         control_layout.addWidget(self.stop_btn)
         control_layout.addStretch()
+        control_layout.addWidget(QLabel("Рядок:"))
+        control_layout.addWidget(self.preview_row)
+        control_layout.addWidget(self.preview_pdf_checkbox)
+        control_layout.addWidget(self.preview_btn)
 
         main_layout.addLayout(control_layout)
 
@@ -404,9 +493,10 @@ class App(QMainWindow):
         log_group.setStyleSheet(files_group.styleSheet())
         log_layout = QVBoxLayout(log_group)
 
-        self.log = QTextEdit()
+        self.log = QPlainTextEdit()
+        self.log.setMaximumBlockCount(LOG_MAX_LINES)
         self.log.setStyleSheet("""
-            QTextEdit {
+            QPlainTextEdit {
                 border: 1px solid #cccccc;
                 border-radius: 4px;
                 padding: 8px;
@@ -455,9 +545,28 @@ class App(QMainWindow):
         """)
 
     def log_write(self, text):
-        """Додає текст до логу"""
-        self.log.append(text)
-        self.log.ensureCursorVisible()
+        """Додає текст до логу (з'явиться при наступному flush_log)"""
+        self.pending_log.append(text)
+
+    def log_write_batch(self, lines):
+        """Пачка повідомлень від LogPipeline"""
+        self.pending_log.extend(lines)
+
+    def flush_log(self):
+        """Виводить накопичені повідомлення одним оновленням віджета"""
+        if not self.pending_log:
+            return
+        scroll_bar = self.log.verticalScrollBar()
+        at_bottom = scroll_bar.value() >= scroll_bar.maximum() - 2
+        self.log.appendPlainText("\n".join(self.pending_log))
+        self.pending_log.clear()
+        # Прокручуємо лише якщо користувач не гортає журнал вище
+        if at_bottom:
+            scroll_bar.setValue(scroll_bar.maximum())
+
+    def clear_log(self):
+        self.pending_log.clear()
+        self.log.clear()
 
     def select_root_dir(self):
         dirname = QFileDialog.getExistingDirectory(self, "Оберіть папку з Excel файлами")
@@ -466,16 +575,21 @@ class App(QMainWindow):
 
     def select_main_file(self):
         filename, _ = QFileDialog.getOpenFileName(
-            self, "Оберіть основний Excel-файл", "", "Excel files (*.xlsx)")
+            self, "Оберіть основну таблицю", "",
+            "Таблиці (*.xlsx *.csv *.parquet *.feather *.sqlite *.sqlite3 *.db);;Excel files (*.xlsx)")
         if filename:
             self.main_file.setText(filename)
             self.root_dir.setText(os.path.dirname(filename))
 
     def select_template_file(self):
-        filename, _ = QFileDialog.getOpenFileName(
-            self, "Оберіть шаблон DOCX", "", "DOCX files (*.docx)")
-        if filename:
-            self.template_file.setText(filename)
+        filenames, _ = QFileDialog.getOpenFileNames(
+            self, "Оберіть шаблон(и) DOCX", "", "DOCX files (*.docx)")
+        if filenames:
+            self.template_file.setText(TEMPLATE_SEPARATOR.join(filenames))
+
+    def template_paths(self):
+        """Шляхи шаблонів з поля вводу (кілька - через ';')"""
+        return [path.strip() for path in self.template_file.text().split(TEMPLATE_SEPARATOR.strip()) if path.strip()]
 
     def select_output_dir(self):
         dirname = QFileDialog.getExistingDirectory(self, "Оберіть папку для збереження DOCX")
@@ -485,7 +599,7 @@ class App(QMainWindow):
     def run_tests_only(self):
         """Запускає тільки тести без основної генерації"""
         # Очищаємо лог
-        self.log.clear()
+        self.clear_log()
 
         # Запуск тестів в окремому потоці
         self.test_thread = TestThread()
@@ -525,23 +639,25 @@ class App(QMainWindow):
                                  "Основний Excel файл не знайдено!")
             return
 
-        if not os.path.exists(self.template_file.text()):
+        missing_templates = [path for path in self.template_paths() if not os.path.exists(path)]
+        if missing_templates:
             QMessageBox.critical(self, "Помилка",
-                                 "Файл шаблону не знайдено!")
+                                 "Файл шаблону не знайдено!\n" + "\n".join(missing_templates))
             return
 
         # Запуск генерації в окремому потоці
         self.generator_thread = GeneratorThread(
             self.root_dir.text(),
             self.main_file.text(),
-            self.template_file.text(),
+            self.template_paths(),
             self.output_dir.text(),
             self.common_column.text() or "id",
             self.file_name_column.text() or "id",
-            run_tests=self.run_tests_checkbox.isChecked()
+            run_tests=self.run_tests_checkbox.isChecked(),
+            pool=self.worker_pool
         )
 
-        self.generator_thread.log_signal.connect(self.log_write)
+        self.generator_thread.log_batch_signal.connect(self.log_write_batch)
         self.generator_thread.finished_signal.connect(self.generation_finished)
 
         # Блокуємо кнопку старту та активуємо стоп
@@ -549,11 +665,37 @@ class App(QMainWindow):
         self.stop_btn.setEnabled(True)
 
         # Очищаємо лог
-        self.log.clear()
+        self.clear_log()
 
         # Запускаємо потік
         self.generator_thread.start()
 
+    def preview(self):
+        """Рендерить один рядок і відкриває документ (таблиці кешуються для наступних переглядів)"""
+        if not all([self.main_file.text(), self.template_file.text()]):
+            QMessageBox.warning(self, "Увага", "Оберіть основну таблицю і шаблон!")
+            return
+
+        self.preview_thread = PreviewThread(
+            self.root_dir.text() or os.path.dirname(self.main_file.text()),
+            self.main_file.text(),
+            self.template_paths(),
+            self.preview_row.value(),
+            self.common_column.text() or "id",
+            self.file_name_column.text() or "id",
+            pdf=self.preview_pdf_checkbox.isChecked()
+        )
+        self.preview_thread.log_signal.connect(self.log_write)
+        self.preview_thread.preview_ready_signal.connect(self.preview_ready)
+        self.preview_btn.setEnabled(False)
+        self.preview_thread.start()
+
+    def preview_ready(self, files):
+        """Відкриває документи перегляду у програмі за замовчуванням"""
+        self.preview_btn.setEnabled(True)
+        for path in files:
+            QDesktopServices.openUrl(QUrl.fromLocalFile(path))
+
     def stop_generation(self):
         """Зупиняє генерацію документів"""
         if self.generator_thread:
@@ -579,11 +721,17 @@ class App(QMainWindow):
             if reply == QMessageBox.Yes:
                 self.generator_thread.stop_generation()
                 self.generator_thread.wait(3000)  # Чекаємо до 3 секунд
+                self.worker_pool.shutdown(wait=False)
+                self.app_log.close(timeout=1)
                 event.accept()
             else:
                 event.ignore()
         else:
+            self.worker_pool.shutdown(wait=False)
+            self.app_log.close(timeout=1)
             event.accept()
+        if event.isAccepted():
+            shutil.rmtree(PREVIEW_DIR, ignore_errors=True)
 
 
 def main():
@@ -0,0 +1,146 @@
+# upload_extract.py - Фонове розпакування архіву таблиць з лімітами розміру; таблиці читаються одразу після розпакування
+"""
+Background extraction of an uploaded archive of additional tables.
+
+TableArchiveExtractor unpacks the zip in its own thread, member by member in
+chunks, and hands every extracted table to sources(): the generator passed to
+generate_documents(table_sources=...), so the first table is parsed while the
+next ones are still being extracted (and the main table is read meanwhile).
+
+Only supported table files are extracted (flattened into dest_dir, folders in
+the archive are ignored). Limits: bytes per member and in total (counted while
+writing, not taken from the zip headers), number of members, and the free disk
+space for the declared sizes. A violated limit stops the job with an error.
+"""
+import os
+import queue
+import shutil
+import threading
+import zipfile
+
+MAX_MEMBER_BYTES = 1024 ** 3
+MAX_TOTAL_BYTES = 4 * 1024 ** 3
+MAX_MEMBERS = 10000
+# Free space left on the disk after extraction
+DISK_RESERVE_BYTES = 512 * 1024 ** 2
+CHUNK_SIZE = 1024 * 1024
+
+_DONE = object()
+
+
+class ArchiveLimitError(ValueError):
+    """The archive breaks a size or count limit"""
+
+
+def _member_file_name(member):
+    """Base name of an archive member, or None for folders and service files"""
+    path = member.replace("\\", "/")
+    name = path.rsplit("/", 1)[-1]
+    if not name or name in (".", "..") or "\0" in name or path.startswith("__MACOSX/") or name.startswith("._"):
+        return None
+    return name
+
+
+class TableArchiveExtractor:
+    """Extracts the table files of zip_path into dest_dir in a background thread"""
+
+    def __init__(self, zip_path, dest_dir, max_member_bytes=MAX_MEMBER_BYTES, max_total_bytes=MAX_TOTAL_BYTES,
+                 max_members=MAX_MEMBERS, stop_flag=None, log_callback=None):
+        self.zip_path = zip_path
+        self.dest_dir = dest_dir
+        self.max_member_bytes = max_member_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_members = max_members
+        self.stop_flag = stop_flag or (lambda: False)
+        self.log_callback = log_callback or (lambda message: None)
+        self.extracted_bytes = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="table-extractor", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            with zipfile.ZipFile(self.zip_path) as archive:
+                for info, name in self._plan(archive):
+                    if self.stop_flag():
+                        break
+                    self._queue.put(self._extract(archive, info, name))
+        except Exception as e:  # reported by sources() in the generating thread
+            self._queue.put(e)
+        finally:
+            self._queue.put(_DONE)
+
+    def _plan(self, archive):
+        """Supported members to extract, checked against the limits before anything is written"""
+        from table_sources import is_supported
+
+        infos = archive.infolist()
+        if len(infos) > self.max_members:
+            raise ArchiveLimitError(f"Archive has {len(infos)} members, at most {self.max_members} allowed")
+        plan = []
+        names = set()
+        skipped = 0
+        for info in infos:
+            if info.is_dir():
+                continue
+            name = _member_file_name(info.filename)
+            if name is None or not is_supported(name):
+                skipped += 1
+                continue
+            if name.lower() in names:
+                self.log_callback(f"⚠️ Archive: {info.filename} skipped, a table named {name} is already extracted")
+                continue
+            if info.file_size > self.max_member_bytes:
+                raise ArchiveLimitError(f"Archive member {info.filename} is {info.file_size / 1024 ** 2:.0f} MB, "
+                                        f"limit {self.max_member_bytes / 1024 ** 2:.0f} MB")
+            names.add(name.lower())
+            plan.append((info, name))
+        declared = sum(info.file_size for info, _ in plan)
+        if declared > self.max_total_bytes:
+            raise ArchiveLimitError(f"Archive tables take {declared / 1024 ** 2:.0f} MB unpacked, "
+                                    f"limit {self.max_total_bytes / 1024 ** 2:.0f} MB")
+        free = shutil.disk_usage(self.dest_dir).free
+        if declared > free - DISK_RESERVE_BYTES:
+            raise ArchiveLimitError(f"Not enough disk space to unpack {declared / 1024 ** 2:.0f} MB of tables")
+        if skipped:
+            self.log_callback(f"⏭️ Archive: {skipped} files that are not tables skipped")
+        return plan
+
+    def _extract(self, archive, info, name):
+        """Copies one member in chunks, counting the real unpacked size; returns the extracted path"""
+        path = os.path.join(self.dest_dir, name)
+        part_path = path + ".part"
+        written = 0
+        try:
+            with archive.open(info) as src, open(part_path, "wb") as dst:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    if written > self.max_member_bytes or self.extracted_bytes + written > self.max_total_bytes:
+                        raise ArchiveLimitError(f"Archive member {info.filename} unpacks beyond the size limit")
+                    dst.write(chunk)
+            os.replace(part_path, path)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        self.extracted_bytes += written
+        self.log_callback(f"📦 Extracted {name} ({written / 1024 ** 2:.1f} MB)")
+        return path
+
+    def sources(self, main_path):
+        """Table sources (name, path, sqlite_table) as soon as their files are extracted"""
+        from table_sources import file_sources
+
+        while True:
+            item = self._queue.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield from file_sources(item, main_path)
@@ -1,7 +1,8 @@
-import pandas as pd
 from datetime import datetime
 import re
 
+# pandas імпортується ліниво: utils використовують воркери, яким pandas не потрібен
+
 
 def is_date_string(val):
     """
@@ -46,6 +47,8 @@ def is_date_string(val):
 
 def format_date(val):
     """Форматує дату в читабельний вигляд (тільки дата)"""
+    import pandas as pd
+
     if pd.isnull(val):
         return '—'
     if isinstance(val, datetime):
@@ -55,6 +58,8 @@ def format_date(val):
 
 def format_datetime(val):
     """Форматує дату з часом в читабельний вигляд"""
+    import pandas as pd
+
     if pd.isnull(val):
         return '—'
     if isinstance(val, datetime):
@@ -79,6 +84,8 @@ def dateformat(val, format_type="date"):
     {{ my_date|dateformat:"date" }} - тільки дата
     {{ my_date|dateformat:"datetime" }} - дата + час
     """
+    import pandas as pd
+
     if pd.isnull(val):
         return '—'
 
@@ -1,131 +1,303 @@
 # web_app.py
 import os
-from flask import Flask, render_template, request, send_file, redirect, url_for, flash,abort
+from flask import Flask, Request, Response, render_template, request, send_file, redirect, url_for, flash,abort
 from werkzeug.utils import secure_filename
 import shutil
 import tempfile
-from generator import generate_documents
+from worker_pool import WarmWorkerPool
+from log_pipeline import LogFile, LogPipeline
+from metrics import GenerationMetrics
+from janitor import CleanupRule, Janitor
+from session_store import SessionStore
+from upload_extract import TableArchiveExtractor
+from output_layout import OUTPUT_INDEX_FILE
+import atexit
+import io
 import threading
-import glob
-import shutil
 import time
+import uuid
+import zipfile
 
-app = Flask(__name__)
-app.secret_key = "some_secret_key"
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+# Увесь запит з файлами; більший обривається з 413 ще під час завантаження
+MAX_UPLOAD_BYTES = 2 * 1024 ** 3
+
+
+class UploadRequest(Request):
+    """Файли запиту пишуться порціями одразу на диск в UPLOAD_FOLDER (не в пам'ять і не в системний /tmp),
+    звідки save_upload переносить їх у папку задачі без копіювання"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = tempfile.NamedTemporaryFile("wb+", prefix=".upload_", dir=UPLOAD_FOLDER, delete=False)
+        self.__dict__.setdefault("upload_files", []).append(stream.name)
+        return stream
+
+
+app = Flask(__name__)
+app.secret_key = "some_secret_key"
+app.request_class = UploadRequest
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
 
 LOGS_FOLDER = "logs"
 os.makedirs(LOGS_FOLDER, exist_ok=True)
 
-sessions = {}  # session_id: {"log": log_path, "result": result_zip}
-stop_flags = {}  # session_id: threading.Event
-def background_generate(session_id, root_dir, main_path, template_path, output_dir, common_column, file_name_column):
-    log_path = os.path.join(LOGS_FOLDER, f"{session_id}.log")
+# Сесії в SQLite: /logs, /result і /stop працюють у будь-якому процесі (gunicorn -w N)
+SESSION_DB = "web_sessions.sqlite"
+session_store = SessionStore(SESSION_DB)
 
-    def log_callback(msg):
-        with open(log_path, "a", encoding="utf-8") as f:
-            f.write(msg + "\n")
+# Спільний прогрітий пул процесів для всіх сесій; воркер перезапускається після N документів
+WORKER_MAX_TASKS = 500
+worker_pool = WarmWorkerPool(max_tasks_per_child=WORKER_MAX_TASKS, log_callback=print,
+                             on_restart=lambda: generation_metrics.pool_restarts.inc())
+atexit.register(worker_pool.shutdown, wait=False)
+# Метрики для /metrics (Prometheus)
+generation_metrics = GenerationMetrics()
 
-    def stop_flag():
-        return stop_flags[session_id].is_set()
+# Фонове прибирання: папки задач, архіви результатів і журнали; квоти за віком і розміром
+JANITOR_INTERVAL = 60  # сек між проходами
+UPLOADS_MAX_AGE = 30 * 60  # сек після завершення задачі (results.zip)
+UPLOADS_MAX_BYTES = 10 * 1024 ** 3
+LOGS_MAX_AGE = 7 * 24 * 3600
+LOGS_MAX_BYTES = 500 * 1024 ** 2
+
+
+# Дані задач, що ще виконуються (у будь-якому процесі), прибиральник не чіпає
+janitor = Janitor(
+    [CleanupRule(UPLOAD_FOLDER, UPLOADS_MAX_AGE, UPLOADS_MAX_BYTES),
+     CleanupRule(LOGS_FOLDER, LOGS_MAX_AGE, LOGS_MAX_BYTES)],
+    protected=session_store.active_paths, interval=JANITOR_INTERVAL, on_remove=session_store.forget_dir)
+atexit.register(janitor.stop)
+# Ті самі формати, що й у table_sources (модуль не імпортуємо: він тягне pandas)
+MAIN_TABLE_EXTENSIONS = (".xlsx", ".csv", ".parquet", ".feather", ".sqlite", ".sqlite3", ".db")
+
+def background_generate(session_id, root_dir, main_path, template_path, output_dir, common_column, file_name_column,
+                        job_metrics, tables_zip=None):
+    # Пульс задачі оновлює окремий потік: читання таблиць, перевірка шаблонів і пакування
+    # не опитують stop_flag, а прибиральник не повинен вважати задачу завислою
+    alive = session_store.keep_alive(session_id)
+    try:
+        _generate_job(session_id, root_dir, main_path, template_path, output_dir, common_column, file_name_column,
+                      job_metrics, tables_zip)
+    finally:
+        alive.set()
+
+
+def _generate_job(session_id, root_dir, main_path, template_path, output_dir, common_column, file_name_column,
+                  job_metrics, tables_zip):
+    # Лінивий імпорт: web_app є __mp_main__ для spawn-воркерів, їм pandas не потрібен
+    from generator import generate_documents
+
+    # Журнал пишеться пачками з фонового потоку; генерація не чекає на диск
+    log_callback = LogPipeline([LogFile(os.path.join(LOGS_FOLDER, f"{session_id}.log"))])
+
+    # Зупинку може запросити інший процес: прапорець читається з бази не частіше разу на секунду
+    stop_flag = session_store.stop_flag(session_id)
 
     output_docs_dir = os.path.join(output_dir, "docs")
     os.makedirs(output_docs_dir, exist_ok=True)
 
-    generate_documents(
-        root_dir=root_dir,
-        main_path=main_path,
-        template_path=template_path,
-        output_dir=output_docs_dir,
-        common_column=common_column,
-        file_name_column=file_name_column,
-        log_callback=log_callback,
-        stop_flag=stop_flag,
-    )
-
-    # Пакуємо результати
-    result_zip = os.path.join(output_dir, "results.zip")
-    shutil.make_archive(os.path.splitext(result_zip)[0], 'zip', output_docs_dir)
-    sessions[session_id]["result"] = result_zip
-    del stop_flags[session_id]
-
-
-def clean_old_temp_dirs(base_folder="uploads", minutes=30):
-    """Видаляє всі тимчасові папки, старші за вказаний час (default: 30 хвилин)"""
-    now = time.time()
-    for dir in glob.glob(os.path.join(base_folder, "*")):
-        if os.path.isdir(dir):
-            mtime = os.path.getmtime(dir)
-            if now - mtime > minutes * 60:
-                try:
-                    shutil.rmtree(dir)
-                except Exception as e:
-                    print(f"Не вдалося видалити {dir}: {e}")
+    summary = None
+    try:
+        # Архів таблиць розпаковується паралельно з читанням основної таблиці; кожна таблиця
+        # читається, щойно її розпаковано
+        table_sources = None
+        if tables_zip:
+            extractor = TableArchiveExtractor(tables_zip, root_dir, stop_flag=stop_flag, log_callback=log_callback)
+            table_sources = extractor.start().sources(main_path)
+        summary = generate_documents(
+            root_dir=root_dir,
+            main_path=main_path,
+            template_path=template_path,
+            output_dir=output_docs_dir,
+            common_column=common_column,
+            file_name_column=file_name_column,
+            log_callback=log_callback,
+            stop_flag=stop_flag,
+            pool=worker_pool,
+            metrics=job_metrics,
+            table_sources=table_sources,
+        )
+    finally:
+        log_callback.close()
+        job_metrics.finish(summary)
+        if tables_zip:
+            try:
+                os.remove(tables_zip)  # таблиці вже розпаковано, місце на диску звільняємо
+            except OSError:
+                pass
+
+    # Пакуємо результати; лише після цього задача перестає бути активною для прибиральника
+    result_zip = None
+    try:
+        session_store.heartbeat(session_id)
+        # Індекс рядок → файл переноситься поруч із папкою docs: у results.zip лише документи
+        index_path = os.path.join(output_docs_dir, OUTPUT_INDEX_FILE)
+        if os.path.exists(index_path):
+            os.replace(index_path, os.path.join(output_dir, OUTPUT_INDEX_FILE))
+        archive_base = os.path.join(output_dir, "results")
+        archive_started = time.perf_counter()
+        result_zip = shutil.make_archive(archive_base, 'zip', output_docs_dir)
+        generation_metrics.archive_seconds.observe(time.perf_counter() - archive_started)
+    finally:
+        session_store.finish(session_id, result_zip)
+
+
+def save_upload(file_storage, path):
+    """Переносить уже записаний на диск файл запиту в папку задачі"""
+    stream = file_storage.stream
+    if getattr(stream, "name", None) and os.path.exists(stream.name):
+        stream.close()
+        os.replace(stream.name, path)
+    else:
+        file_storage.save(path)
+
+
+def save_job_files(output_dir):
+    """Зберігає файли форми в папку задачі: (root_dir, main_path, template_path, tables_zip або None)"""
+    main_file = request.files.get("main_file")
+    template_files = [f for f in request.files.getlist("template_file") if f and f.filename]
+    root_zip = request.files.get("root_zip")
+    root_dir = os.path.join(output_dir, "tables")
+    os.makedirs(root_dir, exist_ok=True)
+    # Архів лише зберігаємо: розпаковка з перевіркою розмірів — у фоні (upload_extract)
+    tables_zip = None
+    if root_zip and root_zip.filename:
+        tables_zip = os.path.join(output_dir, "tables.zip")
+        save_upload(root_zip, tables_zip)
+    # Зберігаємо файли
+    # Розширення зберігаємо: формат таблиці визначається за ним (table_sources)
+    main_ext = os.path.splitext(secure_filename(main_file.filename or ""))[1].lower()
+    if main_ext not in MAIN_TABLE_EXTENSIONS:
+        main_ext = ".xlsx"
+    main_path = os.path.join(output_dir, "main" + main_ext)
+    save_upload(main_file, main_path)
+    if len(template_files) == 1:
+        template_path = [os.path.join(output_dir, "template.docx")]
+    else:
+        # Кілька шаблонів: ім'я шаблону потрапляє в ім'я документа ({template}_{name}.docx)
+        templates_dir = os.path.join(output_dir, "templates")
+        os.makedirs(templates_dir, exist_ok=True)
+        template_path = []
+        for n, f in enumerate(template_files, 1):
+            stem = os.path.splitext(secure_filename(f.filename))[0] or f"template_{n}"
+            path = os.path.join(templates_dir, f"{stem}.docx")
+            if path in template_path:
+                path = os.path.join(templates_dir, f"{stem}_{n}.docx")
+            template_path.append(path)
+    for f, path in zip(template_files, template_path):
+        save_upload(f, path)
+
+    return root_dir, main_path, template_path, tables_zip
+
+
+@app.teardown_request
+def remove_unused_uploads(exc=None):
+    # Файли запиту, які не перенесено в папку задачі (помилка, зайві поля)
+    for path in request.__dict__.get("upload_files", ()):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    flash(f"Файли завеликі: разом не більше {MAX_UPLOAD_BYTES // 1024 ** 2} МБ", "danger")
+    return redirect(url_for("index"))
+
+
+@app.before_request
+def start_janitor():
+    # Не під час імпорту: web_app є __mp_main__ для spawn-воркерів
+    janitor.start()
+
+
 @app.route("/logs")
 def get_logs():
-    session_id = request.args.get("session_id")
-    log_path = f"logs/{session_id}.log"
-    if os.path.exists(log_path):
+    session = session_store.get(request.args.get("session_id"))
+    log_path = session and session["log"]
+    if log_path and os.path.exists(log_path):
         with open(log_path, encoding='utf-8') as f:
             return f.read()
     return ""
 @app.route("/", methods=["GET", "POST"])
 def index():
-    clean_old_temp_dirs()
     if request.method == "POST":
-        import random
-        session_id = str(int(time.time() * 1000)) + str(random.randint(100,999))
+        # Унікальний і між процесами
+        session_id = uuid.uuid4().hex
         output_dir = tempfile.mkdtemp(dir=UPLOAD_FOLDER)
-        main_file = request.files.get("main_file")
-        template_file = request.files.get("template_file")
-        root_zip = request.files.get("root_zip")
-        root_dir = os.path.join(output_dir, "tables")
-        os.makedirs(root_dir, exist_ok=True)
-        if root_zip and root_zip.filename:
-            import zipfile
-            root_zip.seek(0)
-            with zipfile.ZipFile(root_zip, "r") as zip_ref:
-                zip_ref.extractall(root_dir)
+        root_dir, main_path, template_path, tables_zip = save_job_files(output_dir)
         common_column = request.form.get("common_column", "id")
         file_name_column = request.form.get("file_name_column", "id")
 
-        # Зберігаємо файли
-        main_path = os.path.join(output_dir, "main.xlsx")
-        template_path = os.path.join(output_dir, "template.docx")
-        main_file.save(main_path)
-        template_file.save(template_path)
-
         # Сесія
-        sessions[session_id] = {"log": os.path.join(LOGS_FOLDER, f"{session_id}.log"), "result": None}
-        stop_flags[session_id] = threading.Event()
+        session_store.create(session_id, output_dir, os.path.join(LOGS_FOLDER, f"{session_id}.log"))
         # Генерація у фоні
-        t = threading.Thread(target=background_generate, args=(session_id, root_dir, main_path, template_path, output_dir, common_column, file_name_column))
+        t = threading.Thread(target=background_generate, args=(session_id, root_dir, main_path, template_path, output_dir, common_column, file_name_column, generation_metrics.job(), tables_zip))
         t.start()
 
         return redirect(url_for("progress", session_id=session_id))
     return render_template("index.html", logs=None, download_link=None)
 @app.route("/logs/<session_id>")
 def logs(session_id):
-    log_path = sessions.get(session_id, {}).get("log")
+    session = session_store.get(session_id)
+    log_path = session and session["log"]
     if not log_path or not os.path.exists(log_path):
         return ""
     with open(log_path, encoding="utf-8") as f:
         return f.read()
 @app.route("/stop/<session_id>", methods=["POST"])
 def stop(session_id):
-    if session_id in stop_flags:
-        stop_flags[session_id].set()
+    if session_store.request_stop(session_id):
         return "OK"
     return "Not found", 404
 
 
 @app.route("/result/<session_id>")
 def result(session_id):
-    result_zip = sessions.get(session_id, {}).get("result")
+    session = session_store.get(session_id)
+    result_zip = session and session["result"]
     if not result_zip or not os.path.exists(result_zip):
         return "Not ready", 404
     return send_file(result_zip, as_attachment=True)
+@app.route("/preview", methods=["POST"])
+def preview():
+    # Один рядок (row, з 0, як у журналі) тими самими шаблоном і таблицями, що й генерація; format=pdf - у PDF.
+    # Таблиці кешуються в процесі, тож наступні перегляди - за частки секунди.
+    # Лінивий імпорт, як і generator: pandas не потрібен spawn-воркерам
+    from preview import PreviewError, render_preview
+
+    if not request.files.get("main_file") or not any(f.filename for f in request.files.getlist("template_file")):
+        return {"error": "Потрібні основна таблиця і шаблон"}, 400
+    row = request.form.get("row", 0, type=int)
+    pdf = request.form.get("format", "docx") == "pdf"
+    output_dir = tempfile.mkdtemp(prefix="preview_", dir=UPLOAD_FOLDER)
+    try:
+        root_dir, main_path, template_path, tables_zip = save_job_files(output_dir)
+        table_sources = None
+        if tables_zip:
+            table_sources = list(TableArchiveExtractor(tables_zip, root_dir).start().sources(main_path))
+        files = render_preview(root_dir, main_path, template_path, row, os.path.join(output_dir, "docs"),
+                               request.form.get("common_column", "id"), request.form.get("file_name_column", "id"),
+                               table_sources=table_sources, pdf=pdf)
+        # Файли читаються в пам'ять: папку перегляду видаляємо одразу
+        if len(files) == 1:
+            with open(files[0], "rb") as f:
+                data = io.BytesIO(f.read())
+            return send_file(data, as_attachment=True, download_name=os.path.basename(files[0]))
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, "w") as archive:
+            for path in files:
+                archive.write(path, os.path.basename(path))
+        data.seek(0)
+        return send_file(data, as_attachment=True, download_name=f"preview_row_{row}.zip")
+    except (PreviewError, ValueError) as e:
+        return {"error": str(e)}, 400
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
 @app.route('/download/')
 def download_file():
     temp_path = request.args.get("temp_path")
@@ -155,7 +327,7 @@ def faq():
             "a": """
             <ul>
               <li><b>main.xlsx</b> – основна таблиця (кожен рядок = один документ)</li>
-              <li>Інші .xlsx – додаткові таблиці (деталі, списки)</li>
+              <li>Інші .xlsx / .csv / .parquet / .feather / .sqlite – додаткові таблиці (деталі, списки)</li>
               <li><b>template.docx</b> – Word-шаблон із змінними Jinja2</li>
               <li><i>config.yaml</i> – (необовʼязково) для швидкого запуску</li>
             </ul>
@@ -218,8 +390,26 @@ def faq():
     ]
 
     return render_template("faq.html", faqs=faqs)
+@app.route("/health")
+def health():
+    worker_pool.get_executor()
+    if worker_pool.health_check():
+        return {"status": "ok", "workers": worker_pool.max_workers, "restarts": worker_pool.restarts}
+    return {"status": "unavailable", "restarts": worker_pool.restarts}, 503
+
+
+@app.route("/metrics")
+def metrics():
+    # Розмір папок — з останнього проходу прибиральника, без сканування диска в запиті
+    for folder, size in janitor.usage.items():
+        generation_metrics.temp_dir_bytes.set(size, folder=folder)
+    text = generation_metrics.render(pool_workers=worker_pool.max_workers)
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+
 @app.route("/progress/<session_id>")
 def progress(session_id):
     return render_template("progress.html", session_id=session_id)
 if __name__ == '__main__':
+    worker_pool.warm_up_async()
     app.run(debug=True, port=8080)
@@ -0,0 +1,302 @@
+# worker_pool.py - Довгоживучий пул процесів, спільний для кількох запусків генерації
+import multiprocessing
+import sys
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+def _warmup_worker():
+    """Imports the rendering stack in a worker so the first real task starts fast"""
+    from render_worker import preload
+    return preload()
+
+
+class CancelFlags:
+    """
+    Per-run cancel flags in shared memory. Workers inherit the array when they
+    start (initializer) and check their run's slot between documents and stages,
+    so one stopped run does not affect other runs sharing the pool.
+    """
+
+    SLOTS = 64
+
+    def __init__(self, mp_context):
+        self.flags = mp_context.RawArray('b', self.SLOTS)
+        self._free = list(range(self.SLOTS))
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if not self._free:
+                raise RuntimeError("Too many concurrent generation runs")
+            slot = self._free.pop()
+            self.flags[slot] = 0
+            return slot
+
+    def release(self, slot):
+        with self._lock:
+            self.flags[slot] = 0
+            self._free.append(slot)
+
+    def cancel(self, slot):
+        self.flags[slot] = 1
+
+
+class BusyWorkers:
+    """
+    Which worker renders which row, in shared memory: workers write their pid
+    to the entry of (cancel slot, row index) while rendering it, so the parent
+    can kill the one worker stuck on an overdue row instead of the whole pool.
+    """
+
+    ROWS_PER_SLOT = 1024  # rows of one run in flight at once map to distinct entries
+
+    def __init__(self, mp_context):
+        self.pids = mp_context.RawArray('i', CancelFlags.SLOTS * self.ROWS_PER_SLOT)
+
+    @classmethod
+    def entry(cls, slot, index):
+        return slot * cls.ROWS_PER_SLOT + index % cls.ROWS_PER_SLOT
+
+    def pid(self, slot, index):
+        return self.pids[self.entry(slot, index)]
+
+
+class WarmWorkerPool:
+    """
+    Pre-warmed ProcessPoolExecutor owned by the application and reused across runs
+    of generate_documents, so spawned workers import the render stack only once.
+
+    max_workers: pool size, by default the autoscaling ceiling (generator.get_max_workers);
+    each run starts at get_optimal_workers() documents in flight and scales up to it.
+    max_tasks_per_child: recycle a worker after N documents to bound its memory
+    (Python 3.11+, ignored on older versions).
+    on_restart: called after every restart of the executor (e.g. a metrics counter)
+    """
+
+    def __init__(self, max_workers=None, max_tasks_per_child=None, log_callback=None, on_restart=None):
+        self._max_workers = max_workers
+        self.max_tasks_per_child = max_tasks_per_child
+        self.log_callback = log_callback or (lambda message: None)
+        self.on_restart = on_restart
+        self._executor = None
+        self._lock = threading.RLock()
+        self.restarts = 0
+        self.active_runs = 0
+        self._mp_context = None
+        self.cancel_flags = None
+        self.timeout_queue = None
+        self.busy_workers = None
+        self._timed_out = {}  # cancel slot -> row indexes killed by the watchdog
+        # Executors that broke because a worker was killed for a timeout (of any run)
+        self._timeout_breaks = weakref.WeakSet()
+        self._timeout_kills = False  # a worker of the current executor was killed for a timeout
+
+    @property
+    def max_workers(self):
+        # Resolved lazily: this module is imported by __mp_main__ in spawned
+        # workers, which must not pull in generator/pandas
+        if not self._max_workers:
+            from generator import get_max_workers
+            self._max_workers = get_max_workers()
+        return self._max_workers
+
+    def _create_executor(self):
+        from render_worker import init_worker
+
+        if self._mp_context is None:
+            self._mp_context = multiprocessing.get_context()
+            if self.max_tasks_per_child:
+                if sys.version_info < (3, 11):
+                    self.log_callback("⚠️ Worker recycling requires Python 3.11+, option ignored")
+                    self.max_tasks_per_child = None
+                # Recycling is not supported with 'fork'
+                elif self._mp_context.get_start_method() == "fork":
+                    self._mp_context = multiprocessing.get_context("spawn")
+            self.cancel_flags = CancelFlags(self._mp_context)
+            self.timeout_queue = self._mp_context.SimpleQueue()
+            self.busy_workers = BusyWorkers(self._mp_context)
+
+        kwargs = {"max_workers": self.max_workers, "mp_context": self._mp_context,
+                  "initializer": init_worker,
+                  "initargs": (self.cancel_flags.flags, self.timeout_queue, self.busy_workers.pids)}
+        if self.max_tasks_per_child:
+            kwargs["max_tasks_per_child"] = self.max_tasks_per_child
+        return ProcessPoolExecutor(**kwargs)
+
+    def get_executor(self):
+        """Returns the running executor, starting it if needed"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._create_executor()
+            return self._executor
+
+    def warm_up(self):
+        """Starts all workers and imports the rendering stack in each of them"""
+        started = time.time()
+        executor = self.get_executor()
+        futures = [executor.submit(_warmup_worker) for _ in range(self.max_workers)]
+        pids = set()
+        import_times = []
+        for future in futures:
+            try:
+                pid, import_seconds = future.result()
+                pids.add(pid)
+                import_times.append(import_seconds)
+            except BrokenProcessPool as e:
+                self.log_callback(f"❌ Worker pool failed to start: {e}")
+                self.restart_if_broken(executor)
+                return False
+        self.log_callback(
+            f"🔥 Worker pool warmed up: {len(pids)} processes in {time.time() - started:.1f} sec "
+            f"(render stack import max {max(import_times, default=0) * 1000:.0f} ms)")
+        return True
+
+    def warm_up_async(self):
+        """Warms the pool in a background thread (does not block the UI)"""
+        thread = threading.Thread(target=self.warm_up, daemon=True)
+        thread.start()
+        return thread
+
+    def health_check(self):
+        """
+        Returns True if the executor is running and none of its workers died.
+        Judged from process state only: a ping would queue behind the documents
+        of other runs and time out on a busy pool.
+        """
+        executor = self._executor
+        if executor is None or getattr(executor, "_broken", False):
+            return False
+        # A worker recycled by max_tasks_per_child exits with 0 before it is replaced
+        processes = list((getattr(executor, "_processes", None) or {}).values())
+        return all(process.exitcode in (None, 0) for process in processes)
+
+    def ensure_healthy(self):
+        """
+        Restarts a broken pool when no run uses it; returns the executor. With
+        active runs the pool is left alone: they replace a broken executor
+        themselves (restart_if_broken) and resubmit their documents.
+        """
+        healthy = self.health_check()
+        with self._lock:
+            if self._executor is not None and not healthy and self.active_runs == 0:
+                self.log_callback("⚠️ Worker pool is unhealthy, restarting...")
+                self.restart()
+            return self.get_executor()
+
+    def begin_run(self):
+        """Registers a generation run; returns its cancel slot"""
+        with self._lock:
+            self.get_executor()
+            self.active_runs += 1
+            return self.cancel_flags.acquire()
+
+    def end_run(self, slot):
+        with self._lock:
+            self.active_runs -= 1
+            self._timed_out.pop(slot, None)
+            self.cancel_flags.release(slot)
+
+    def mark_timed_out(self, slot, index):
+        """Records a row whose worker was killed by the parent as timed out"""
+        with self._lock:
+            self._timed_out.setdefault(slot, set()).add(index)
+            self._timeout_kills = True
+
+    def _drain_timeouts(self):
+        # Called before the executor is replaced: everything queued so far came from its workers
+        while not self.timeout_queue.empty():
+            timed_out_slot, index = self.timeout_queue.get()
+            self._timed_out.setdefault(timed_out_slot, set()).add(index)
+            self._timeout_kills = True
+
+    def collect_timeouts(self, slot):
+        """Returns (and forgets) the rows of a run that hit the per-document timeout"""
+        with self._lock:
+            self._drain_timeouts()
+            return self._timed_out.pop(slot, set())
+
+    def broke_on_timeout(self, executor):
+        """
+        True if executor broke because a worker was killed for a timeout, in any
+        run: the other documents it was rendering are collateral, not crashes.
+        """
+        with self._lock:
+            self._drain_timeouts()
+            if executor is self._executor:
+                return self._timeout_kills
+            return executor in self._timeout_breaks
+
+    def kill_worker(self, slot, index):
+        """
+        Terminates only the worker rendering row `index` of the run (fallback
+        when its watchdog cannot fire); returns True if a worker was killed.
+        The executor still breaks and is replaced (restart_if_broken).
+        """
+        with self._lock:
+            pid = self.busy_workers.pid(slot, index) if self.busy_workers else 0
+            process = (getattr(self._executor, "_processes", None) or {}).get(pid)
+            if not pid or process is None or not process.is_alive():
+                return False
+            self.mark_timed_out(slot, index)
+            process.terminate()
+            return True
+
+    def busy_worker_pids(self, slot, indexes):
+        """PIDs of the live workers rendering these rows of the run (not idle workers, not other runs)"""
+        with self._lock:
+            processes = getattr(self._executor, "_processes", None) or {}
+            pids = {self.busy_workers.pid(slot, index) for index in indexes} if self.busy_workers else set()
+            return [pid for pid in pids if pid in processes and processes[pid].is_alive()]
+
+    def restart_if_broken(self, executor):
+        """Replaces a broken executor once, even if several runs notice it"""
+        with self._lock:
+            if self._executor is executor:
+                self.log_callback("♻️ Worker process died, restarting the pool...")
+                self.restart()
+            return self.get_executor()
+
+    def cancel_run(self, slot):
+        """Asks workers to drop the run's remaining documents at the next check point"""
+        self.cancel_flags.cancel(slot)
+
+    def terminate_workers(self, restart=True, join_timeout=5):
+        """Hard-kills all worker processes; with restart=True starts a fresh (cold) executor"""
+        with self._lock:
+            executor = self._executor
+            processes = list((getattr(executor, "_processes", None) or {}).values())
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            for process in processes:
+                process.join(join_timeout)
+            if restart:
+                return self.restart()
+            self.shutdown(wait=False)
+
+    def restart(self):
+        """Tears down the current workers and starts a fresh executor"""
+        with self._lock:
+            if self._executor is not None:
+                if self.timeout_queue is not None:
+                    self._drain_timeouts()
+                if self._timeout_kills:
+                    self._timeout_breaks.add(self._executor)
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._timeout_kills = False
+            self._executor = self._create_executor()
+            self.restarts += 1
+            if self.on_restart:
+                self.on_restart()
+            return self._executor
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+                self._executor = None
+            self._timeout_kills = False